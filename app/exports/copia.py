@@ -0,0 +1,263 @@
+import logging
+import queue
+import threading
+import zlib
+from typing import Iterator
+
+from sqlalchemy import text
+
+from app.searchs.registro import iter_registers, sql_registros_filtrados
+from core.database import engine, motor_lectura, sesion_lectura
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional: pip install pyarrow
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Exportación masiva (CSV / NDJSON / Parquet)
+# ------------------------------------------------------------------
+# CSV y NDJSON salen de Postgres con COPY (...) TO STDOUT: el servidor arma
+# el texto y Python solo pasa bytes, sin crear un objeto por fila. COPY es
+# bloqueante (copy_expert escribe en un "archivo"), así que corre en un hilo
+# que deja bloques de ~64 KB en una cola acotada; el generador de la
+# respuesta los va entregando. Si el cliente es lento, la cola se llena y
+# COPY espera: la memoria queda acotada a _BLOQUES_EN_COLA * _TAMANO_BLOQUE.
+#
+# Parquet no existe como formato de COPY: se lee con el cursor del servidor
+# (iter_registers) y cada lote se escribe como un row group.
+
+FORMATOS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+_TAMANO_BLOQUE = 64 * 1024
+_BLOQUES_EN_COLA = 16
+_FILAS_POR_ROW_GROUP = 50_000
+# Cada cuánto el consumidor revisa que el hilo del COPY siga vivo
+_ESPERA_COLA = 1.0
+_FIN = object()
+
+
+def parquet_disponible() -> bool:
+    return pa is not None
+
+
+def _sql_copy(cursor, formato: str, filtros: dict) -> str:
+    """
+    COPY no admite parámetros: el SELECT se compila con el dialecto de
+    SQLAlchemy y los valores se incrustan con mogrify (escapado de psycopg2).
+    """
+    sql, params = sql_registros_filtrados(**filtros)
+    compilado = text(sql).bindparams(**params).compile(dialect=engine.dialect)
+    select = cursor.mogrify(compilado.string, compilado.params).decode("utf-8")
+
+    if formato == "csv":
+        return f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+    # NDJSON: una línea row_to_json por fila. En FORMAT csv con comilla y
+    # delimitador que JSON nunca contiene sin escapar (\x01, \x02), COPY
+    # deja cada valor tal cual (en FORMAT text duplicaría las '\').
+    return (
+        f"COPY (SELECT row_to_json(t)::text FROM ({select}) t) TO STDOUT "
+        f"WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+    )
+
+
+class _Cancelado(Exception):
+    pass
+
+
+class _EscritorCola:
+    """
+    "Archivo" para copy_expert: agrupa lo que escribe COPY en bloques y los
+    pone en la cola (bloquea si el cliente va atrasado).
+    """
+
+    def __init__(self, cola: queue.Queue, cancelado: threading.Event):
+        self._cola = cola
+        self._cancelado = cancelado
+        self._buffer = bytearray()
+
+    def write(self, datos) -> int:
+        if self._cancelado.is_set():
+            raise _Cancelado()
+        self._buffer += datos.encode("utf-8") if isinstance(datos, str) else datos
+        if len(self._buffer) >= _TAMANO_BLOQUE:
+            self.flush()
+        return len(datos)
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        bloque = bytes(self._buffer)
+        self._buffer.clear()
+        self.entregar(bloque)
+
+    def entregar(self, elemento) -> None:
+        while not self._cancelado.is_set():
+            try:
+                self._cola.put(elemento, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise _Cancelado()
+
+
+def _ejecutar_copy(formato: str, filtros: dict, cola: queue.Queue, cancelado: threading.Event, lsn_minimo: str = None) -> None:
+    escritor = _EscritorCola(cola, cancelado)
+    conexion = None
+    valida = True
+    try:
+        # Réplica de lectura si está disponible (y al día con 'lsn_minimo').
+        # Dentro del try: si no hay conexión (pool agotado, réplica caída)
+        # el error también llega a la cola y la descarga no queda colgada.
+        conexion = motor_lectura(lsn_minimo).raw_connection()
+        cursor = conexion.cursor()
+        cursor.copy_expert(_sql_copy(cursor, formato, filtros), escritor)
+        escritor.flush()
+        cursor.close()
+        conexion.rollback()
+        escritor.entregar(_FIN)
+    except _Cancelado:
+        # El cliente cortó la descarga: la conexión pudo quedar a mitad de un COPY
+        valida = False
+    except Exception as e:
+        valida = False
+        logger.error(f"Error durante el COPY de exportación ({formato}): {str(e)}")
+        try:
+            escritor.entregar(e)
+        except _Cancelado:
+            pass
+    finally:
+        if conexion is not None:
+            if valida:
+                conexion.close()
+            else:
+                conexion.invalidate()
+
+
+def _comprimir(bloques: Iterator[bytes]) -> Iterator[bytes]:
+    # wbits=31: contenedor gzip (no zlib crudo), descomprimible con gunzip
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for bloque in bloques:
+        comprimido = compresor.compress(bloque)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+
+def exportar_copy(formato: str, comprimir: bool = False, lsn_minimo: str = None, **filtros) -> Iterator[bytes]:
+    """
+    Bytes de la exportación CSV/NDJSON por COPY TO STDOUT, opcionalmente gzip.
+    """
+    cola = queue.Queue(maxsize=_BLOQUES_EN_COLA)
+    cancelado = threading.Event()
+    hilo = threading.Thread(
+        target=_ejecutar_copy,
+        args=(formato, filtros, cola, cancelado, lsn_minimo),
+        name=f"copy-{formato}",
+        daemon=True
+    )
+
+    def bloques():
+        hilo.start()
+        try:
+            while True:
+                try:
+                    bloque = cola.get(timeout=_ESPERA_COLA)
+                except queue.Empty:
+                    if hilo.is_alive():
+                        continue
+                    # Pudo entregar justo antes de terminar
+                    try:
+                        bloque = cola.get_nowait()
+                    except queue.Empty:
+                        raise RuntimeError("El hilo del COPY terminó sin completar la exportación")
+                if bloque is _FIN:
+                    return
+                if isinstance(bloque, Exception):
+                    # Los encabezados ya se enviaron: solo queda cortar la descarga
+                    raise bloque
+                yield bloque
+        finally:
+            cancelado.set()
+
+    return _comprimir(bloques()) if comprimir else bloques()
+
+
+class _Sumidero:
+    """
+    Archivo de solo escritura para ParquetWriter: acumula lo escrito hasta
+    que el generador lo entrega.
+    """
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, datos) -> int:
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._posicion
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def _esquema_parquet():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("codigo_estudiante", pa.string()),
+        ("nombre", pa.string()),
+        ("grado", pa.string()),
+        ("tipo_alimentacion", pa.string()),
+        ("fecha_hora", pa.timestamp("us")),
+        ("plan", pa.string()),
+        ("estado", pa.string()),
+    ])
+
+
+def exportar_parquet(**filtros) -> Iterator[bytes]:
+    """
+    Bytes de un Parquet (zstd) con un row group por lote del cursor del servidor.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow no está instalado")
+
+    esquema = _esquema_parquet()
+    columnas = esquema.names
+
+    db = sesion_lectura()
+    try:
+        sumidero = _Sumidero()
+        escritor = pq.ParquetWriter(sumidero, esquema, compression="zstd")
+        for lote in iter_registers(db, batch_size=_FILAS_POR_ROW_GROUP, **filtros):
+            tabla = pa.Table.from_pydict(
+                {columna: [fila[columna] for fila in lote] for columna in columnas},
+                schema=esquema
+            )
+            escritor.write_table(tabla)
+            yield sumidero.vaciar()
+        escritor.close()
+        yield sumidero.vaciar()
+    finally:
+        db.close()
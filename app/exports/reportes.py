@@ -0,0 +1,359 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from threading import Lock, get_ident
+import hashlib
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.exports.copia import exportar_copy
+from app.exports.xlsx import ENCABEZADOS_REGISTROS, fila_registro, generar_xlsx
+from app.searchs.registro import _filtros_registros, contar_registros, iter_registers
+from core.config import settings
+from core.database import sesion_lectura
+from core.etag import version_recursos
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Reportes en segundo plano con caché en disco
+# ------------------------------------------------------------------
+# POST /registro/reportes encola el reporte y responde de inmediato con un
+# id; un pool acotado de hilos (REPORTES_WORKERS) arma el archivo en
+# REPORTES_DIR y GET /registro/reportes/{id} informa el progreso.
+#
+# El id es un hash de formato + filtros + una marca de los datos del rango
+# pedido: dos personas pidiendo el mismo mes reciben el mismo id y comparten
+# el archivo. La marca sale del rollup diario (consumo_diario_caf, al día por
+# trigger) de las fechas del filtro, más la versión del roster (nombre y
+# grado salen de estudiantes_caf): un registro nuevo, borrado o que cambia de
+# estado DENTRO del rango cambia el id; las escrituras de otros días (p. ej.
+# los inserts diarios del scheduler) no tocan los reportes de meses cerrados.
+# Un cambio que no mueve ningún conteo del rollup (solo la hora de un
+# registro, por ejemplo) no cambia el id hasta que el reporte expira.
+#
+# El estado de cada trabajo (PENDIENTE, EN_PROCESO, LISTO, ERROR) se escribe
+# en un .json junto al archivo, en REPORTES_DIR, y el worker que lo genera
+# lo refresca cada _LATIDO_SEGUNDOS: cualquier worker que comparta el disco
+# informa el progreso, no duplica un trabajo en curso y sirve el resultado.
+# Un .json en curso sin latido por _ABANDONADO_SEGUNDOS (el worker murió) se
+# informa como ERROR y la siguiente solicitud lo vuelve a encolar.
+
+PENDIENTE = "PENDIENTE"
+EN_PROCESO = "EN_PROCESO"
+LISTO = "LISTO"
+ERROR = "ERROR"
+
+_LATIDO_SEGUNDOS = 5
+_ABANDONADO_SEGUNDOS = 300
+
+EXTENSIONES = {"xlsx": "xlsx", "csv": "csv", "ndjson": "ndjson"}
+
+MEDIA_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class ColaLlena(Exception):
+    pass
+
+
+def _serializar(valor):
+    return valor.isoformat() if isinstance(valor, (date, datetime)) else valor
+
+
+def marca_datos(db: Session, filtros: dict) -> dict:
+    """
+    Huella del rollup diario en las fechas del filtro (con el mismo día de
+    holgura que _filtros_registros) y versión del roster.
+    """
+    desde = hasta = None
+    if filtros.get("fecha_inicio") and filtros.get("fecha_fin"):
+        desde = filtros["fecha_inicio"] - timedelta(days=1)
+        hasta = filtros["fecha_fin"] + timedelta(days=1)
+
+    fila = db.execute(text("""
+        SELECT
+            COUNT(*) AS renglones,
+            COALESCE(SUM(total), 0) AS total,
+            md5(COALESCE(string_agg(
+                concat_ws('|', fecha, plan, estado, grado, tipo_alimentacion, total), ','
+                ORDER BY fecha, plan, estado, grado, tipo_alimentacion
+            ), '')) AS huella
+        FROM public.consumo_diario_caf
+        WHERE (CAST(:desde AS date) IS NULL OR fecha >= CAST(:desde AS date))
+          AND (CAST(:hasta AS date) IS NULL OR fecha <= CAST(:hasta AS date))
+    """), {"desde": desde, "hasta": hasta}).mappings().one()
+
+    return {
+        **fila,
+        "estudiantes": version_recursos(db, ("estudiantes",))["estudiantes"]
+    }
+
+
+def preparar_reporte(db: Session, formato: str, filtros: dict) -> tuple:
+    """
+    (id, total_estimado) para una solicitud. Corre con la sesión del request
+    (ver core.database.run_db): solo lee la marca de los datos del rango y
+    la estimación del total.
+    """
+    base = json.dumps(
+        {
+            "formato": formato,
+            "filtros": {clave: _serializar(valor) for clave, valor in sorted(filtros.items())},
+            "datos": marca_datos(db, filtros)
+        },
+        sort_keys=True
+    )
+    id_reporte = hashlib.sha256(base.encode("utf-8")).hexdigest()[:32]
+
+    where_clause, params = _filtros_registros(**filtros)
+    total_estimado, _ = contar_registros(db, where_clause, params)
+    return id_reporte, total_estimado
+
+
+class TrabajoReporte:
+
+    def __init__(self, id_reporte: str, formato: str, filtros: dict, total_estimado: int, lsn: str = None):
+        self.id = id_reporte
+        self.formato = formato
+        self.filtros = filtros
+        self.total_estimado = total_estimado
+        # Posición del WAL del primario al solicitarlo (None sin réplica)
+        self.lsn = lsn
+        self.estado = PENDIENTE
+        self.filas = 0
+        self.bytes = 0
+        self.error = None
+        self.creado = datetime.now()
+        self.iniciado = None
+        self.terminado = None
+
+    def como_dict(self) -> dict:
+        progreso = None
+        if self.estado == LISTO:
+            progreso = 100
+        elif self.total_estimado and self.filas:
+            # El total es una estimación del planificador: nunca decir 100 antes de tiempo
+            progreso = min(99, round(self.filas * 100 / self.total_estimado))
+        return {
+            "id": self.id,
+            "formato": self.formato,
+            "estado": self.estado,
+            "progreso": progreso,
+            "filas": self.filas,
+            "total_estimado": self.total_estimado,
+            "bytes": self.bytes,
+            "filtros": {clave: _serializar(valor) for clave, valor in self.filtros.items()},
+            "error": self.error,
+            "creado": self.creado.isoformat(),
+            "iniciado": self.iniciado.isoformat() if self.iniciado else None,
+            "terminado": self.terminado.isoformat() if self.terminado else None
+        }
+
+
+class GestorReportes:
+
+    def __init__(self, directorio: str, workers: int, max_pendientes: int):
+        self.directorio = directorio
+        self.workers = workers
+        self.max_pendientes = max_pendientes
+        self._trabajos = {}
+        self._lock = Lock()
+        self._executor = None
+        self._ultimo_latido = 0.0
+
+    # -- Archivos ------------------------------------------------------
+    def _ruta(self, id_reporte: str, formato: str) -> str:
+        return os.path.join(self.directorio, f"{id_reporte}.{EXTENSIONES[formato]}")
+
+    def _ruta_meta(self, id_reporte: str) -> str:
+        return os.path.join(self.directorio, f"{id_reporte}.json")
+
+    def _leer_meta(self, id_reporte: str):
+        """
+        Estado compartido del reporte (de este u otro worker), o None.
+        """
+        ruta_meta = self._ruta_meta(id_reporte)
+        try:
+            with open(ruta_meta, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            modificado = os.path.getmtime(ruta_meta)
+        except (OSError, ValueError):
+            return None
+
+        if meta["estado"] == LISTO:
+            return meta if os.path.exists(self._ruta(id_reporte, meta["formato"])) else None
+        if meta["estado"] in (PENDIENTE, EN_PROCESO) and time.time() - modificado > _ABANDONADO_SEGUNDOS:
+            return {**meta, "estado": ERROR, "error": "El worker que generaba el reporte dejó de responder"}
+        return meta
+
+    def _escribir_meta(self, trabajo: TrabajoReporte) -> None:
+        # Reemplazo atómico: quien lee nunca ve un .json a medias
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta_meta = self._ruta_meta(trabajo.id)
+        temporal = f"{ruta_meta}.{os.getpid()}.{get_ident()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(trabajo.como_dict(), f)
+        os.replace(temporal, ruta_meta)
+
+    def _latido(self) -> None:
+        """
+        Refresca el .json de los trabajos en cola o en curso de este worker
+        (progreso y prueba de vida), como mucho cada _LATIDO_SEGUNDOS.
+        """
+        ahora = time.monotonic()
+        if ahora - self._ultimo_latido < _LATIDO_SEGUNDOS:
+            return
+        self._ultimo_latido = ahora
+        with self._lock:
+            activos = [t for t in self._trabajos.values() if t.estado in (PENDIENTE, EN_PROCESO)]
+        for trabajo in activos:
+            try:
+                self._escribir_meta(trabajo)
+            except OSError as e:
+                logger.warning(f"⚠️ No se pudo actualizar el estado del reporte {trabajo.id}: {e}")
+
+    # -- API -----------------------------------------------------------
+    def solicitar(self, id_reporte: str, formato: str, filtros: dict, total_estimado: int, lsn: str = None) -> dict:
+        """
+        Devuelve el estado del reporte: desde la caché en disco, el trabajo
+        en curso con el mismo id o uno nuevo encolado. Con 'lsn' el reporte
+        se lee de la réplica solo si ya llegó a esa posición del WAL.
+        """
+        meta = self._leer_meta(id_reporte)
+        if meta is not None and meta["estado"] == LISTO:
+            return {**meta, "desde_cache": True}
+
+        with self._lock:
+            trabajo = self._trabajos.get(id_reporte)
+            if trabajo is not None and trabajo.estado != ERROR:
+                return {**trabajo.como_dict(), "desde_cache": False}
+            if meta is not None and meta["estado"] in (PENDIENTE, EN_PROCESO):
+                # En cola o en curso en otro worker
+                return {**meta, "desde_cache": False}
+
+            pendientes = sum(1 for t in self._trabajos.values() if t.estado in (PENDIENTE, EN_PROCESO))
+            if pendientes >= self.max_pendientes:
+                raise ColaLlena(f"Hay {pendientes} reportes en cola; intente más tarde")
+
+            if self._executor is None:
+                os.makedirs(self.directorio, exist_ok=True)
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reporte")
+
+            trabajo = TrabajoReporte(id_reporte, formato, filtros, total_estimado, lsn)
+            self._trabajos[id_reporte] = trabajo
+            self._escribir_meta(trabajo)
+            self._executor.submit(self._generar, trabajo)
+            return {**trabajo.como_dict(), "desde_cache": False}
+
+    def consultar(self, id_reporte: str):
+        with self._lock:
+            trabajo = self._trabajos.get(id_reporte)
+        if trabajo is not None:
+            return trabajo.como_dict()
+        return self._leer_meta(id_reporte)
+
+    def archivo(self, id_reporte: str):
+        """
+        (ruta, formato) del reporte terminado, o None.
+        """
+        meta = self._leer_meta(id_reporte)
+        if meta is None or meta["estado"] != LISTO:
+            return None
+        return self._ruta(id_reporte, meta["formato"]), meta["formato"]
+
+    def limpiar(self, horas: float) -> int:
+        """
+        Borra archivos y metadatos con más de 'horas' de antigüedad.
+        """
+        if not os.path.isdir(self.directorio):
+            return 0
+        limite = time.time() - horas * 3600
+        borrados = 0
+        for nombre in os.listdir(self.directorio):
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+                    borrados += 1
+            except OSError:
+                continue
+        with self._lock:
+            for id_reporte in [
+                i for i, t in self._trabajos.items()
+                if t.terminado and t.terminado.timestamp() < limite
+            ]:
+                del self._trabajos[id_reporte]
+        return borrados
+
+    # -- Worker --------------------------------------------------------
+    def _bloques(self, trabajo: TrabajoReporte, db: Session):
+        if trabajo.formato == "xlsx":
+            def filas():
+                for lote in iter_registers(db, **trabajo.filtros):
+                    trabajo.filas += len(lote)
+                    yield [fila_registro(row) for row in lote]
+            return generar_xlsx("Registros Filtrados", ENCABEZADOS_REGISTROS, filas())
+
+        # CSV / NDJSON: COPY TO STDOUT; el avance se cuenta en líneas
+        def contar(bloques):
+            for bloque in bloques:
+                trabajo.filas += bloque.count(b"\n")
+                yield bloque
+            if trabajo.formato == "csv" and trabajo.filas:
+                trabajo.filas -= 1  # encabezado
+        return contar(exportar_copy(trabajo.formato, lsn_minimo=trabajo.lsn, **trabajo.filtros))
+
+    def _generar(self, trabajo: TrabajoReporte) -> None:
+        trabajo.estado = EN_PROCESO
+        trabajo.iniciado = datetime.now()
+        ruta = self._ruta(trabajo.id, trabajo.formato)
+        temporal = f"{ruta}.{os.getpid()}.parcial"
+        db = sesion_lectura(trabajo.lsn)
+        try:
+            self._escribir_meta(trabajo)
+            with open(temporal, "wb") as f:
+                for bloque in self._bloques(trabajo, db):
+                    f.write(bloque)
+                    trabajo.bytes += len(bloque)
+                    self._latido()
+
+            # El archivo aparece completo o no aparece
+            os.replace(temporal, ruta)
+            trabajo.terminado = datetime.now()
+            trabajo.estado = LISTO
+
+            self._escribir_meta(trabajo)
+
+            logger.info(
+                f"📄 Reporte {trabajo.id} ({trabajo.formato}) listo: {trabajo.filas} filas, "
+                f"{(trabajo.terminado - trabajo.iniciado).total_seconds():.1f} s"
+            )
+
+        except Exception as e:
+            trabajo.estado = ERROR
+            trabajo.error = str(e)
+            trabajo.terminado = datetime.now()
+            logger.error(f"Error al generar el reporte {trabajo.id}: {e}")
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            try:
+                self._escribir_meta(trabajo)
+            except OSError as e_meta:
+                logger.warning(f"⚠️ No se pudo guardar el error del reporte {trabajo.id}: {e_meta}")
+        finally:
+            db.close()
+
+
+gestor_reportes = GestorReportes(
+    directorio=settings.REPORTES_DIR,
+    workers=settings.REPORTES_WORKERS,
+    max_pendientes=settings.REPORTES_MAX_PENDIENTES
+)
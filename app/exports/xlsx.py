@@ -0,0 +1,177 @@
+import io
+import re
+import zipfile
+from typing import Iterable, Iterator, List
+from xml.sax.saxutils import escape
+
+# ------------------------------------------------------------------
+# Escritor XLSX en streaming
+# ------------------------------------------------------------------
+# openpyxl (incluso en modo write_only) arma el .zip completo al final con
+# wb.save(). Aquí escribimos el paquete OOXML mínimo directamente sobre un
+# ZipFile no "seekable": cada lote de filas se comprime y se entrega al
+# cliente de inmediato, así la memoria es constante y el primer byte sale
+# apenas llega el primer lote de la base de datos.
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{titulo}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+_SHEET_INICIO = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetData>'
+)
+
+_SHEET_FIN = '</sheetData></worksheet>'
+
+# Caracteres de control que XML 1.0 no admite (Excel rechaza el archivo)
+_CARACTERES_INVALIDOS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Excel no acepta nombres de hoja de más de 31 caracteres ni con []:*?/\
+_TITULO_INVALIDO = re.compile(r"[\[\]:*?/\\]")
+
+
+# Columnas de los reportes de registros (/excel, /excel/all y reportes en segundo plano)
+ENCABEZADOS_REGISTROS = [
+    "ID", "Código Estudiante", "Nombre", "Grado",
+    "Tipo Alimentación", "Fecha Hora", "Plan", "Estado"
+]
+
+
+def fila_registro(row) -> List:
+    """
+    Fila de registros_validacion_caf (mapping) con el orden de ENCABEZADOS_REGISTROS.
+    """
+    # Manejo robusto de fechas para PostgreSQL
+    fecha_hora = row.get("fecha_hora")
+    if hasattr(fecha_hora, "strftime"):
+        fecha_str = fecha_hora.strftime("%Y-%m-%d %H:%M:%S")
+    else:
+        fecha_str = str(fecha_hora) if fecha_hora else ""
+
+    # Usamos row.get() para evitar KeyErrors si alguna columna es NULL en la BD
+    return [
+        row.get("id"),
+        row.get("codigo_estudiante"),
+        row.get("nombre"),
+        row.get("grado", ""),
+        row.get("tipo_alimentacion"),
+        fecha_str,
+        row.get("plan"),
+        row.get("estado")
+    ]
+
+
+class _Sumidero(io.RawIOBase):
+    """
+    Destino no 'seekable' del ZipFile: acumula lo escrito hasta que el
+    generador lo vacía hacia la respuesta HTTP.
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._partes.append(bytes(b))
+        return len(b)
+
+    def vaciar(self) -> bytes:
+        data = b"".join(self._partes)
+        self._partes.clear()
+        return data
+
+
+def _celda(valor) -> str:
+    if valor is None:
+        return "<c/>"
+    if isinstance(valor, bool):
+        return f'<c t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float)):
+        return f'<c t="n"><v>{valor}</v></c>'
+    texto = escape(_CARACTERES_INVALIDOS.sub("", str(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _fila(numero: int, valores: List) -> str:
+    return f'<row r="{numero}">' + "".join(_celda(v) for v in valores) + "</row>"
+
+
+def generar_xlsx(
+    titulo_hoja: str,
+    encabezados: List[str],
+    lotes: Iterable[List[List]]
+) -> Iterator[bytes]:
+    """
+    Genera un .xlsx de una sola hoja como una secuencia de bloques de bytes.
+    'lotes' es un iterable de listas de filas (cada fila, una lista de valores).
+    """
+    titulo = escape(_TITULO_INVALIDO.sub("", titulo_hoja)[:31] or "Hoja1")
+    sumidero = _Sumidero()
+
+    with zipfile.ZipFile(sumidero, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(titulo=titulo))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+
+        # force_zip64: el tamaño final de la hoja no se conoce de antemano
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as hoja:
+            hoja.write(_SHEET_INICIO.encode("utf-8"))
+            hoja.write(_fila(1, encabezados).encode("utf-8"))
+            numero = 1
+
+            for lote in lotes:
+                partes = []
+                for valores in lote:
+                    numero += 1
+                    partes.append(_fila(numero, valores))
+                hoja.write("".join(partes).encode("utf-8"))
+
+                bloque = sumidero.vaciar()
+                if bloque:
+                    yield bloque
+
+            hoja.write(_SHEET_FIN.encode("utf-8"))
+
+    # Directorio central del zip
+    bloque = sumidero.vaciar()
+    if bloque:
+        yield bloque
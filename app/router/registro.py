@@ -1,17 +1,19 @@
-from datetime import date
-from io import BytesIO
+from datetime import date, datetime
+from itertools import chain
 from typing import Optional
+import asyncio
+import json
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from fastapi.responses import StreamingResponse
-from openpyxl import Workbook
+from fastapi import APIRouter, Depends, File, HTTPException, Path, Query, Request, Response, UploadFile, status
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+from starlette.concurrency import run_in_threadpool
 
-# Tus funciones ya migradas a Supabase
-from app.searchs.registro import (
+# Tus funciones ya migradas a Supabase (versiones async: ver core.database.run_db)
+from app.searchs.registro_async import (
     buscar_estudiantes, 
     consumo_mes_actual, 
     count_all_students, 
@@ -21,15 +23,53 @@ from app.searchs.registro import (
     total_planalimenticio, 
     get_all_registers, 
     get_registers_filtered, 
-    get_registers_today
+    get_registers_today,
+    get_dashboard_snapshot,
+    get_kpis_periodo,
+    registrar_validaciones
 )
-from core.database import get_db
+from app.searchs.importacion import importar_roster, leer_roster
+from app.searchs.registro import iter_registers
+from app.searchs.roster import indice_roster
+from app.schemas.registro import LoteValidaciones, SolicitudReporte
+from app.exports.copia import FORMATOS, exportar_copy, exportar_parquet, parquet_disponible
+from app.exports.reportes import MEDIA_TYPES, ColaLlena, gestor_reportes, preparar_reporte
+from app.exports.xlsx import ENCABEZADOS_REGISTROS, fila_registro, generar_xlsx
+from core.cache import estadisticas_cache, fijar_versiones, invalidar_cache
+from core.database import (
+    SessionLocal, commit_db, get_read_session, get_session, lsn_primario, run_db, sesion_lectura
+)
+from core.etag import calcular_etag, coincide_if_none_match, version_recursos
+from core.notificaciones import broker_registros
+from core.respuestas import ORJSONRespuesta
 
 # Configuración de logger para ver errores de Supabase en consola
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+async def _respuesta_condicional(request: Request, response: Response, db, recursos: tuple, *partes):
+    """
+    GET condicional: calcula el ETag con las versiones de 'recursos' (core/etag.py)
+    y devuelve un 304 si el cliente ya lo tiene, sin correr la consulta pesada.
+    Si no coincide, deja el ETag en 'response' y devuelve None. Las versiones
+    quedan fijadas para el request: la caché y el roster en memoria no
+    responden con datos anteriores a ellas (core/cache.py).
+
+    Con 'db' en la réplica las versiones también se leen ahí: la réplica
+    reproduce la tabla de versiones junto con los datos, así que el ETag
+    describe exactamente lo que esa réplica puede responder.
+    """
+    versiones = await run_db(db, version_recursos, recursos)
+    fijar_versiones(versiones)
+    etag = calcular_etag(versiones, request.url.path, *partes)
+    encabezados = {"ETag": etag, "Cache-Control": "no-cache"}
+    if coincide_if_none_match(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=encabezados)
+    response.headers.update(encabezados)
+    return None
+
 # ------------------------------------------------------------------
 # Endpoint: Obtener los últimos 15 registros
 # ------------------------------------------------------------------
@@ -39,16 +79,16 @@ router = APIRouter()
     summary="Obtener estudiantes (máx. 15)",
     description="Devuelve hasta 15 registros recientes de la tabla registros_validacion desde Supabase"
 )
-def listar_estudiantes(db: Session = Depends(get_db)):
+async def listar_estudiantes(db: Session = Depends(get_read_session)):
     try:
         # get_all_registers ya tiene el SELECT con 'public.registros_validacion'
-        registros = get_all_registers(db)
+        registros = await get_all_registers(db)
         
-        return {
+        return ORJSONRespuesta({
             "status": "success",
             "total": len(registros),
             "data": registros
-        }
+        })
         
     except (SQLAlchemyError, DBAPIError) as e:
         # Logueamos el error real para debuguear (ej: error de SSL o puerto 8432)
@@ -66,21 +106,29 @@ def listar_estudiantes(db: Session = Depends(get_db)):
     summary="Obtener estudiantes paginados",
     description="Devuelve una lista paginada de todos los estudiantes registrados desde Supabase."
 )
-def listar_estudiantes_paginados(
-    db: Session = Depends(get_db),
+async def listar_estudiantes_paginados(
+    db: Session = Depends(get_read_session),
     page: int = Query(1, ge=1, description="Número de página"), 
-    size: int = Query(50, ge=1, le=100, description="Registros por página")
+    size: int = Query(50, ge=1, le=100, description="Registros por página"),
+    cursor: Optional[str] = Query(None, description="Cursor 'next_cursor' de la respuesta anterior (ignora 'page')"),
+    exact: bool = Query(False, description="Forzar COUNT(*) exacto para 'total' (por defecto se estima en listados grandes)")
 ):
     """
     Nota: He añadido 'Query' para que FastAPI valide que la página no sea 
     menor a 1 y el tamaño no sea exagerado (máx 100).
+    Con 'cursor' la página se busca por índice (keyset) y no por OFFSET.
     """
     try:
         # La función get_all_registers_all ya usa el esquema 'public' y el puerto 8432
-        resultado = get_all_registers_all(db, page=page, size=size)
+        resultado = await get_all_registers_all(db, page=page, size=size, cursor=cursor, exact=exact)
         
-        return resultado
+        return ORJSONRespuesta(resultado)
 
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except SQLAlchemyError as e:
         # Logueamos el error específico para identificar fallos en el túnel de Supabase
         logger.error(f"Error de base de datos en /all: {str(e)}")
@@ -101,8 +149,10 @@ def listar_estudiantes_paginados(
     summary="Obtener estudiantes registrados en el día actual",
     description="Devuelve todos los registros de validación del día de hoy desde Supabase."
 )
-def listar_registros_hoy(
-    db: Session = Depends(get_db),
+async def listar_registros_hoy(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_session),
     codigo_estudiante: Optional[str] = Query(None, description="Filtrar por código de estudiante")
 ):
     """
@@ -110,10 +160,16 @@ def listar_registros_hoy(
     Nota: La función 'get_registers_today' ya está configurada para usar CURRENT_DATE de Postgres.
     """
     try:
+        no_modificado = await _respuesta_condicional(
+            request, response, db, ("registros", "estudiantes"), date.today(), codigo_estudiante
+        )
+        if no_modificado:
+            return no_modificado
+
         # Llamamos a la función que ya migramos con la sintaxis de PostgreSQL
-        registros = get_registers_today(db, codigo_estudiante=codigo_estudiante)
+        registros = await get_registers_today(db, codigo_estudiante=codigo_estudiante)
         
-        return {
+        return ORJSONRespuesta({
             "status": "success",
             "filtros": {
                 "codigo_estudiante": codigo_estudiante if codigo_estudiante else "todos",
@@ -121,7 +177,7 @@ def listar_registros_hoy(
             },
             "total": len(registros),
             "data": registros
-        }
+        }, headers=response.headers)
 
     except SQLAlchemyError as e:
         logger.error(f"Error de base de datos en /hoy: {str(e)}")
@@ -143,7 +199,7 @@ def listar_registros_hoy(
     summary="Buscador con filtros avanzados y paginación",
     description="Permite filtrar por rango de fechas, código, nombre, grado, plan y estado, devolviendo resultados paginados desde Supabase."
 )
-def listar_registros_filtrados(
+async def listar_registros_filtrados(
     fecha_inicio: Optional[date] = Query(None, description="Fecha inicio (YYYY-MM-DD)"),
     fecha_fin: Optional[date] = Query(None, description="Fecha fin (YYYY-MM-DD)"),
     codigo_estudiante: Optional[str] = Query(None, description="Código del estudiante"),
@@ -153,7 +209,9 @@ def listar_registros_filtrados(
     estado: Optional[str] = Query(None, description="Estado del registro: VALIDADO, NO REGISTRADO o TODOS"),
     page: int = Query(1, ge=1, description="Número de página"),
     size: int = Query(50, ge=1, le=100, description="Registros por página"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Cursor 'next_cursor' de la respuesta anterior (ignora 'page')"),
+    exact: bool = Query(False, description="Forzar COUNT(*) exacto para 'total' (por defecto se estima en listados grandes)"),
+    db: Session = Depends(get_read_session)
 ):
     """
     Endpoint que integra filtros y paginación. 
@@ -167,7 +225,7 @@ def listar_registros_filtrados(
         )
         
         # Llamamos al controlador que ya configuramos con la sintaxis de PostgreSQL
-        resultado = get_registers_filtered(
+        resultado = await get_registers_filtered(
             db=db,
             fecha_inicio=fecha_inicio,
             fecha_fin=fecha_fin,
@@ -177,11 +235,18 @@ def listar_registros_filtrados(
             plan=plan,
             estado=estado,
             page=page,
-            size=size
+            size=size,
+            cursor=cursor,
+            exact=exact
         )
 
-        return resultado
+        return ORJSONRespuesta(resultado)
 
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except SQLAlchemyError as e:
         logger.error(f"Error de base de datos en /filtrar: {str(e)}")
         raise HTTPException(
@@ -196,6 +261,48 @@ def listar_registros_filtrados(
         )
 
 
+def _respuesta_excel_streaming(titulo_hoja: str, filename: str, **filtros):
+    """
+    Abre una sesión propia (vive mientras dure la descarga), lee el primer lote
+    para poder responder 404 si no hay datos, y devuelve un StreamingResponse
+    que escribe el Excel lote a lote desde el cursor del servidor.
+    Lee de la réplica si está disponible.
+    """
+    db = sesion_lectura()
+    try:
+        lotes = iter_registers(db, **filtros)
+        primer_lote = next(lotes, None)
+    except Exception:
+        db.close()
+        raise
+
+    if not primer_lote:
+        db.close()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No hay registros para los filtros indicados en Supabase"
+        )
+
+    def contenido():
+        try:
+            filas = (
+                [fila_registro(row) for row in lote]
+                for lote in chain([primer_lote], lotes)
+            )
+            yield from generar_xlsx(titulo_hoja, ENCABEZADOS_REGISTROS, filas)
+        except Exception as e:
+            # Los encabezados ya se enviaron: solo queda cortar la descarga
+            logger.error(f"Error durante el streaming del Excel: {str(e)}")
+            raise
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        contenido(),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 @router.get(
     "/excel", 
     status_code=status.HTTP_200_OK,
@@ -209,96 +316,51 @@ def descargar_excel(
     nombre: Optional[str] = Query(None, description="Nombre del estudiante"),
     grado: Optional[str] = Query(None, description="Grado del estudiante"),
     plan: Optional[str] = Query(None, description="Tipo de plan (REFRIGERIO/ALMUERZO)"),
-    estado: Optional[str] = Query(None, description="Estado del registro (VALIDADO/NO REGISTRADO)"),
-    db: Session = Depends(get_db)
+    estado: Optional[str] = Query(None, description="Estado del registro (VALIDADO/NO REGISTRADO)")
 ):
+    # 1. LÓGICA DE NOMBRE DINÁMICO
+    partes_nombre = ["Reporte"]
+    
+    if nombre:
+        partes_nombre.append(nombre.replace(" ", "_").strip())
+    elif codigo_estudiante:
+        partes_nombre.append(str(codigo_estudiante))
+    
+    if grado:
+        partes_nombre.append(f"G{grado}")
+    
+    if plan and plan.upper() != "TODOS":
+        partes_nombre.append(plan.capitalize())
+        
+    if estado and estado.upper() != "TODOS":
+        partes_nombre.append(estado.capitalize())
+
+    if fecha_inicio and fecha_fin:
+        if fecha_inicio == fecha_fin:
+            partes_nombre.append(str(fecha_inicio))
+        else:
+            partes_nombre.append(f"{fecha_inicio}_al_{fecha_fin}")
+    else:
+        partes_nombre.append("Historico")
+
+    filename_final = "_".join(partes_nombre) + ".xlsx"
+
     try:
-        # 1. Obtener datos (get_registers_filtered ya usa la sintaxis de Supabase)
-        resultado = get_registers_filtered(
-            db=db,
+        # 2. Excel en streaming (cursor del servidor + escritura por lotes)
+        return _respuesta_excel_streaming(
+            "Registros Filtrados",
+            filename_final,
             fecha_inicio=fecha_inicio,
             fecha_fin=fecha_fin,
             codigo_estudiante=codigo_estudiante,
             nombre=nombre,
             grado=grado,
             plan=plan,
-            estado=estado,
-            page=1,
-            size=1000000 # Límite alto para exportación total
-        )
-
-        registros = resultado.get("data", [])
-        if not registros:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail="No hay registros para los filtros indicados en Supabase"
-            )
-
-        # 2. Crear Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Registros Filtrados"
-        
-        # Encabezados
-        ws.append(["ID", "Código Estudiante", "Nombre", "Grado", "Tipo Alimentación", "Fecha Hora", "Plan", "Estado"])
-
-        for row in registros:
-            # Manejo robusto de fechas para PostgreSQL
-            fecha_hora = row.get("fecha_hora")
-            if hasattr(fecha_hora, "strftime"):
-                # Si viene de Supabase con zona horaria, esto lo maneja correctamente
-                fecha_str = fecha_hora.strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                fecha_str = str(fecha_hora)
-
-            ws.append([
-                row.get("id"), 
-                row.get("codigo_estudiante"), 
-                row.get("nombre"), 
-                row.get("grado", ""), 
-                row.get("tipo_alimentacion"), 
-                fecha_str, 
-                row.get("plan"), 
-                row.get("estado")
-            ])
-
-        buffer = BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
-
-        # 3. LÓGICA DE NOMBRE DINÁMICO
-        partes_nombre = ["Reporte"]
-        
-        if nombre:
-            partes_nombre.append(nombre.replace(" ", "_").strip())
-        elif codigo_estudiante:
-            partes_nombre.append(str(codigo_estudiante))
-        
-        if grado:
-            partes_nombre.append(f"G{grado}")
-        
-        if plan and plan.upper() != "TODOS":
-            partes_nombre.append(plan.capitalize())
-            
-        if estado and estado.upper() != "TODOS":
-            partes_nombre.append(estado.capitalize())
-
-        if fecha_inicio and fecha_fin:
-            if fecha_inicio == fecha_fin:
-                partes_nombre.append(str(fecha_inicio))
-            else:
-                partes_nombre.append(f"{fecha_inicio}_al_{fecha_fin}")
-        else:
-            partes_nombre.append("Historico")
-
-        filename_final = "_".join(partes_nombre) + ".xlsx"
-
-        return StreamingResponse(
-            buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename_final}"}
+            estado=estado
         )
 
+    except HTTPException:
+        raise
     except SQLAlchemyError as e:
         logger.error(f"Error de base de datos al exportar Excel: {str(e)}")
         raise HTTPException(status_code=500, detail="Error al extraer datos de Supabase para el reporte")
@@ -312,74 +374,19 @@ def descargar_excel(
     summary="Descargar todos los registros en Excel",
     description="Genera un Excel con todos los registros históricos almacenados en Supabase sin filtros."
 )
-def descargar_excel_all(
-    db: Session = Depends(get_db)
-):
+def descargar_excel_all():
     """
     Exportación masiva de datos desde Supabase a Excel.
+    Se escribe en streaming: la memoria no crece con el tamaño del histórico.
     """
     try:
-        # Usamos la función que ya migramos para Supabase con un límite alto.
-        # get_all_registers_all ya usa el esquema 'public' y el puerto 8432.
-        resultado = get_all_registers_all(db, page=1, size=1000000)
-        registros = resultado.get("data", [])
-
-        if not registros:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="No se encontraron registros en Supabase para exportar"
-            )
-
-        # 1. Crear el libro de Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Histórico Completo"
-
-        # 2. Definir y añadir encabezados
-        headers = [
-            "ID", "Código Estudiante", "Nombre", "Grado", 
-            "Tipo Alimentación", "Fecha Hora", "Plan", "Estado"
-        ]
-        ws.append(headers)
-
-        # 3. Iterar sobre los registros de Supabase
-        for row in registros:
-            # Manejo de fecha: Postgres devuelve objetos datetime. 
-            # Verificamos si tiene el método strftime para evitar errores.
-            fecha_hora = row.get("fecha_hora")
-            if hasattr(fecha_hora, "strftime"):
-                fecha_str = fecha_hora.strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                fecha_str = str(fecha_hora) if fecha_hora else ""
-            
-            # Usamos row.get() para evitar KeyErrors si alguna columna es NULL en la BD
-            ws.append([
-                row.get("id"),
-                row.get("codigo_estudiante"),
-                row.get("nombre"),
-                row.get("grado", ""),
-                row.get("tipo_alimentacion"),
-                fecha_str,
-                row.get("plan"),
-                row.get("estado")
-            ])
-
-        # 4. Preparar el buffer de memoria
-        buffer = BytesIO()
-        wb.save(buffer)
-        buffer.seek(0)
-
         # Nombre del archivo con la fecha de hoy
         filename = f"reporte_historico_cafeteria_{date.today()}.xlsx"
 
-        return StreamingResponse(
-            buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}"
-            }
-        )
+        return _respuesta_excel_streaming("Histórico Completo", filename)
 
+    except HTTPException:
+        raise
     except SQLAlchemyError as e:
         logger.error(f"Error de base de datos en Excel ALL (Supabase): {str(e)}")
         raise HTTPException(
@@ -393,17 +400,156 @@ def descargar_excel_all(
             detail="Error interno al procesar el archivo Excel"
         )
 
+@router.get(
+    "/export",
+    status_code=status.HTTP_200_OK,
+    summary="Exportación masiva en CSV, NDJSON o Parquet",
+    description="Exporta los registros con los mismos filtros de /filtrar. CSV y NDJSON se transmiten directo desde Supabase con COPY TO STDOUT; Parquet se arma por lotes desde un cursor del servidor (requiere pyarrow). 'gzip=true' comprime CSV/NDJSON al vuelo."
+)
+def exportar_registros(
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$", description="csv, ndjson o parquet"),
+    gzip: bool = Query(False, description="Comprimir la salida (.gz); no aplica a Parquet, que ya va comprimido"),
+    fecha_inicio: Optional[date] = Query(None, description="Fecha inicio (YYYY-MM-DD)"),
+    fecha_fin: Optional[date] = Query(None, description="Fecha fin (YYYY-MM-DD)"),
+    codigo_estudiante: Optional[str] = Query(None, description="Código del estudiante"),
+    nombre: Optional[str] = Query(None, description="Nombre del estudiante"),
+    grado: Optional[str] = Query(None, description="Grado del estudiante"),
+    plan: Optional[str] = Query(None, description="Tipo de plan (REFRIGERIO/ALMUERZO)"),
+    estado: Optional[str] = Query(None, description="Estado del registro (VALIDADO/NO REGISTRADO)")
+):
+    """
+    Pensado para herramientas de BI: sin paginación y con memoria constante
+    (ver app/exports/copia.py). Sin filtros exporta todo el histórico.
+    """
+    filtros = {
+        "fecha_inicio": fecha_inicio,
+        "fecha_fin": fecha_fin,
+        "codigo_estudiante": codigo_estudiante,
+        "nombre": nombre,
+        "grado": grado,
+        "plan": plan,
+        "estado": estado
+    }
+    filename = f"registros_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+
+    if format == "parquet":
+        if not parquet_disponible():
+            raise HTTPException(
+                status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                detail="La exportación Parquet requiere pyarrow en el servidor (pip install pyarrow)"
+            )
+        contenido = exportar_parquet(**filtros)
+        media_type = FORMATOS[format]
+    else:
+        contenido = exportar_copy(format, comprimir=gzip, **filtros)
+        media_type = FORMATOS[format]
+        if gzip:
+            filename += ".gz"
+            media_type = "application/gzip"
+
+    return StreamingResponse(
+        contenido,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@router.post(
+    "/reportes",
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Solicitar un reporte en segundo plano",
+    description="Encola la generación de un reporte (xlsx, csv o ndjson) con los filtros de /filtrar y devuelve su id de inmediato. Si ya existe uno idéntico sobre los mismos datos se reutiliza sin regenerarlo."
+)
+async def solicitar_reporte(solicitud: SolicitudReporte, db: Session = Depends(get_session)):
+    """
+    El id depende de los filtros y de la versión de los datos: repetir la
+    misma solicitud devuelve el mismo id (en curso o ya terminado).
+    """
+    try:
+        filtros = solicitud.filtros()
+        id_reporte, total_estimado = await run_db(db, preparar_reporte, solicitud.formato, filtros)
+        # El reporte se genera en la réplica solo cuando ya tenga lo que hay hoy en el primario
+        lsn = await run_db(db, lsn_primario)
+        # solicitar lee/escribe el .json de metadatos: fuera del event loop
+        trabajo = await run_in_threadpool(
+            gestor_reportes.solicitar, id_reporte, solicitud.formato, filtros, total_estimado, lsn
+        )
+
+        return ORJSONRespuesta({
+            "status": "success",
+            "data": trabajo
+        }, status_code=status.HTTP_202_ACCEPTED)
+
+    except ColaLlena as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e)
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Error de base de datos al solicitar reporte (Supabase): {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al conectar con Supabase para preparar el reporte"
+        )
+    except Exception as e:
+        logger.error(f"Error inesperado al solicitar reporte: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno al encolar el reporte"
+        )
+
+@router.get(
+    "/reportes/{id_reporte}",
+    status_code=status.HTTP_200_OK,
+    summary="Estado de un reporte en segundo plano",
+    description="Devuelve el estado (PENDIENTE, EN_PROCESO, LISTO o ERROR), el progreso estimado y las filas procesadas del reporte."
+)
+def consultar_reporte(id_reporte: str = Path(..., pattern="^[0-9a-f]{32}$", description="Id devuelto por POST /reportes")):
+    trabajo = gestor_reportes.consultar(id_reporte)
+    if trabajo is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No existe un reporte con ese id (o ya expiró)"
+        )
+    return ORJSONRespuesta({
+        "status": "success",
+        "data": trabajo
+    })
+
+@router.get(
+    "/reportes/{id_reporte}/descargar",
+    status_code=status.HTTP_200_OK,
+    summary="Descargar un reporte terminado",
+    description="Descarga el archivo de un reporte en estado LISTO."
+)
+def descargar_reporte(id_reporte: str = Path(..., pattern="^[0-9a-f]{32}$", description="Id devuelto por POST /reportes")):
+    archivo = gestor_reportes.archivo(id_reporte)
+    if archivo is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="El reporte no existe, no ha terminado o ya expiró"
+        )
+    ruta, formato = archivo
+    return FileResponse(
+        ruta,
+        media_type=MEDIA_TYPES[formato],
+        filename=f"reporte_{id_reporte[:8]}_{date.today()}.{formato}"
+    )
+
 @router.get(
     "/total-estudiantes", 
     status_code=status.HTTP_200_OK,
     summary="Obtener todos los estudiantes",
     description="Obtiene el conteo total de estudiantes registrados en Supabase"
 )
-def obtener_total_estudiantes(db: Session = Depends(get_db)):
+async def obtener_total_estudiantes(request: Request, response: Response, db: Session = Depends(get_read_session)):
     try:
+        no_modificado = await _respuesta_condicional(request, response, db, ("estudiantes",))
+        if no_modificado:
+            return no_modificado
+
         # Llamamos a la función de búsqueda
-        total = count_all_students(db)
-        return {"total_estudiantes": total}
+        total = await count_all_students(db)
+        return ORJSONRespuesta({"total_estudiantes": total}, headers=response.headers)
     except Exception as e:
         logger.error(f"❌ Error al obtener total de estudiantes: {str(e)}")
         raise HTTPException(
@@ -417,18 +563,24 @@ def obtener_total_estudiantes(db: Session = Depends(get_db)):
     summary="Obtiene el desglose de consumos por nivel educativo",
     description="Retorna el conteo de SNACK y LUNCH segmentado por Elementary (1-5) y High School (6-12) desde Supabase."
 )
-def obtener_total_estudiantes_hoy(db: Session = Depends(get_db)):
+async def obtener_total_estudiantes_hoy(request: Request, response: Response, db: Session = Depends(get_read_session)):
     """
     Este endpoint consume la lógica de agregación de PostgreSQL.
     Ideal para mostrar en los indicadores (cards) principales del dashboard.
     """
     try:
+        no_modificado = await _respuesta_condicional(
+            request, response, db, ("registros", "estudiantes"), date.today()
+        )
+        if no_modificado:
+            return no_modificado
+
         # La función count_students_today ya maneja el esquema 'public' 
         # y la conversión de grados (::INTEGER) para Postgres.
-        conteo = count_students_today(db)
+        conteo = await count_students_today(db)
         
         # Estructuramos la respuesta asegurando tipos enteros
-        return {
+        return ORJSONRespuesta({
             "status": "success",
             "total_estudiantes_hoy": int(conteo.get("total_estudiantes_hoy", 0)),
             "desglose": {
@@ -443,7 +595,7 @@ def obtener_total_estudiantes_hoy(db: Session = Depends(get_db)):
                     "total": int(conteo["lunch"].get("total", 0))
                 }
             }
-        }
+        }, headers=response.headers)
         
     except SQLAlchemyError as e:
         logger.error(f"Error de base de datos en totales hoy (Supabase): {str(e)}")
@@ -464,25 +616,31 @@ def obtener_total_estudiantes_hoy(db: Session = Depends(get_db)):
     summary="Obtiene los totales globales del plan alimenticio",
     description="Retorna el total de estudiantes inscritos, cuántos han consumido hoy y el desglose por tipo de plan (SNACK, LUNCH, etc.) desde Supabase."
 )
-def obtener_totales_planes(db: Session = Depends(get_db)):
+async def obtener_totales_planes(request: Request, response: Response, db: Session = Depends(get_read_session)):
     """
     Este endpoint es el corazón del Dashboard principal.
     Consume 'total_planalimenticio' que ya fue migrado al esquema 'public'.
     """
     try:
+        no_modificado = await _respuesta_condicional(
+            request, response, db, ("registros", "estudiantes"), date.today()
+        )
+        if no_modificado:
+            return no_modificado
+
         # La función total_planalimenticio ya está optimizada para 
         # manejar los conteos y grupos en PostgreSQL.
-        totales = total_planalimenticio(db)
+        totales = await total_planalimenticio(db)
         
         # Estructuramos la respuesta para asegurar que sea JSON puro
-        return {
+        return ORJSONRespuesta({
             "status": "success",
             "data": {
                 "total_estudiantes": int(totales.get("total_estudiantes", 0)),
                 "total_consumieron_hoy": int(totales.get("total_consumieron_hoy", 0)),
                 "total_por_tipo": totales.get("total_por_tipo", [])
             }
-        }
+        }, headers=response.headers)
 
     except SQLAlchemyError as e:
         # Logueamos el error técnico para soporte interno
@@ -504,18 +662,24 @@ def obtener_totales_planes(db: Session = Depends(get_db)):
     summary="Obtiene el total de estudiantes que han consumido este mes",
     description="Calcula el conteo de estudiantes únicos que tienen registros en el mes y año actuales desde Supabase."
 )
-def obtener_consumo_mes(db: Session = Depends(get_db)):
+async def obtener_consumo_mes(request: Request, response: Response, db: Session = Depends(get_read_session)):
     """
     Endpoint para KPIs mensuales. 
     Usa la lógica de PostgreSQL para filtrar por el mes en curso.
     """
     try:
+        no_modificado = await _respuesta_condicional(
+            request, response, db, ("registros", "estudiantes"), date.today()
+        )
+        if no_modificado:
+            return no_modificado
+
         hoy = date.today()
         # La función consumo_mes_actual ya maneja los esquemas 'public' 
         # y la sintaxis EXTRACT de Postgres.
-        total_mes = consumo_mes_actual(db)
+        total_mes = await consumo_mes_actual(db)
         
-        return {
+        return ORJSONRespuesta({
             "status": "success",
             "periodo": {
                 "mes": hoy.month,
@@ -523,7 +687,7 @@ def obtener_consumo_mes(db: Session = Depends(get_db)):
                 "nombre_mes": hoy.strftime("%B") # Opcional: devuelve el nombre del mes
             },
             "total_consumo": int(total_mes)
-        }
+        }, headers=response.headers)
 
     except SQLAlchemyError as e:
         logger.error(f"Error de base de datos en consumo-mes (Supabase): {str(e)}")
@@ -538,26 +702,155 @@ def obtener_consumo_mes(db: Session = Depends(get_db)):
             detail="Error interno al calcular el consumo del mes"
         )
     
+@router.get(
+    "/dashboard/snapshot",
+    status_code=status.HTTP_200_OK,
+    summary="Snapshot completo del dashboard en una sola llamada",
+    description="Devuelve los últimos registros y todos los indicadores del dashboard (totales, consumos de hoy, planes y consumo del mes) calculados en una sola consulta a Supabase."
+)
+async def obtener_dashboard_snapshot(request: Request, response: Response, db: Session = Depends(get_read_session)):
+    """
+    Reemplaza las 5 llamadas en paralelo del dashboard. Cada bloque conserva
+    la forma de la respuesta del endpoint individual equivalente, así el
+    frontend puede renderizar con el mismo código.
+    """
+    try:
+        no_modificado = await _respuesta_condicional(
+            request, response, db, ("registros", "estudiantes"), date.today()
+        )
+        if no_modificado:
+            return no_modificado
+
+        snapshot = await get_dashboard_snapshot(db)
+        hoy = date.today()
+
+        return ORJSONRespuesta({
+            "status": "success",
+            "recientes": {
+                "status": "success",
+                "total": len(snapshot["recientes"]),
+                "data": snapshot["recientes"]
+            },
+            "total_estudiantes": {
+                "total_estudiantes": snapshot["total_estudiantes"]
+            },
+            "consumos_hoy": {
+                "status": "success",
+                "total_estudiantes_hoy": snapshot["hoy"]["total_estudiantes_hoy"],
+                "desglose": {
+                    "snack": snapshot["hoy"]["snack"],
+                    "lunch": snapshot["hoy"]["lunch"]
+                }
+            },
+            "planes": {
+                "status": "success",
+                "data": snapshot["planes"]
+            },
+            "consumo_mes": {
+                "status": "success",
+                "periodo": {
+                    "mes": hoy.month,
+                    "anio": hoy.year,
+                    "nombre_mes": hoy.strftime("%B")
+                },
+                "total_consumo": snapshot["consumo_mes"]
+            }
+        }, headers=response.headers)
+
+    except SQLAlchemyError as e:
+        logger.error(f"Error de base de datos en dashboard/snapshot (Supabase): {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al conectar con Supabase para obtener el dashboard"
+        )
+    except Exception as e:
+        logger.error(f"Error inesperado en dashboard/snapshot: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno al construir el dashboard"
+        )
+
+@router.get(
+    "/kpis",
+    status_code=status.HTTP_200_OK,
+    summary="KPIs por periodo (día, semana o mes)",
+    description="Devuelve los consumos agrupados por periodo, plan, estado y nivel escolar (elementary/highschool) entre dos fechas, calculados desde el rollup diario en Supabase."
+)
+async def obtener_kpis_periodo(
+    request: Request,
+    response: Response,
+    desde: date = Query(..., description="Fecha inicial (YYYY-MM-DD)"),
+    hasta: date = Query(..., description="Fecha final, inclusive (YYYY-MM-DD)"),
+    granularidad: str = Query("day", pattern="^(day|week|month)$", description="day, week o month"),
+    db: Session = Depends(get_read_session)
+):
+    """
+    Sirve para graficar cualquier periodo (semana, mes, bimestre, año escolar)
+    sin exportar a Excel. 'periodo' es el primer día de cada bloque.
+    """
+    try:
+        no_modificado = await _respuesta_condicional(
+            request, response, db, ("registros", "estudiantes"), date.today(), desde, hasta, granularidad
+        )
+        if no_modificado:
+            return no_modificado
+
+        data = await get_kpis_periodo(db, desde, hasta, granularidad)
+
+        return ORJSONRespuesta({
+            "status": "success",
+            "filtros": {
+                "desde": desde.isoformat(),
+                "hasta": hasta.isoformat(),
+                "granularidad": granularidad
+            },
+            "total": len(data),
+            "data": data
+        }, headers=response.headers)
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Error de base de datos en /kpis (Supabase): {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al conectar con Supabase para obtener los KPIs"
+        )
+    except Exception as e:
+        logger.error(f"Error inesperado en /kpis: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error interno al calcular los KPIs del periodo"
+        )
+
 @router.get(
     "/estudiantes-con-plan",
     status_code=status.HTTP_200_OK,
     summary="Estudiantes con plan alimenticio",
     description="Lista a todos los estudiantes registrados en Supabase cuyo tipo de alimentación es distinto a 'NINGUNO'."
 )
-def listar_estudiantes_con_plan(db: Session = Depends(get_db)):
+async def listar_estudiantes_con_plan(request: Request, response: Response, db: Session = Depends(get_read_session)):
     """
     Este endpoint es útil para obtener la lista base de beneficiarios.
     La función 'get_estudiantes_con_plan' ya utiliza el esquema 'public' y ordena por nombre.
     """
     try:
+        # El roster cambia muy poco: si el cliente ya tiene esta versión, 304
+        no_modificado = await _respuesta_condicional(request, response, db, ("estudiantes",))
+        if no_modificado:
+            return no_modificado
+
         # Llamamos a la función del controlador que ya migramos
-        data = get_estudiantes_con_plan(db)
+        data = await get_estudiantes_con_plan(db)
 
-        return {
+        return ORJSONRespuesta({
             "status": "success",
             "total": len(data),
             "data": data
-        }
+        }, headers=response.headers)
 
     except SQLAlchemyError as e:
         # Registramos el error de base de datos (Postgres/Supabase)
@@ -574,22 +867,136 @@ def listar_estudiantes_con_plan(db: Session = Depends(get_db)):
             detail="Ocurrió un error interno al procesar la lista de estudiantes"
         )
     
+@router.post(
+    "/validaciones/batch",
+    status_code=status.HTTP_200_OK,
+    summary="Registrar un lote de validaciones (estaciones de escáner)",
+    description="Recibe hasta 1000 eventos (codigo_estudiante, plan, fecha_hora) y los registra en una sola sentencia: aplica las reglas de elegibilidad del scheduler, pasa a VALIDADO los 'NO RECLAMO' existentes e inserta los demás. Devuelve el resultado de cada evento en el mismo orden."
+)
+async def registrar_lote_validaciones(lote: LoteValidaciones, db: Session = Depends(get_session)):
+    """
+    Resultados por evento: INSERTADO, ACTUALIZADO, DUPLICADO, NO_ELEGIBLE
+    o NO_ENCONTRADO (ver app/searchs/validaciones.py).
+    """
+    try:
+        resultados = await registrar_validaciones(db, lote.eventos)
+        await commit_db(db)
+        # Los agregados del dashboard cambiaron: que no se sirvan desde caché
+        invalidar_cache()
+
+        resumen = {}
+        for item in resultados:
+            resumen[item["resultado"]] = resumen.get(item["resultado"], 0) + 1
+
+        return ORJSONRespuesta({
+            "status": "success",
+            "total": len(resultados),
+            "resumen": resumen,
+            "data": resultados
+        })
+
+    except SQLAlchemyError as e:
+        logger.error(f"Error de base de datos en validaciones/batch: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al registrar las validaciones en Supabase"
+        )
+    except Exception as e:
+        logger.error(f"Error inesperado en validaciones/batch: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ocurrió un error interno al registrar las validaciones"
+        )
+
+def _importar_roster_archivo(contenido: bytes, nombre_archivo: str) -> dict:
+    """
+    Lee el archivo, hace el upsert en su propia sesión (COPY necesita la
+    conexión psycopg2 aun con DB_ASYNC) y refresca caché y roster en memoria.
+    """
+    df, descartados = leer_roster(contenido, nombre_archivo)
+    db = SessionLocal()
+    try:
+        resultado = importar_roster(db, df)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    # El roster cambió: agregados y búsquedas no deben servir la copia vieja
+    invalidar_cache()
+    db = SessionLocal()
+    try:
+        indice_roster.refrescar(db)
+    except Exception as e:
+        # El job periódico lo vuelve a intentar
+        logger.error(f"⚠️ Roster importado pero no se pudo refrescar el índice en memoria: {str(e)}")
+    finally:
+        db.close()
+
+    return {**resultado, "descartados": descartados}
+
+@router.post(
+    "/estudiantes/import",
+    status_code=status.HTTP_200_OK,
+    summary="Importar el roster de estudiantes (CSV/XLSX)",
+    description="Carga el roster del colegio con COPY a una tabla temporal y lo mezcla en estudiantes_caf con un solo upsert. Columnas: codigo_estudiante, nombre, grado, tipo_alimentacion. Devuelve cuántos se insertaron, actualizaron y quedaron sin cambios."
+)
+async def importar_estudiantes(archivo: UploadFile = File(..., description="Roster en .csv o .xlsx")):
+    """
+    Pensado para el inicio de periodo: miles de estudiantes en un par de
+    round trips. Los estudiantes que no vienen en el archivo no se borran.
+    """
+    try:
+        contenido = await archivo.read()
+        resultado = await run_in_threadpool(_importar_roster_archivo, contenido, archivo.filename or "")
+
+        logger.info(
+            f"📥 Roster importado ({archivo.filename}): {resultado['insertados']} nuevos, "
+            f"{resultado['actualizados']} actualizados, {resultado['sin_cambios']} sin cambios"
+        )
+        return ORJSONRespuesta({
+            "status": "success",
+            "archivo": archivo.filename,
+            "data": resultado
+        })
+
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except SQLAlchemyError as e:
+        logger.error(f"Error de base de datos al importar estudiantes: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error al guardar el roster en Supabase"
+        )
+    except Exception as e:
+        logger.error(f"Error inesperado al importar estudiantes: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Ocurrió un error interno al importar el roster"
+        )
+
 @router.get(
     "/buscar-estudiantes",
     status_code=status.HTTP_200_OK,
     summary="Buscador de estudiantes",
     description="Permite buscar estudiantes en Supabase por nombre, código, grado o combinación de ellos."
 )
-def buscar_estudiantes_endpoint(
+async def buscar_estudiantes_endpoint(
     codigo_estudiante: Optional[str] = Query(None, description="Código del estudiante"),
     nombre: Optional[str] = Query(None, description="Nombre del estudiante"),
     grado: Optional[str] = Query(None, description="Grado / grupo"),
-    db: Session = Depends(get_db)
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Máximo de resultados (typeahead)"),
+    db: Session = Depends(get_read_session)
 ):
     """
     Endpoint de búsqueda flexible.
-    Nota: La función 'buscar_estudiantes' ya utiliza ILIKE para que no importe 
-    si escribes en mayúsculas o minúsculas en Supabase.
+    Nota: La función 'buscar_estudiantes' ignora mayúsculas y tildes
+    ("jose" encuentra "JOSÉ") y resuelve primero los códigos exactos.
     """
     # Validamos que no intenten buscar en blanco
     if not any([codigo_estudiante, nombre, grado]):
@@ -600,14 +1007,15 @@ def buscar_estudiantes_endpoint(
 
     try:
         # Llamamos al controlador que ya configuramos con la sintaxis de PostgreSQL
-        data = buscar_estudiantes(
+        data = await buscar_estudiantes(
             db=db,
             codigo_estudiante=codigo_estudiante,
             nombre=nombre,
-            grado=grado
+            grado=grado,
+            limit=limit
         )
 
-        return {
+        return ORJSONRespuesta({
             "status": "success",
             "filtros_aplicados": {
                 "codigo": codigo_estudiante,
@@ -616,7 +1024,7 @@ def buscar_estudiantes_endpoint(
             },
             "total": len(data),
             "data": data
-        }
+        })
 
     except SQLAlchemyError as e:
         logger.error(f"Error de base de datos en buscar-estudiantes: {str(e)}")
@@ -629,4 +1037,66 @@ def buscar_estudiantes_endpoint(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Ocurrió un error interno al realizar la búsqueda"
-        )
\ No newline at end of file
+        )
+
+@router.get(
+    "/cache/estadisticas",
+    status_code=status.HTTP_200_OK,
+    summary="Estadísticas de la caché de agregados",
+    description="Devuelve entradas, desalojos y aciertos/fallos por función de la caché en proceso del dashboard."
+)
+def obtener_estadisticas_cache():
+    return ORJSONRespuesta({
+        "status": "success",
+        "data": estadisticas_cache()
+    })
+
+
+@router.get(
+    "/roster/estado",
+    status_code=status.HTTP_200_OK,
+    summary="Estado del roster en memoria",
+    description="Versión, número de estudiantes y última actualización del índice en memoria que sirve las búsquedas."
+)
+def obtener_estado_roster():
+    return ORJSONRespuesta({
+        "status": "success",
+        "data": indice_roster.estadisticas()
+    })
+
+
+@router.get(
+    "/stream",
+    summary="Feed en vivo de validaciones (Server-Sent Events)",
+    description="Envía los registros nuevos/actualizados y los cambios en los contadores de hoy a medida que ocurren en Supabase (LISTEN/NOTIFY). Reemplaza el sondeo periódico del dashboard."
+)
+async def stream_registros(request: Request):
+    """
+    Eventos:
+    - 'cambios': {registros: [...], contadores: {snack/lunch: {elementary, highschool, total}}}
+      con los deltas a sumar a las cartas de hoy.
+    - 'recarga': hubo un cambio masivo (scheduler) o se perdió la conexión;
+      el cliente debe volver a pedir /registro/dashboard/snapshot.
+    Cada 15 s sin eventos se envía un comentario para mantener viva la conexión.
+    """
+    cola = broker_registros.suscribir()
+
+    async def eventos():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                datos = json.dumps(evento, default=str, ensure_ascii=False)
+                yield f"event: {evento.get('tipo', 'cambios')}\ndata: {datos}\n\n"
+        finally:
+            broker_registros.desuscribir(cola)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
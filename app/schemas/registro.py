@@ -0,0 +1,67 @@
+from datetime import date, datetime
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field, field_validator
+from pytz import timezone
+
+ZONA_COLEGIO = timezone("America/Bogota")
+
+# Tope de eventos por lote de /validaciones/batch (un solo round trip)
+MAX_EVENTOS_LOTE = 1000
+
+# ------------------------------------------------------------------
+# Cuerpos (JSON) de los endpoints POST de /registro
+# ------------------------------------------------------------------
+
+
+class SolicitudReporte(BaseModel):
+    """
+    POST /registro/reportes: mismos filtros de /filtrar y /excel.
+    """
+    formato: Literal["xlsx", "csv", "ndjson"] = Field("xlsx", description="xlsx, csv o ndjson")
+    fecha_inicio: Optional[date] = Field(None, description="Fecha inicio (YYYY-MM-DD)")
+    fecha_fin: Optional[date] = Field(None, description="Fecha fin (YYYY-MM-DD)")
+    codigo_estudiante: Optional[str] = Field(None, description="Código del estudiante")
+    nombre: Optional[str] = Field(None, description="Nombre del estudiante")
+    grado: Optional[str] = Field(None, description="Grado del estudiante")
+    plan: Optional[str] = Field(None, description="Tipo de plan (REFRIGERIO/ALMUERZO)")
+    estado: Optional[str] = Field(None, description="Estado del registro (VALIDADO/NO REGISTRADO)")
+
+    def filtros(self) -> dict:
+        return self.model_dump(exclude={"formato"})
+
+
+class EventoValidacion(BaseModel):
+    """
+    Una lectura del escáner: quién, qué plan y cuándo (hora local de Bogotá
+    si no trae zona horaria).
+    """
+    codigo_estudiante: str = Field(..., min_length=1, description="Código del estudiante")
+    plan: Literal["SNACK", "LUNCH"] = Field(..., description="SNACK o LUNCH")
+    fecha_hora: datetime = Field(..., description="Momento de la validación")
+
+    @field_validator("codigo_estudiante", mode="before")
+    @classmethod
+    def _limpiar_codigo(cls, valor):
+        # Antes de min_length: un código solo con espacios no pasa
+        return valor.strip() if isinstance(valor, str) else valor
+
+    @field_validator("plan", mode="before")
+    @classmethod
+    def _plan_mayusculas(cls, valor):
+        return valor.strip().upper() if isinstance(valor, str) else valor
+
+    @field_validator("fecha_hora")
+    @classmethod
+    def _hora_local(cls, valor: datetime) -> datetime:
+        # registros_validacion_caf guarda la hora local sin zona (igual que el scheduler)
+        if valor.tzinfo is not None:
+            valor = valor.astimezone(ZONA_COLEGIO).replace(tzinfo=None)
+        return valor
+
+
+class LoteValidaciones(BaseModel):
+    """
+    POST /registro/validaciones/batch.
+    """
+    eventos: List[EventoValidacion] = Field(..., min_length=1, max_length=MAX_EVENTOS_LOTE)
@@ -0,0 +1,54 @@
+import re
+import unicodedata
+
+# ------------------------------------------------------------------
+# Helpers de búsqueda por texto (nombre / código)
+# ------------------------------------------------------------------
+# Las condiciones que se arman aquí están pensadas para los índices de la
+# migración 2 (core/schema.py):
+#   - public.f_normalizar(nombre) con gin_trgm_ops y text_pattern_ops
+#   - codigo_estudiante con gin_trgm_ops y text_pattern_ops
+# El término se normaliza en Python igual que f_normalizar en Postgres
+# (minúsculas y sin tildes), así "jose" encuentra "JOSÉ" usando el índice.
+
+_ESPACIOS = re.compile(r"\s+")
+
+
+def normalizar(texto: str) -> str:
+    """
+    Minúsculas, sin tildes/diéresis/eñes y con espacios colapsados.
+    """
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    sin_marcas = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return _ESPACIOS.sub(" ", sin_marcas).strip().lower()
+
+
+def escapar_like(texto: str) -> str:
+    # Los comodines que escriba el usuario se buscan como texto literal
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def condicion_nombre(columna: str, nombre: str, params: dict, clave: str = "nombre") -> str:
+    """
+    Subcadena sin tildes ni mayúsculas sobre 'columna'
+    (servida por el GIN trigram de f_normalizar).
+    """
+    params[clave] = f"%{escapar_like(normalizar(nombre))}%"
+    return f"public.f_normalizar({columna}) LIKE :{clave}"
+
+
+def condicion_codigo(columna: str, codigo: str, params: dict, clave: str = "codigo") -> str:
+    """
+    Subcadena sobre el código (el GIN trigram también sirve ILIKE).
+    """
+    params[clave] = f"%{escapar_like(codigo.strip())}%"
+    return f"{columna} ILIKE :{clave}"
+
+
+def prefijo_nombre(nombre: str) -> str:
+    # Patrón 'term%' para ordenar primero los nombres que empiezan por el término
+    return f"{escapar_like(normalizar(nombre))}%"
+
+
+def prefijo_codigo(codigo: str) -> str:
+    return f"{escapar_like(codigo.strip())}%"
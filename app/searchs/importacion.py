@@ -0,0 +1,149 @@
+import io
+import logging
+import time
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.searchs.busqueda import normalizar
+from core.metricas import consulta_nombrada
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Importación masiva del roster (public.estudiantes_caf)
+# ------------------------------------------------------------------
+# El archivo del colegio (CSV o XLSX) se lee con pandas, se limpia y se carga
+# con COPY en una tabla temporal. Luego un solo INSERT ... ON CONFLICT DO
+# UPDATE mezcla todo en estudiantes_caf: el WHERE IS DISTINCT FROM evita
+# reescribir filas idénticas y RETURNING (xmax = 0) distingue insertadas de
+# actualizadas. Miles de estudiantes son un par de round trips.
+
+COLUMNAS = ("codigo_estudiante", "nombre", "grado", "tipo_alimentacion")
+
+# Encabezados que usa el colegio (ya normalizados) -> columna de la tabla
+_ALIAS = {
+    "codigo_estudiante": "codigo_estudiante",
+    "codigo": "codigo_estudiante",
+    "cod_estudiante": "codigo_estudiante",
+    "nombre": "nombre",
+    "nombre_completo": "nombre",
+    "estudiante": "nombre",
+    "grado": "grado",
+    "curso": "grado",
+    "tipo_alimentacion": "tipo_alimentacion",
+    "alimentacion": "tipo_alimentacion",
+    "plan": "tipo_alimentacion",
+}
+
+
+def leer_roster(contenido: bytes, nombre_archivo: str) -> tuple:
+    """
+    DataFrame con COLUMNAS (texto, sin espacios sobrantes, un renglón por
+    código) y cuántos renglones se descartaron por código vacío o repetido.
+    Lanza ValueError si el archivo no se puede leer o le faltan columnas.
+    """
+    extension = nombre_archivo.rsplit(".", 1)[-1].lower() if "." in nombre_archivo else ""
+    try:
+        if extension == "csv":
+            # utf-8-sig: los CSV que exporta Excel traen BOM
+            df = pd.read_csv(io.BytesIO(contenido), dtype=str, keep_default_na=False, encoding="utf-8-sig", sep=None, engine="python")
+        elif extension in ("xlsx", "xlsm"):
+            df = pd.read_excel(io.BytesIO(contenido), dtype=str, keep_default_na=False, engine="openpyxl")
+        else:
+            raise ValueError("Formato no soportado: se espera un archivo .csv o .xlsx")
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"No se pudo leer el archivo: {e}")
+
+    renombres = {}
+    for columna in df.columns:
+        clave = normalizar(str(columna)).replace(" ", "_")
+        if clave in _ALIAS:
+            renombres[columna] = _ALIAS[clave]
+    df = df.rename(columns=renombres)
+
+    faltantes = [columna for columna in COLUMNAS if columna not in df.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas en el archivo: {', '.join(faltantes)}")
+
+    df = df.loc[:, list(COLUMNAS)]
+    for columna in COLUMNAS:
+        df[columna] = df[columna].astype(str).str.strip()
+    df["tipo_alimentacion"] = df["tipo_alimentacion"].str.upper()
+
+    total = len(df)
+    df = df[df["codigo_estudiante"] != ""]
+    # Si un código aparece dos veces gana el último renglón del archivo
+    df = df.drop_duplicates(subset="codigo_estudiante", keep="last")
+    return df, total - len(df)
+
+
+@consulta_nombrada
+def importar_roster(db: Session, df: pd.DataFrame) -> dict:
+    """
+    COPY a tabla temporal + upsert en estudiantes_caf.
+    Devuelve insertados / actualizados / sin_cambios. No hace commit.
+    """
+    try:
+        inicio = time.perf_counter()
+
+        db.execute(text("""
+            CREATE TEMP TABLE tmp_estudiantes_import (
+                codigo_estudiante TEXT,
+                nombre TEXT,
+                grado TEXT,
+                tipo_alimentacion TEXT
+            ) ON COMMIT DROP
+        """))
+
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        # COPY con el cursor de psycopg2 de la misma conexión/transacción
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY tmp_estudiantes_import (codigo_estudiante, nombre, grado, tipo_alimentacion) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        finally:
+            cursor.close()
+
+        conteo = db.execute(text("""
+            WITH upsert AS (
+                INSERT INTO public.estudiantes_caf AS e
+                    (codigo_estudiante, nombre, grado, tipo_alimentacion)
+                SELECT codigo_estudiante, nombre, grado, tipo_alimentacion
+                FROM tmp_estudiantes_import
+                ON CONFLICT (codigo_estudiante) DO UPDATE
+                    SET nombre = EXCLUDED.nombre,
+                        grado = EXCLUDED.grado,
+                        tipo_alimentacion = EXCLUDED.tipo_alimentacion
+                    WHERE (e.nombre, e.grado, e.tipo_alimentacion)
+                        IS DISTINCT FROM (EXCLUDED.nombre, EXCLUDED.grado, EXCLUDED.tipo_alimentacion)
+                RETURNING (xmax = 0) AS insertado
+            )
+            SELECT
+                COUNT(*) FILTER (WHERE insertado) AS insertados,
+                COUNT(*) FILTER (WHERE NOT insertado) AS actualizados
+            FROM upsert
+        """)).mappings().one()
+
+        insertados = int(conteo["insertados"])
+        actualizados = int(conteo["actualizados"])
+        return {
+            "recibidos": len(df),
+            "insertados": insertados,
+            "actualizados": actualizados,
+            "sin_cambios": len(df) - insertados - actualizados,
+            "duracion_ms": round((time.perf_counter() - inicio) * 1000, 1)
+        }
+
+    except Exception as e:
+        logger.error(f"Error al importar el roster en Supabase: {e}")
+        raise
@@ -1,4 +1,6 @@
-from datetime import date, datetime
+from datetime import date, datetime, time, timedelta
+import base64
+import json
 from fastapi import FastAPI
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
@@ -7,13 +9,40 @@ import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from pytz import timezone
 
+from app.searchs.busqueda import (
+    condicion_codigo,
+    condicion_nombre,
+    normalizar,
+    prefijo_codigo,
+    prefijo_nombre
+)
+from app.searchs.roster import indice_roster
+from core.cache import cached, version_request
+from core.config import settings
 from core.database import SessionLocal
+from core.metricas import consulta_nombrada
+from core.respuestas import filas_a_dicts
 
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# TTL (segundos) de los agregados del dashboard. Los conteos de hoy cambian
+# con cada validación; el roster casi nunca. Los jobs del scheduler invalidan
+# la caché al terminar (ver main.py).
+TTL_TOTAL_ESTUDIANTES = 300
+TTL_PLANES = 60
+TTL_CONSUMO_HOY = 15
+TTL_CONSUMO_MES = 60
+TTL_SNAPSHOT = 15
+TTL_KPIS = 60
+TTL_TOTALES = 30
+
+# Granularidades admitidas por get_kpis_periodo -> argumento de date_trunc
+GRANULARIDADES = {"day": "day", "week": "week", "month": "month"}
+
 # 1️⃣ Todos los registros recientes (LIMIT 15)
+@consulta_nombrada
 def get_all_registers(db: Session):
     try:
         # ⚠️ Cambié 'cafeteria.' por 'public.' que es el estándar de Supabase
@@ -35,8 +64,7 @@ def get_all_registers(db: Session):
             LIMIT 15;
         """)
         
-        result = db.execute(query)
-        return result.mappings().all()
+        return filas_a_dicts(db.execute(query))
         
     except SQLAlchemyError as e:
         # Importante: Supabase puede cerrar conexiones inactivas. 
@@ -44,24 +72,100 @@ def get_all_registers(db: Session):
         logger.error(f"Error en Supabase al obtener registros: {str(e)}")
         raise
 
-def get_all_registers_all(db: Session, page: int = 1, size: int = 50):
+# 🔖 Cursor opaco para paginación por "seek" (keyset) sobre (fecha_hora, id)
+def encode_cursor(fecha_hora: datetime, registro_id) -> str:
+    payload = json.dumps({"f": fecha_hora.isoformat(), "i": registro_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    """
+    Devuelve (fecha_hora, id). Lanza ValueError si el cursor no es válido.
+    """
     try:
-        # 1. Calcular el salto (offset)
+        relleno = "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return datetime.fromisoformat(payload["f"]), payload["i"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Cursor de paginación inválido") from e
+
+def _json(valor):
+    # psycopg2 decodifica json/jsonb; asyncpg (DB_ASYNC) lo entrega como texto
+    return json.loads(valor) if isinstance(valor, str) else valor
+
+def _siguiente_cursor(result, size: int):
+    # Solo hay página siguiente si la actual vino llena
+    if len(result) < size:
+        return None
+    ultimo = result[-1]
+    return encode_cursor(ultimo["fecha_hora"], ultimo["id"])
+
+_FROM_REGISTROS = """
+    FROM public.registros_validacion_caf rv
+    INNER JOIN public.estudiantes_caf e
+        ON rv.codigo_estudiante = e.codigo_estudiante
+"""
+
+@consulta_nombrada
+def _conteo_exacto_sin_cache(db: Session, where_clause: str, params_items: tuple) -> int:
+    count_sql = f"SELECT COUNT(*) {_FROM_REGISTROS} {where_clause}"
+    return db.execute(text(count_sql), dict(params_items)).scalar() or 0
+
+# La clave de caché es el WHERE ya normalizado por _filtros_registros
+_conteo_exacto = cached(ttl=TTL_TOTALES, espacio="conteo_registros_exacto")(_conteo_exacto_sin_cache)
+
+@cached(ttl=TTL_TOTALES, espacio="conteo_registros_estimado")
+@consulta_nombrada
+def _conteo_estimado(db: Session, where_clause: str, params_items: tuple) -> int:
+    # Filas estimadas por el planificador (estadísticas de ANALYZE), sin ejecutar
+    plan = db.execute(
+        text(f"EXPLAIN (FORMAT JSON) SELECT 1 {_FROM_REGISTROS} {where_clause}"),
+        dict(params_items)
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def contar_registros(db: Session, where_clause: str = "", params: dict = None, exact: bool = False):
+    """
+    Total para los listados paginados. Devuelve (total, es_exacto).
+    - exact=True: COUNT(*) real, sin caché.
+    - Por defecto: si el planificador estima menos de CONTEO_ESTIMADO_MINIMO
+      filas se cuenta de verdad (consulta barata); si estima más, se devuelve
+      la estimación. Ambos resultados quedan en caché unos segundos por filtro.
+    """
+    params_items = tuple(sorted((params or {}).items()))
+    if exact:
+        return _conteo_exacto_sin_cache(db, where_clause, params_items), True
+
+    estimado = _conteo_estimado(db, where_clause, params_items)
+    if estimado < settings.CONTEO_ESTIMADO_MINIMO:
+        return _conteo_exacto(db, where_clause, params_items), True
+    return estimado, False
+
+@consulta_nombrada
+def get_all_registers_all(db: Session, page: int = 1, size: int = 50, cursor: str = None, exact: bool = False):
+    """
+    Paginación del histórico. Con 'cursor' (tomado de 'next_cursor' de la
+    respuesta anterior) la consulta salta directo a la posición con el índice
+    (fecha_hora DESC, id) y cuesta lo mismo en la página 1 que en la 500.
+    Sin cursor se mantiene el contrato clásico page/size (OFFSET).
+    """
+    try:
+        # 1. Calcular el salto (offset), o la posición del cursor
         skip = (page - 1) * size
+        seek_clause = ""
+        params = {"limit": size, "offset": skip}
+        if cursor:
+            cursor_fecha, cursor_id = decode_cursor(cursor)
+            seek_clause = "WHERE (rv.fecha_hora, rv.id) < (:cursor_fecha, :cursor_id)"
+            params.update({"cursor_fecha": cursor_fecha, "cursor_id": cursor_id, "offset": 0})
 
-        # 2. Consulta para contar el total de registros (sin paginar)
-        # Cambiamos 'cafeteria.' por 'public.'
-        count_query = text("""
-            SELECT COUNT(*) 
-            FROM public.registros_validacion_caf rv
-            INNER JOIN public.estudiantes_caf e 
-                ON rv.codigo_estudiante = e.codigo_estudiante
-        """)
-        total_registros = db.execute(count_query).scalar()
+        # 2. Total de registros (sin paginar): estimado o en caché salvo exact=True
+        total_registros, total_exacto = contar_registros(db, exact=exact)
 
-        # 3. Consulta principal con LIMIT y OFFSET
+        # 3. Consulta principal con LIMIT y OFFSET (o seek por cursor)
         # Usamos los nombres de tablas de Supabase
-        query = text("""
+        query = text(f"""
             SELECT
                 rv.id,
                 rv.codigo_estudiante,
@@ -74,18 +178,21 @@ def get_all_registers_all(db: Session, page: int = 1, size: int = 50):
             FROM public.registros_validacion_caf rv
             INNER JOIN public.estudiantes_caf e
                 ON rv.codigo_estudiante = e.codigo_estudiante
-            ORDER BY rv.fecha_hora DESC
+            {seek_clause}
+            ORDER BY rv.fecha_hora DESC, rv.id DESC
             LIMIT :limit OFFSET :offset
         """)
 
         # Ejecución con parámetros nombrados (muy seguro contra inyecciones)
-        result = db.execute(query, {"limit": size, "offset": skip}).mappings().all()
+        result = filas_a_dicts(db.execute(query, params))
 
         # 4. Retornar estructura completa
         return {
             "total": total_registros,
+            "total_exacto": total_exacto,
             "page": page,
             "size": size,
+            "next_cursor": _siguiente_cursor(result, size),
             "data": result
         }
 
@@ -94,7 +201,66 @@ def get_all_registers_all(db: Session, page: int = 1, size: int = 50):
         logger.error(f"Error en paginación de Supabase: {str(e)}")
         raise
 
+# Construye el WHERE compartido entre el listado filtrado y las exportaciones
+def _filtros_registros(
+    fecha_inicio: date = None,
+    fecha_fin: date = None,
+    codigo_estudiante: str = None,
+    nombre: str = None,
+    grado: str = None,
+    plan: str = None,
+    estado: str = None
+):
+    conditions = []
+    params = {}
+
+    # 1. Filtrar por fecha
+    # Rango semiabierto [inicio 00:00, día siguiente al fin 00:00) sobre la
+    # columna sin funciones: así Postgres puede usar el índice de fecha_hora
+    # (con DATE(rv.fecha_hora) recorría toda la tabla).
+    if fecha_inicio and fecha_fin:
+        conditions.append("rv.fecha_hora >= :fecha_desde AND rv.fecha_hora < :fecha_hasta")
+        params["fecha_desde"] = datetime.combine(fecha_inicio, time.min)
+        params["fecha_hasta"] = datetime.combine(fecha_fin + timedelta(days=1), time.min)
+        # Mismo rango sobre 'fecha' (la llave de partición) para que Postgres
+        # descarte los meses que no tocan. Un día de holgura a cada lado por
+        # si algún registro quedó con fecha y fecha_hora en días distintos.
+        conditions.append("rv.fecha BETWEEN :fecha_particion_desde AND :fecha_particion_hasta")
+        params["fecha_particion_desde"] = fecha_inicio - timedelta(days=1)
+        params["fecha_particion_hasta"] = fecha_fin + timedelta(days=1)
+
+    # 2. Filtrar por código (subcadena con índice trigram de estudiantes_caf;
+    #    e.codigo_estudiante = rv.codigo_estudiante por el JOIN)
+    if codigo_estudiante:
+        conditions.append(condicion_codigo("e.codigo_estudiante", codigo_estudiante, params, "codigo_estudiante"))
+
+    # 3. Filtrar por nombre (sin tildes ni mayúsculas, índice trigram)
+    if nombre:
+        conditions.append(condicion_nombre("e.nombre", nombre, params, "nombre"))
+
+    # 4. Filtrar por grado
+    if grado:
+        conditions.append("e.grado = :grado")
+        params["grado"] = grado
+
+    # 5. Filtrar por Plan
+    if plan and plan.upper() != "TODOS":
+        conditions.append("rv.plan = :plan")
+        params["plan"] = plan
+
+    # 6. Filtrar por Estado
+    if estado and estado.upper() != "TODOS":
+        conditions.append("rv.estado = :estado")
+        params["estado"] = estado
+
+    where_clause = ""
+    if conditions:
+        where_clause = " WHERE " + " AND ".join(conditions)
+
+    return where_clause, params
+
 # 2️⃣ Filtrar por fechas, código o ambos
+@consulta_nombrada
 def get_registers_filtered(
     db: Session,
     fecha_inicio: date = None,
@@ -105,62 +271,34 @@ def get_registers_filtered(
     plan: str = None,
     estado: str = None,
     page: int = 1,
-    size: int = 50
+    size: int = 50,
+    cursor: str = None,
+    exact: bool = False
 ):
     try:
         skip = (page - 1) * size
 
         # Cambiamos 'cafeteria.' por 'public.'
-        base_query = """
-            FROM public.registros_validacion_caf rv
-            INNER JOIN public.estudiantes_caf e
-                ON rv.codigo_estudiante = e.codigo_estudiante
-        """
+        base_query = _FROM_REGISTROS
 
-        conditions = []
-        params = {}
+        where_clause, params = _filtros_registros(
+            fecha_inicio, fecha_fin, codigo_estudiante, nombre, grado, plan, estado
+        )
 
-        # 1. Filtrar por fecha (Postgres usa DATE() igual que MySQL)
-        if fecha_inicio and fecha_fin:
-            conditions.append("DATE(rv.fecha_hora) BETWEEN :fecha_inicio AND :fecha_fin")
-            params["fecha_inicio"] = fecha_inicio
-            params["fecha_fin"] = fecha_fin
-
-        # 2. Filtrar por código (ILIKE para ignorar case en Postgres)
-        if codigo_estudiante:
-            conditions.append("rv.codigo_estudiante ILIKE :codigo_estudiante")
-            params["codigo_estudiante"] = f"%{codigo_estudiante}%"
-
-        # 3. Filtrar por nombre
-        # 🟢 CAMBIO CLAVE: Quitamos COLLATE y usamos ILIKE
-        if nombre:
-            conditions.append("e.nombre ILIKE :nombre")
-            params["nombre"] = f"%{nombre}%"
-
-        # 4. Filtrar por grado
-        if grado:
-            conditions.append("e.grado = :grado")
-            params["grado"] = grado
-
-        # 5. Filtrar por Plan
-        if plan and plan.upper() != "TODOS":
-            conditions.append("rv.plan = :plan")
-            params["plan"] = plan
-
-        # 6. Filtrar por Estado
-        if estado and estado.upper() != "TODOS":
-            conditions.append("rv.estado = :estado")
-            params["estado"] = estado
-
-        where_clause = ""
-        if conditions:
-            where_clause = " WHERE " + " AND ".join(conditions)
-
-        # --- 1. OBTENER EL TOTAL ---
-        count_sql = f"SELECT COUNT(*) {base_query} {where_clause}"
-        total_registros = db.execute(text(count_sql), params).scalar()
+        # --- 1. OBTENER EL TOTAL (estimado/caché, o exacto si se pide) ---
+        total_registros, total_exacto = contar_registros(db, where_clause, params, exact=exact)
 
         # --- 2. OBTENER LOS DATOS ---
+        # Con cursor se busca directo la posición (keyset) en vez de OFFSET
+        seek_clause = ""
+        if cursor:
+            cursor_fecha, cursor_id = decode_cursor(cursor)
+            seek_clause = ("AND" if where_clause else "WHERE") + \
+                " (rv.fecha_hora, rv.id) < (:cursor_fecha, :cursor_id)"
+            params["cursor_fecha"] = cursor_fecha
+            params["cursor_id"] = cursor_id
+            skip = 0
+
         select_sql = f"""
             SELECT
                 rv.id,
@@ -173,19 +311,22 @@ def get_registers_filtered(
                 rv.estado
             {base_query}
             {where_clause}
-            ORDER BY rv.fecha_hora DESC
+            {seek_clause}
+            ORDER BY rv.fecha_hora DESC, rv.id DESC
             LIMIT :limit OFFSET :offset
         """
         
         params["limit"] = size
         params["offset"] = skip
 
-        result = db.execute(text(select_sql), params).mappings().all()
+        result = filas_a_dicts(db.execute(text(select_sql), params))
 
         return {
             "total": total_registros,
+            "total_exacto": total_exacto,
             "page": page,
             "size": size,
+            "next_cursor": _siguiente_cursor(result, size),
             "data": result
         }
 
@@ -193,7 +334,73 @@ def get_registers_filtered(
         logger.error(f"Error al filtrar registros en Supabase: {e}")
         raise
 
+# 📤 SELECT de los registros filtrados y lectura por lotes para exportaciones grandes
+def sql_registros_filtrados(
+    fecha_inicio: date = None,
+    fecha_fin: date = None,
+    codigo_estudiante: str = None,
+    nombre: str = None,
+    grado: str = None,
+    plan: str = None,
+    estado: str = None
+):
+    """
+    SELECT completo (columnas del Excel, filtros de /filtrar, más recientes
+    primero) y sus parámetros. Lo comparten iter_registers y las
+    exportaciones con COPY (app/exports/copia.py).
+    """
+    where_clause, params = _filtros_registros(
+        fecha_inicio, fecha_fin, codigo_estudiante, nombre, grado, plan, estado
+    )
+
+    sql = f"""
+        SELECT
+            rv.id,
+            rv.codigo_estudiante,
+            e.nombre,
+            e.grado,
+            e.tipo_alimentacion,
+            rv.fecha_hora,
+            rv.plan,
+            rv.estado
+        {_FROM_REGISTROS}
+        {where_clause}
+        ORDER BY rv.fecha_hora DESC, rv.id DESC
+    """
+    return sql, params
+
+def iter_registers(
+    db: Session,
+    fecha_inicio: date = None,
+    fecha_fin: date = None,
+    codigo_estudiante: str = None,
+    nombre: str = None,
+    grado: str = None,
+    plan: str = None,
+    estado: str = None,
+    batch_size: int = 2000
+):
+    """
+    Recorre los registros (con los mismos filtros de /filtrar) usando un cursor
+    del lado del servidor. Entrega listas de hasta 'batch_size' filas, así la
+    memoria del worker no depende del tamaño total del histórico.
+    """
+    sql, params = sql_registros_filtrados(
+        fecha_inicio, fecha_fin, codigo_estudiante, nombre, grado, plan, estado
+    )
+    query = text(sql)
+
+    try:
+        # yield_per activa el cursor con nombre de psycopg2 (server-side cursor)
+        result = db.execute(query, params, execution_options={"yield_per": batch_size})
+        for lote in result.mappings().partitions():
+            yield lote
+    except SQLAlchemyError as e:
+        logger.error(f"Error al leer registros por lotes en Supabase: {e}")
+        raise
+
 # 3️⃣ Registros del día
+@consulta_nombrada
 def get_registers_today(db: Session, codigo_estudiante: str = None):
     try:
         # Cambiamos 'cafeteria.' por 'public.' 
@@ -221,11 +428,13 @@ def get_registers_today(db: Session, codigo_estudiante: str = None):
 
         query += " ORDER BY rv.fecha_hora DESC"
 
-        return db.execute(text(query), params).mappings().all()
+        return filas_a_dicts(db.execute(text(query), params))
     except Exception as e:
         logger.error(f"Error al obtener registros del día en Supabase: {e}")
         raise
 
+@cached(ttl=TTL_TOTAL_ESTUDIANTES)
+@consulta_nombrada
 def count_all_students(db: Session) -> int:
     try:
         # Cambiamos 'cafeteria.' por 'public.' o lo eliminamos
@@ -240,26 +449,39 @@ def count_all_students(db: Session) -> int:
         logger.error(f"Error al contar estudiantes en Supabase: {e}")
         raise
 
+@cached(ttl=TTL_CONSUMO_HOY)
+@consulta_nombrada
 def count_students_today(db: Session):
     try:
+        # Las sumas por plan/nivel salen del rollup diario (unos pocos renglones
+        # por día); solo los estudiantes únicos se cuentan sobre los registros
+        # de hoy, que el índice (fecha, plan, estado) acota a un solo día.
         query = text("""
-            SELECT 
-                -- Conteos para SNACK
-                SUM(CASE WHEN rv.plan = 'SNACK' AND e.grado ~ '^[0-9]+$' AND (e.grado::INTEGER) BETWEEN 1 AND 5 THEN 1 ELSE 0 END) AS snack_elementary,
-                SUM(CASE WHEN rv.plan = 'SNACK' AND e.grado ~ '^[0-9]+$' AND (e.grado::INTEGER) BETWEEN 6 AND 12 THEN 1 ELSE 0 END) AS snack_highschool,
-                
-                -- Conteos para LUNCH
-                SUM(CASE WHEN rv.plan = 'LUNCH' AND e.grado ~ '^[0-9]+$' AND (e.grado::INTEGER) BETWEEN 1 AND 5 THEN 1 ELSE 0 END) AS lunch_elementary,
-                SUM(CASE WHEN rv.plan = 'LUNCH' AND e.grado ~ '^[0-9]+$' AND (e.grado::INTEGER) BETWEEN 6 AND 12 THEN 1 ELSE 0 END) AS lunch_highschool,
-                
-                -- Totales generales
-                SUM(CASE WHEN rv.plan = 'SNACK' THEN 1 ELSE 0 END) AS total_snack,
-                SUM(CASE WHEN rv.plan = 'LUNCH' THEN 1 ELSE 0 END) AS total_lunch,
-                COUNT(DISTINCT rv.codigo_estudiante) AS total_unicos
-            FROM public.registros_validacion_caf rv
-            INNER JOIN public.estudiantes_caf e ON rv.codigo_estudiante = e.codigo_estudiante
-            WHERE rv.fecha = CURRENT_DATE
-            AND rv.estado = 'VALIDADO'
+            WITH rollup AS (
+                SELECT 
+                    -- Conteos para SNACK
+                    SUM(CASE WHEN c.plan = 'SNACK' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 1 AND 5 THEN c.total ELSE 0 END) AS snack_elementary,
+                    SUM(CASE WHEN c.plan = 'SNACK' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 6 AND 12 THEN c.total ELSE 0 END) AS snack_highschool,
+                    
+                    -- Conteos para LUNCH
+                    SUM(CASE WHEN c.plan = 'LUNCH' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 1 AND 5 THEN c.total ELSE 0 END) AS lunch_elementary,
+                    SUM(CASE WHEN c.plan = 'LUNCH' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 6 AND 12 THEN c.total ELSE 0 END) AS lunch_highschool,
+                    
+                    -- Totales generales
+                    SUM(CASE WHEN c.plan = 'SNACK' THEN c.total ELSE 0 END) AS total_snack,
+                    SUM(CASE WHEN c.plan = 'LUNCH' THEN c.total ELSE 0 END) AS total_lunch
+                FROM public.consumo_diario_caf c
+                WHERE c.fecha = CURRENT_DATE
+                AND c.estado = 'VALIDADO'
+            ),
+            unicos AS (
+                SELECT COUNT(DISTINCT rv.codigo_estudiante) AS total_unicos
+                FROM public.registros_validacion_caf rv
+                INNER JOIN public.estudiantes_caf e ON rv.codigo_estudiante = e.codigo_estudiante
+                WHERE rv.fecha = CURRENT_DATE
+                AND rv.estado = 'VALIDADO'
+            )
+            SELECT * FROM rollup, unicos
         """)
         
         result = db.execute(query).mappings().first()
@@ -282,6 +504,8 @@ def count_students_today(db: Session):
         raise
 
 
+@cached(ttl=TTL_PLANES)
+@consulta_nombrada
 def total_planalimenticio(db: Session):
     try:
         # 1️⃣ Total de estudiantes con tipo de alimentación ≠ 'NINGUNO'
@@ -315,9 +539,7 @@ def total_planalimenticio(db: Session):
               AND tipo_alimentacion != 'NINGUNO'
             GROUP BY tipo_alimentacion
         """)
-        result_tipo = db.execute(por_tipo_query).mappings().all()
-        # Convertimos a lista de dicts para asegurar la serialización JSON
-        por_tipo = [dict(row) for row in result_tipo]
+        por_tipo = filas_a_dicts(db.execute(por_tipo_query))
 
         return {
             "total_estudiantes": total_estudiantes,
@@ -329,36 +551,221 @@ def total_planalimenticio(db: Session):
         logger.error(f"❌ Error al calcular totales del dashboard en Supabase: {e}")
         raise
 
+@cached(ttl=TTL_CONSUMO_MES)
+@consulta_nombrada
 def consumo_mes_actual(db: Session):
     try:
-        # Obtener mes y año actuales
-        hoy = date.today()
-        mes_actual = hoy.month
-        anio_actual = hoy.year
+        # Primer día del mes actual (clave del rollup mensual)
+        inicio_mes = date.today().replace(day=1)
 
-        # 1️⃣ Cambiamos el esquema a public
-        # 2️⃣ Usamos EXTRACT para obtener mes y año en PostgreSQL
+        # Consumidores distintos del mes desde el rollup mensual
+        # (public.consumidores_mes_caf, mantenido por trigger): una búsqueda
+        # por PK en lugar de un COUNT(DISTINCT) sobre todo el mes de registros
         query = text("""
-            SELECT COUNT(DISTINCT rv.codigo_estudiante)
-            FROM public.registros_validacion_caf rv
-            INNER JOIN public.estudiantes_caf e
-                ON rv.codigo_estudiante = e.codigo_estudiante
-            WHERE EXTRACT(MONTH FROM rv.fecha_hora) = :mes
-            AND EXTRACT(YEAR FROM rv.fecha_hora) = :anio
+            SELECT COUNT(*)
+            FROM public.consumidores_mes_caf
+            WHERE mes = :mes
         """)
 
-        total = db.execute(query, {"mes": mes_actual, "anio": anio_actual}).scalar() or 0
+        total = db.execute(query, {"mes": inicio_mes}).scalar() or 0
         return int(total)
 
     except Exception as e:
         logger.error(f"Error al calcular consumo del mes actual en Supabase: {e}")
         raise
 
+@cached(ttl=TTL_SNAPSHOT)
+@consulta_nombrada
+def get_dashboard_snapshot(db: Session):
+    """
+    Todos los indicadores del dashboard y los últimos 15 registros en UNA sola
+    consulta (CTEs), en lugar de las ~8 consultas de los cinco endpoints
+    /registro/, /total-estudiantes, /total-estudiantes-hoy, /total-planes y
+    /dashboard/consumo-mes.
+    """
+    try:
+        inicio_mes = date.today().replace(day=1)
+
+        query = text("""
+            WITH estudiantes AS (
+                SELECT
+                    COUNT(*) AS total_estudiantes,
+                    COUNT(*) FILTER (
+                        WHERE tipo_alimentacion IS NOT NULL
+                          AND tipo_alimentacion != 'NINGUNO'
+                    ) AS total_con_plan
+                FROM public.estudiantes_caf
+            ),
+            por_tipo AS (
+                SELECT COALESCE(
+                    json_agg(json_build_object('tipo_alimentacion', t.tipo_alimentacion, 'total', t.total)),
+                    '[]'::json
+                ) AS total_por_tipo
+                FROM (
+                    SELECT tipo_alimentacion, COUNT(*) AS total
+                    FROM public.estudiantes_caf
+                    WHERE tipo_alimentacion IS NOT NULL
+                      AND tipo_alimentacion != 'NINGUNO'
+                    GROUP BY tipo_alimentacion
+                ) t
+            ),
+            hoy AS (
+                SELECT
+                    SUM(CASE WHEN c.plan = 'SNACK' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 1 AND 5 THEN c.total ELSE 0 END) AS snack_elementary,
+                    SUM(CASE WHEN c.plan = 'SNACK' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 6 AND 12 THEN c.total ELSE 0 END) AS snack_highschool,
+                    SUM(CASE WHEN c.plan = 'LUNCH' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 1 AND 5 THEN c.total ELSE 0 END) AS lunch_elementary,
+                    SUM(CASE WHEN c.plan = 'LUNCH' AND c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 6 AND 12 THEN c.total ELSE 0 END) AS lunch_highschool,
+                    SUM(CASE WHEN c.plan = 'SNACK' THEN c.total ELSE 0 END) AS total_snack,
+                    SUM(CASE WHEN c.plan = 'LUNCH' THEN c.total ELSE 0 END) AS total_lunch
+                FROM public.consumo_diario_caf c
+                WHERE c.fecha = CURRENT_DATE
+                  AND c.estado = 'VALIDADO'
+            ),
+            unicos_hoy AS (
+                SELECT
+                    COUNT(DISTINCT rv.codigo_estudiante) AS total_unicos,
+                    COUNT(DISTINCT rv.codigo_estudiante) FILTER (
+                        WHERE e.tipo_alimentacion != 'NINGUNO'
+                    ) AS total_consumieron_hoy
+                FROM public.registros_validacion_caf rv
+                INNER JOIN public.estudiantes_caf e ON rv.codigo_estudiante = e.codigo_estudiante
+                WHERE rv.fecha = CURRENT_DATE
+                  AND rv.estado = 'VALIDADO'
+            ),
+            mes AS (
+                SELECT COUNT(*) AS total_mes
+                FROM public.consumidores_mes_caf
+                WHERE mes = :mes
+            ),
+            recientes AS (
+                SELECT COALESCE(json_agg(r ORDER BY r.fecha_hora DESC, r.id DESC), '[]'::json) AS registros
+                FROM (
+                    SELECT
+                        rv.id,
+                        rv.codigo_estudiante,
+                        e.nombre,
+                        e.grado,
+                        e.tipo_alimentacion,
+                        rv.fecha_hora,
+                        rv.plan,
+                        rv.estado
+                    FROM public.registros_validacion_caf rv
+                    INNER JOIN public.estudiantes_caf e
+                        ON rv.codigo_estudiante = e.codigo_estudiante
+                    ORDER BY rv.fecha_hora DESC, rv.id DESC
+                    LIMIT 15
+                ) r
+            )
+            SELECT *
+            FROM estudiantes, por_tipo, hoy, unicos_hoy, mes, recientes
+        """)
+
+        row = db.execute(query, {"mes": inicio_mes}).mappings().first()
+
+        return {
+            "total_estudiantes": int(row["total_estudiantes"] or 0),
+            "hoy": {
+                "snack": {
+                    "elementary": int(row["snack_elementary"] or 0),
+                    "highschool": int(row["snack_highschool"] or 0),
+                    "total": int(row["total_snack"] or 0)
+                },
+                "lunch": {
+                    "elementary": int(row["lunch_elementary"] or 0),
+                    "highschool": int(row["lunch_highschool"] or 0),
+                    "total": int(row["total_lunch"] or 0)
+                },
+                "total_estudiantes_hoy": int(row["total_unicos"] or 0)
+            },
+            "planes": {
+                "total_estudiantes": int(row["total_con_plan"] or 0),
+                "total_consumieron_hoy": int(row["total_consumieron_hoy"] or 0),
+                "total_por_tipo": _json(row["total_por_tipo"]) or []
+            },
+            "consumo_mes": int(row["total_mes"] or 0),
+            "recientes": _json(row["registros"]) or []
+        }
+
+    except Exception as e:
+        logger.error(f"❌ Error al obtener el snapshot del dashboard en Supabase: {e}")
+        raise
+
+@cached(ttl=TTL_KPIS)
+@consulta_nombrada
+def get_kpis_periodo(db: Session, desde: date, hasta: date, granularidad: str = "day"):
+    """
+    Conteos por periodo (día, semana ISO o mes), plan, estado y nivel escolar
+    entre 'desde' y 'hasta' (inclusive). Se leen del rollup diario, así un año
+    escolar completo son unos pocos miles de renglones agregados por la PK
+    (fecha, ...) en vez de cientos de miles de registros.
+    """
+    if granularidad not in GRANULARIDADES:
+        raise ValueError(f"Granularidad inválida: {granularidad}")
+    if desde > hasta:
+        raise ValueError("'desde' no puede ser posterior a 'hasta'")
+
+    try:
+        query = text("""
+            SELECT
+                date_trunc(:granularidad, c.fecha::timestamp)::date AS periodo,
+                c.plan,
+                c.estado,
+                CASE
+                    WHEN c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 1 AND 5 THEN 'elementary'
+                    WHEN c.grado ~ '^[0-9]+$' AND (c.grado::INTEGER) BETWEEN 6 AND 12 THEN 'highschool'
+                    ELSE 'otro'
+                END AS nivel,
+                SUM(c.total) AS total
+            FROM public.consumo_diario_caf c
+            WHERE c.fecha >= :desde
+              AND c.fecha < :hasta
+            GROUP BY 1, 2, 3, 4
+            HAVING SUM(c.total) <> 0
+            ORDER BY 1, 2, 3, 4
+        """)
+
+        result = db.execute(query, {
+            "granularidad": GRANULARIDADES[granularidad],
+            "desde": desde,
+            "hasta": hasta + timedelta(days=1)
+        }).mappings().all()
+
+        return [
+            {
+                "periodo": row["periodo"],
+                "plan": row["plan"],
+                "estado": row["estado"],
+                "nivel": row["nivel"],
+                "total": int(row["total"] or 0)
+            }
+            for row in result
+        ]
+
+    except Exception as e:
+        logger.error(f"Error al calcular KPIs por periodo en Supabase: {e}")
+        raise
+
+def _roster_en_memoria() -> bool:
+    """
+    El roster en memoria sirve si está cargado y no es más viejo que la
+    versión de estudiantes_caf con la que el request armó su ETag (el
+    refresco corre cada ROSTER_REFRESCO_SEGUNDOS; mientras tanto, SQL).
+    """
+    if not (settings.ROSTER_EN_MEMORIA and indice_roster.listo()):
+        return False
+    version = version_request("estudiantes")
+    return version is None or indice_roster.version >= version
+
+@consulta_nombrada
 def get_estudiantes_con_plan(db: Session):
     """
     Obtiene estudiantes con tipo de alimentación distinto a 'NINGUNO'
     sin repetir por código de estudiante de forma alfabética.
+    Se sirve desde el roster en memoria cuando ya está cargado y al día.
     """
+    if _roster_en_memoria():
+        return indice_roster.estudiantes_con_plan()
+
     try:
         # 1️⃣ Cambiamos el esquema de 'cafeteria.' a 'public.'
         # 2️⃣ DISTINCT funciona igual, pero Postgres es más rápido si 
@@ -374,22 +781,30 @@ def get_estudiantes_con_plan(db: Session):
             ORDER BY e.nombre ASC
         """)
 
-        result = db.execute(query).mappings().all()
-        
-        # Opcional: Convertir a lista de diccionarios para asegurar 
-        # compatibilidad total con el JSON de FastAPI
-        return [dict(row) for row in result]
+        return filas_a_dicts(db.execute(query))
 
     except Exception as e:
         logger.error(f"Error al obtener estudiantes con plan en Supabase: {e}")
         raise
 
+@consulta_nombrada
 def buscar_estudiantes(
     db: Session, 
     codigo_estudiante: str = None, 
     nombre: str = None, 
-    grado: str = None
+    grado: str = None,
+    limit: int = None
 ):
+    """
+    Búsqueda de estudiantes con plan. Un código exacto se resuelve primero por
+    igualdad (índice único); si no hay coincidencia exacta se busca por
+    subcadena con pg_trgm, sin tildes ni mayúsculas, ordenando primero los que
+    empiezan por el término. 'limit' acota el resultado para typeahead.
+    Con el roster en memoria cargado no se consulta la base.
+    """
+    if _roster_en_memoria():
+        return indice_roster.buscar(codigo_estudiante, nombre, grado, limit)
+
     try:
         # 1️⃣ Cambiamos el esquema a 'public.'
         base_query = """
@@ -405,32 +820,63 @@ def buscar_estudiantes(
         conditions = []
         params = {}
 
-        # 2️⃣ En Postgres, ILIKE es excelente para búsquedas que ignoran mayúsculas/minúsculas
-        if codigo_estudiante:
-            conditions.append("e.codigo_estudiante ILIKE :codigo")
-            params["codigo"] = f"%{codigo_estudiante}%"
-
-        if nombre:
-            # 🟢 CAMBIO CLAVE: Eliminamos COLLATE y usamos ILIKE
-            # ILIKE en Postgres ignora mayúsculas y minúsculas por defecto
-            conditions.append("e.nombre ILIKE :nombre")
-            params["nombre"] = f"%{nombre}%"
-
         if grado:
             conditions.append("e.grado = :grado")
             params["grado"] = grado
 
+        # 2️⃣ Camino rápido: código exacto
+        if codigo_estudiante:
+            exacto_query = base_query + " AND e.codigo_estudiante = :codigo_exacto"
+            if conditions:
+                exacto_query += " AND " + " AND ".join(conditions)
+            if nombre:
+                exacto_query += " AND " + condicion_nombre("e.nombre", nombre, params)
+            exacto = filas_a_dicts(db.execute(
+                text(exacto_query), {**params, "codigo_exacto": codigo_estudiante.strip()}
+            ))
+            if exacto:
+                return exacto
+
+        # 3️⃣ Subcadena con índice trigram; los prefijos van primero.
+        #    Con menos de 3 caracteres no hay trigramas que indexar, así que
+        #    (typeahead) se busca solo por prefijo con el índice text_pattern_ops.
+        prioridad = []
+        if codigo_estudiante:
+            params["codigo_prefijo"] = prefijo_codigo(codigo_estudiante)
+            if len(codigo_estudiante.strip()) < 3:
+                conditions.append("e.codigo_estudiante LIKE :codigo_prefijo")
+            else:
+                conditions.append(condicion_codigo("e.codigo_estudiante", codigo_estudiante, params))
+            prioridad.append("b.codigo_estudiante ILIKE :codigo_prefijo")
+
+        if nombre:
+            params["nombre_prefijo"] = prefijo_nombre(nombre)
+            if len(normalizar(nombre)) < 3:
+                conditions.append("public.f_normalizar(e.nombre) LIKE :nombre_prefijo")
+            else:
+                conditions.append(condicion_nombre("e.nombre", nombre, params))
+            prioridad.append("public.f_normalizar(b.nombre) LIKE :nombre_prefijo")
+
         if conditions:
             base_query += " AND " + " AND ".join(conditions)
 
-        base_query += " ORDER BY e.nombre ASC"
+        prioridad_sql = " OR ".join(prioridad) if prioridad else "TRUE"
+        query = f"""
+            SELECT codigo_estudiante, nombre, grado, tipo_alimentacion
+            FROM (
+                SELECT b.*, ({prioridad_sql}) AS es_prefijo
+                FROM ({base_query}) b
+            ) s
+            ORDER BY es_prefijo DESC, nombre ASC
+        """
+
+        if limit:
+            query += " LIMIT :limit"
+            params["limit"] = limit
 
         # Ejecución
-        result = db.execute(text(base_query), params).mappings().all()
-        
-        # Convertimos a lista de diccionarios para asegurar compatibilidad
-        return [dict(row) for row in result]
+        return filas_a_dicts(db.execute(text(query), params))
 
     except Exception as e:
         logger.error(f"Error en buscador de estudiantes en Supabase: {e}")
-        raise
\ No newline at end of file
+        raise
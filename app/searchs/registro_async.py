@@ -0,0 +1,37 @@
+from functools import wraps
+
+from app.searchs import registro, validaciones
+from core.database import run_db
+
+# ------------------------------------------------------------------
+# Versiones async de las consultas de app/searchs/registro.py
+# ------------------------------------------------------------------
+# Esto es un puente, no consultas nativas: el SQL y la caché (@cached) viven
+# en un solo lugar (registro.py, sync) y cada función de aquí recibe la
+# sesión de core.database.get_session y delega con run_db. Sobre
+# AsyncSession (DB_ASYNC=true) corre con run_sync: asyncpg sin ocupar hilos,
+# pero el armado de filas sigue siendo el código sync dentro de un greenlet.
+# Sobre Session clásica va al threadpool. Una versión con 'await
+# db.execute' necesitaría duplicar el SQL y una caché async.
+
+
+def _async(funcion):
+    @wraps(funcion)
+    async def envoltura(db, *args, **kwargs):
+        return await run_db(db, funcion, *args, **kwargs)
+    return envoltura
+
+
+get_all_registers = _async(registro.get_all_registers)
+get_all_registers_all = _async(registro.get_all_registers_all)
+get_registers_filtered = _async(registro.get_registers_filtered)
+get_registers_today = _async(registro.get_registers_today)
+count_all_students = _async(registro.count_all_students)
+count_students_today = _async(registro.count_students_today)
+total_planalimenticio = _async(registro.total_planalimenticio)
+consumo_mes_actual = _async(registro.consumo_mes_actual)
+get_dashboard_snapshot = _async(registro.get_dashboard_snapshot)
+get_kpis_periodo = _async(registro.get_kpis_periodo)
+get_estudiantes_con_plan = _async(registro.get_estudiantes_con_plan)
+buscar_estudiantes = _async(registro.buscar_estudiantes)
+registrar_validaciones = _async(validaciones.registrar_validaciones)
@@ -0,0 +1,95 @@
+from datetime import date
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core.metricas import consulta_nombrada
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Rollup diario (public.consumo_diario_caf / public.consumidores_mes_caf)
+# ------------------------------------------------------------------
+# Los triggers de la migración 3 mantienen ambas tablas al día con cada
+# INSERT/UPDATE/DELETE sobre registros_validacion_caf. Esta reconstrucción
+# es el respaldo: recalcula un rango desde los registros crudos (p. ej. si
+# alguien cargó datos con los triggers deshabilitados).
+#
+# El grado y el tipo de alimentación salen del propio registro (foto del
+# momento en que se registró, migración 9), igual que en los triggers: un
+# cambio de grado posterior no mueve los consumos pasados en ninguno de los
+# dos caminos. Solo los registros anteriores a la migración 9 (grado NULL)
+# usan el grado actual de estudiantes_caf.
+
+
+@consulta_nombrada
+def reconstruir_consumo_diario(db: Session, desde: date, hasta: date) -> int:
+    """
+    Recalcula consumo_diario_caf para [desde, hasta] (inclusive). Devuelve
+    cuántos renglones diarios quedaron. No hace commit: lo decide quien
+    llama.
+    """
+    # El día es COALESCE(fecha, fecha_hora::date), igual que en el trigger.
+    # El WHERE es esa misma condición escrita como OR para que siga usando
+    # los índices de fecha y fecha_hora.
+    try:
+        params = {"desde": desde, "hasta": hasta}
+
+        db.execute(text("""
+            DELETE FROM public.consumo_diario_caf
+            WHERE fecha BETWEEN :desde AND :hasta
+        """), params)
+
+        resultado = db.execute(text("""
+            INSERT INTO public.consumo_diario_caf
+                (fecha, plan, estado, grado, tipo_alimentacion, total)
+            SELECT
+                COALESCE(rv.fecha, rv.fecha_hora::date), COALESCE(rv.plan, ''), COALESCE(rv.estado, ''),
+                COALESCE(rv.grado, e.grado, ''), COALESCE(rv.tipo_alimentacion, e.tipo_alimentacion, ''), COUNT(*)
+            FROM public.registros_validacion_caf rv
+            INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = rv.codigo_estudiante
+            WHERE (rv.fecha BETWEEN :desde AND :hasta
+                   OR (rv.fecha IS NULL
+                       AND rv.fecha_hora >= :desde
+                       AND rv.fecha_hora < CAST(:hasta AS date) + 1))
+            GROUP BY 1, 2, 3, 4, 5
+        """), params)
+
+        return resultado.rowcount
+
+    except Exception as e:
+        logger.error(f"Error al reconstruir el rollup diario en Supabase: {e}")
+        raise
+
+
+@consulta_nombrada
+def reconstruir_consumidores_mes(db: Session, mes_desde: date, mes_hasta: date) -> int:
+    """
+    Recalcula consumidores_mes_caf para los meses completos entre
+    'mes_desde' y 'mes_hasta' (inclusive). Devuelve cuántos consumidores
+    distintos quedaron. No hace commit: lo decide quien llama.
+    """
+    try:
+        params_mes = {
+            "mes_desde": mes_desde.replace(day=1),
+            "mes_hasta": mes_hasta.replace(day=1)
+        }
+        db.execute(text("""
+            DELETE FROM public.consumidores_mes_caf
+            WHERE mes BETWEEN :mes_desde AND :mes_hasta
+        """), params_mes)
+        resultado = db.execute(text("""
+            INSERT INTO public.consumidores_mes_caf (mes, codigo_estudiante)
+            SELECT DISTINCT date_trunc('month', rv.fecha_hora)::date, rv.codigo_estudiante
+            FROM public.registros_validacion_caf rv
+            INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = rv.codigo_estudiante
+            WHERE rv.fecha_hora >= :mes_desde
+              AND rv.fecha_hora < (CAST(:mes_hasta AS date) + INTERVAL '1 month')
+        """), params_mes)
+
+        return resultado.rowcount
+
+    except Exception as e:
+        logger.error(f"Error al reconstruir los consumidores del mes en Supabase: {e}")
+        raise
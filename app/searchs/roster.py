@@ -0,0 +1,318 @@
+from bisect import bisect_left
+from datetime import datetime
+from threading import Lock
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.searchs.busqueda import normalizar
+from core.etag import version_recursos
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Índice del roster en memoria (public.estudiantes_caf)
+# ------------------------------------------------------------------
+# La tabla es de un solo colegio (unos miles de filas) y cambia muy poco,
+# así que cada proceso guarda una copia compacta y responde búsquedas por
+# código, nombre o grado sin ir a Postgres. El refresco compara la versión
+# de la tabla (cambios_tablas_caf, la misma de los ETags): si no
+# cambió no se lee nada; si cambió se lee el roster y solo se aplican las
+# diferencias. Si la base está lenta o caída se sigue respondiendo con la
+# última copia.
+#
+# Los lectores nunca toman lock: cada refresco arma estructuras nuevas
+# (copy-on-write) y las publica con una sola asignación.
+#
+# Búsqueda por nombre sin recorrer todo el roster: un término de 3 o más
+# caracteres busca cada palabra en el mapa trigrama -> palabras (como el
+# índice pg_trgm de la consulta SQL) y uno más corto, que solo admite
+# prefijo, hace bisect sobre los nombres ordenados.
+
+
+def _trigramas(palabra: str) -> set:
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+
+class Estudiante:
+    __slots__ = ("codigo_estudiante", "nombre", "grado", "tipo_alimentacion", "nombre_norm", "codigo_norm")
+
+    def __init__(self, codigo_estudiante, nombre, grado, tipo_alimentacion):
+        self.codigo_estudiante = codigo_estudiante
+        self.nombre = nombre
+        self.grado = grado
+        self.tipo_alimentacion = tipo_alimentacion
+        self.nombre_norm = normalizar(nombre or "")
+        self.codigo_norm = (codigo_estudiante or "").lower()
+
+    def clave(self) -> tuple:
+        return (self.nombre, self.grado, self.tipo_alimentacion)
+
+    def tiene_plan(self) -> bool:
+        # Igual que "tipo_alimentacion != 'NINGUNO'" en SQL (NULL no pasa)
+        return self.tipo_alimentacion is not None and self.tipo_alimentacion != "NINGUNO"
+
+    def como_dict(self) -> dict:
+        return {
+            "codigo_estudiante": self.codigo_estudiante,
+            "nombre": self.nombre,
+            "grado": self.grado,
+            "tipo_alimentacion": self.tipo_alimentacion
+        }
+
+
+class _Estado:
+    """
+    Foto inmutable del índice; se reemplaza completa en cada refresco.
+    """
+    __slots__ = ("version", "por_codigo", "tokens", "trigramas", "por_grado", "con_plan", "nombres")
+
+    def __init__(self, version, por_codigo, tokens, trigramas, por_grado):
+        self.version = version
+        self.por_codigo = por_codigo          # codigo -> Estudiante
+        self.tokens = tokens                  # palabra normalizada -> frozenset(codigos)
+        self.trigramas = trigramas            # trigrama -> frozenset(palabras de 'tokens')
+        self.por_grado = por_grado            # grado -> frozenset(codigos)
+        # Con plan y ordenados como la consulta (ORDER BY nombre)
+        self.con_plan = sorted(
+            (e for e in por_codigo.values() if e.tiene_plan()),
+            key=lambda e: (e.nombre or "", e.codigo_estudiante)
+        )
+        # (nombre normalizado, codigo) de los con plan, para prefijos con bisect
+        self.nombres = sorted((e.nombre_norm, e.codigo_estudiante) for e in self.con_plan)
+
+    def con_prefijo(self, prefijo: str) -> set:
+        """Códigos cuyo nombre normalizado empieza por 'prefijo'."""
+        codigos = set()
+        for nombre_norm, codigo in self.nombres[bisect_left(self.nombres, (prefijo,)):]:
+            if not nombre_norm.startswith(prefijo):
+                break
+            codigos.add(codigo)
+        return codigos
+
+    def con_subcadena(self, palabra: str) -> set:
+        """
+        Códigos con alguna palabra del nombre que contiene 'palabra' (3 o
+        más caracteres): solo se revisan las palabras con todos sus trigramas.
+        """
+        palabras = None
+        for trigrama in _trigramas(palabra):
+            del_trigrama = self.trigramas.get(trigrama)
+            if not del_trigrama:
+                return set()
+            palabras = set(del_trigrama) if palabras is None else palabras & del_trigrama
+        codigos = set()
+        for token in palabras:
+            if palabra in token:
+                codigos |= self.tokens[token]
+        return codigos
+
+
+def _aplicar(indice: dict, clave, codigo, agregar: bool) -> None:
+    actual = indice.get(clave, frozenset())
+    nuevo = actual | {codigo} if agregar else actual - {codigo}
+    if nuevo:
+        indice[clave] = nuevo
+    else:
+        indice.pop(clave, None)
+
+
+class IndiceRoster:
+
+    def __init__(self):
+        self._estado = None
+        self._lock_refresco = Lock()
+        self.ultima_actualizacion = None
+        self.ultimo_error = None
+
+    # -- Estado ------------------------------------------------------
+    def listo(self) -> bool:
+        return self._estado is not None
+
+    @property
+    def version(self):
+        estado = self._estado
+        return estado.version if estado else None
+
+    def estadisticas(self) -> dict:
+        estado = self._estado
+        return {
+            "cargado": estado is not None,
+            "version": estado.version if estado else None,
+            "estudiantes": len(estado.por_codigo) if estado else 0,
+            "con_plan": len(estado.con_plan) if estado else 0,
+            "tokens": len(estado.tokens) if estado else 0,
+            "ultima_actualizacion": self.ultima_actualizacion.isoformat() if self.ultima_actualizacion else None,
+            "ultimo_error": self.ultimo_error
+        }
+
+    # -- Refresco ----------------------------------------------------
+    def refrescar(self, db: Session, forzar: bool = False) -> bool:
+        """
+        Trae los cambios del roster si la versión de la tabla cambió.
+        Devuelve True si el índice se modificó. No hace commit.
+        """
+        with self._lock_refresco:
+            try:
+                version = version_recursos(db, ("estudiantes",))["estudiantes"]
+                anterior = self._estado
+                if anterior is not None and anterior.version == version and not forzar:
+                    return False
+
+                inicio = time.perf_counter()
+                filas = db.execute(text("""
+                    SELECT codigo_estudiante, nombre, grado, tipo_alimentacion
+                    FROM public.estudiantes_caf
+                """)).all()
+
+                nuevos = {fila[0]: Estudiante(*fila) for fila in filas if fila[0] is not None}
+                self._estado = self._diferencias(anterior, nuevos, version)
+                self.ultima_actualizacion = datetime.now()
+                self.ultimo_error = None
+
+                logger.info(
+                    f"📇 Roster en memoria v{version}: {len(nuevos)} estudiantes "
+                    f"({(time.perf_counter() - inicio) * 1000:.1f} ms)"
+                )
+                return True
+
+            except Exception as e:
+                self.ultimo_error = str(e)
+                logger.error(f"Error al refrescar el roster en memoria desde Supabase: {e}")
+                raise
+
+    @staticmethod
+    def _diferencias(anterior, nuevos: dict, version) -> _Estado:
+        """
+        Aplica sobre la foto anterior solo altas, bajas y cambios
+        (copy-on-write: la foto anterior no se toca).
+        """
+        if anterior is None:
+            por_codigo, tokens, trigramas, por_grado = {}, {}, {}, {}
+        else:
+            por_codigo = dict(anterior.por_codigo)
+            tokens = dict(anterior.tokens)
+            trigramas = dict(anterior.trigramas)
+            por_grado = dict(anterior.por_grado)
+        tocados = set()
+
+        def quitar(estudiante):
+            del por_codigo[estudiante.codigo_estudiante]
+            for token in set(estudiante.nombre_norm.split()):
+                _aplicar(tokens, token, estudiante.codigo_estudiante, False)
+                tocados.add(token)
+            _aplicar(por_grado, estudiante.grado, estudiante.codigo_estudiante, False)
+
+        def poner(estudiante):
+            por_codigo[estudiante.codigo_estudiante] = estudiante
+            for token in set(estudiante.nombre_norm.split()):
+                _aplicar(tokens, token, estudiante.codigo_estudiante, True)
+                tocados.add(token)
+            _aplicar(por_grado, estudiante.grado, estudiante.codigo_estudiante, True)
+
+        for codigo in [c for c in por_codigo if c not in nuevos]:
+            quitar(por_codigo[codigo])
+
+        for codigo, estudiante in nuevos.items():
+            actual = por_codigo.get(codigo)
+            if actual is not None:
+                if actual.clave() == estudiante.clave():
+                    continue
+                quitar(actual)
+            poner(estudiante)
+
+        # Solo cambian los trigramas de las palabras que aparecieron o desaparecieron
+        for token in tocados:
+            presente = token in tokens
+            if anterior is not None and presente == (token in anterior.tokens):
+                continue
+            for trigrama in _trigramas(token):
+                _aplicar(trigramas, trigrama, token, presente)
+
+        return _Estado(version, por_codigo, tokens, trigramas, por_grado)
+
+    # -- Consultas ---------------------------------------------------
+    def estudiantes_con_plan(self) -> list:
+        return [e.como_dict() for e in self._estado.con_plan]
+
+    def buscar(self, codigo_estudiante: str = None, nombre: str = None, grado: str = None, limit: int = None) -> list:
+        """
+        Mismo contrato que registro.buscar_estudiantes: código exacto primero;
+        si no, subcadena (prefijo con menos de 3 caracteres) sin tildes ni
+        mayúsculas, con los que empiezan por el término primero.
+        """
+        estado = self._estado
+
+        nombre_norm = normalizar(nombre) if nombre else None
+
+        def pasa_filtros(e) -> bool:
+            return e.tiene_plan() and (not grado or e.grado == grado)
+
+        # 1️⃣ Camino rápido: código exacto
+        if codigo_estudiante:
+            exacto = estado.por_codigo.get(codigo_estudiante.strip())
+            if exacto is not None and pasa_filtros(exacto) and (
+                not nombre_norm or nombre_norm in exacto.nombre_norm
+            ):
+                return [exacto.como_dict()]
+
+        # 2️⃣ Candidatos: por grado y por el nombre (prefijo o palabras)
+        candidatos = None
+        if grado:
+            candidatos = set(estado.por_grado.get(grado, ()))
+        if nombre_norm and len(nombre_norm) < 3:
+            codigos = estado.con_prefijo(nombre_norm)
+            candidatos = codigos if candidatos is None else candidatos & codigos
+            if not candidatos:
+                return []
+        elif nombre_norm:
+            # Cada palabra del término cae dentro de una sola palabra del nombre.
+            # Las de menos de 3 caracteres no tienen trigramas: las cubre el paso 3.
+            for palabra in nombre_norm.split():
+                if len(palabra) < 3:
+                    continue
+                codigos = estado.con_subcadena(palabra)
+                candidatos = codigos if candidatos is None else candidatos & codigos
+                if not candidatos:
+                    return []
+
+        if candidatos is None:
+            universo = estado.con_plan
+        else:
+            universo = [estado.por_codigo[c] for c in candidatos]
+
+        # 3️⃣ Verificación exacta de cada condición y prioridad por prefijo
+        codigo_norm = codigo_estudiante.strip().lower() if codigo_estudiante else None
+        prefijos, resto = [], []
+        for e in universo:
+            if not pasa_filtros(e):
+                continue
+            # Sin término de texto la prioridad es la misma para todos ("TRUE")
+            es_prefijo = codigo_norm is None and nombre_norm is None
+            if codigo_norm is not None:
+                if len(codigo_norm) < 3:
+                    # Igual que LIKE 'term%' (sensible a mayúsculas)
+                    if not e.codigo_estudiante.startswith(codigo_estudiante.strip()):
+                        continue
+                elif codigo_norm not in e.codigo_norm:
+                    continue
+                es_prefijo = e.codigo_norm.startswith(codigo_norm)
+            if nombre_norm is not None:
+                if len(nombre_norm) < 3:
+                    if not e.nombre_norm.startswith(nombre_norm):
+                        continue
+                elif nombre_norm not in e.nombre_norm:
+                    continue
+                es_prefijo = es_prefijo or e.nombre_norm.startswith(nombre_norm)
+            (prefijos if es_prefijo else resto).append(e)
+
+        orden = lambda e: (e.nombre or "", e.codigo_estudiante)
+        resultado = sorted(prefijos, key=orden) + sorted(resto, key=orden)
+        if limit:
+            resultado = resultado[:limit]
+        return [e.como_dict() for e in resultado]
+
+
+indice_roster = IndiceRoster()
@@ -0,0 +1,164 @@
+from functools import lru_cache
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from core.metricas import consulta_nombrada
+from core.respuestas import filas_a_dicts
+from core.schema import estructura_registros
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Ingesta por lotes de validaciones (estaciones de escáner)
+# ------------------------------------------------------------------
+# Un lote entero se resuelve en UNA sentencia: los eventos llegan como tres
+# arreglos paralelos (unnest ... WITH ORDINALITY conserva el orden), se
+# cruzan con estudiantes_caf para aplicar las reglas de elegibilidad, se
+# pasa a VALIDADO el "NO RECLAMO" que haya dejado el scheduler y lo demás se
+# inserta con ON CONFLICT sobre el índice único (codigo_estudiante, fecha,
+# plan) de la migración 6. Si ese índice todavía no existe (duplicados sin
+# depurar) se inserta con NOT EXISTS en lugar de ON CONFLICT; la columna
+# grado solo se escribe si ya corrió la migración 9. Cada evento recibe su
+# resultado:
+#   INSERTADO      no había registro ese día para ese plan
+#   ACTUALIZADO    había un NO RECLAMO y quedó VALIDADO
+#   DUPLICADO      ya estaba VALIDADO (o se repite dentro del mismo lote)
+#   NO_ELEGIBLE    el plan no aplica a su tipo de alimentación o grado
+#   NO_ENCONTRADO  el código no existe en estudiantes_caf
+
+# Mismas reglas que ejecutar_registro_snack / ejecutar_registro_lunch (main.py)
+CODIGOS_EXCLUIDOS = ["0000"]
+GRADOS_EXCLUIDOS = ["K2", "K3", "K4", "K5", "1", "2"]
+TIPOS_EXCLUIDOS = {
+    "SNACK": ["NINGUNO", "ALMUERZO", "SOLO ALMUERZO"],
+    "LUNCH": ["NINGUNO", "REFRIGERIO", "SOLO REFRIGERIO"],
+}
+
+@lru_cache(maxsize=None)
+def _sql_lote(grado: bool, unico: bool):
+    """
+    La sentencia del lote según el esquema (ver core.schema.estructura_registros).
+    """
+    columna_grado = "grado, " if grado else ""
+    valor_grado = "p.grado, " if grado else ""
+    if unico:
+        sin_repetir = "ON CONFLICT (codigo_estudiante, fecha, plan) DO NOTHING"
+    else:
+        sin_repetir = """AND NOT EXISTS (
+            SELECT 1 FROM public.registros_validacion_caf r
+            WHERE r.codigo_estudiante = p.codigo_estudiante
+              AND r.fecha = p.fecha
+              AND r.plan = p.plan
+        )"""
+    return text(f"""
+    WITH entrada AS (
+        SELECT
+            i.n,
+            i.codigo_estudiante,
+            i.plan,
+            i.fecha_hora,
+            i.fecha_hora::date AS fecha
+        FROM unnest(
+            CAST(:codigos AS text[]),
+            CAST(:planes AS text[]),
+            CAST(:fechas AS timestamp[])
+        ) WITH ORDINALITY AS i(codigo_estudiante, plan, fecha_hora, n)
+    ),
+    evaluada AS (
+        SELECT
+            en.*,
+            e.codigo_estudiante IS NOT NULL AS existe,
+            e.nombre,
+            e.tipo_alimentacion,
+            e.grado,
+            COALESCE(
+                e.codigo_estudiante <> ALL(CAST(:codigos_excluidos AS text[]))
+                AND e.grado <> ALL(CAST(:grados_excluidos AS text[]))
+                AND CASE en.plan
+                    WHEN 'SNACK' THEN e.tipo_alimentacion <> ALL(CAST(:tipos_snack AS text[]))
+                    WHEN 'LUNCH' THEN e.tipo_alimentacion <> ALL(CAST(:tipos_lunch AS text[]))
+                    ELSE FALSE
+                END,
+                FALSE
+            ) AS elegible
+        FROM entrada en
+        LEFT JOIN public.estudiantes_caf e ON e.codigo_estudiante = en.codigo_estudiante
+    ),
+    -- Dentro del lote cuenta la primera lectura de cada (estudiante, fecha, plan)
+    primeros AS (
+        SELECT DISTINCT ON (codigo_estudiante, fecha, plan) *
+        FROM evaluada
+        WHERE elegible
+        ORDER BY codigo_estudiante, fecha, plan, n
+    ),
+    actualizados AS (
+        UPDATE public.registros_validacion_caf r
+        SET estado = 'VALIDADO', fecha_hora = p.fecha_hora
+        FROM primeros p
+        WHERE r.codigo_estudiante = p.codigo_estudiante
+          AND r.fecha = p.fecha
+          AND r.plan = p.plan
+          AND r.estado = 'NO RECLAMO'
+        RETURNING r.id, p.n
+    ),
+    insertados AS (
+        INSERT INTO public.registros_validacion_caf (
+            codigo_estudiante, nombre, tipo_alimentacion, {columna_grado}plan, estado, fecha_hora, fecha
+        )
+        SELECT p.codigo_estudiante, p.nombre, p.tipo_alimentacion, {valor_grado}p.plan, 'VALIDADO', p.fecha_hora, p.fecha
+        FROM primeros p
+        WHERE NOT EXISTS (SELECT 1 FROM actualizados a WHERE a.n = p.n)
+        {sin_repetir}
+        RETURNING id, codigo_estudiante, fecha, plan
+    )
+    SELECT
+        ev.n,
+        ev.codigo_estudiante,
+        ev.plan,
+        ev.fecha_hora,
+        CASE
+            WHEN NOT ev.existe THEN 'NO_ENCONTRADO'
+            WHEN NOT ev.elegible THEN 'NO_ELEGIBLE'
+            WHEN a.id IS NOT NULL THEN 'ACTUALIZADO'
+            WHEN i.id IS NOT NULL THEN 'INSERTADO'
+            ELSE 'DUPLICADO'
+        END AS resultado,
+        COALESCE(a.id, i.id) AS id
+    FROM evaluada ev
+    LEFT JOIN primeros p ON p.n = ev.n
+    -- Sin el índice único puede haber más de un NO RECLAMO por evento
+    LEFT JOIN (SELECT DISTINCT ON (n) n, id FROM actualizados ORDER BY n, id) a ON a.n = p.n
+    LEFT JOIN insertados i
+        ON p.n IS NOT NULL
+       AND i.codigo_estudiante = p.codigo_estudiante
+       AND i.fecha = p.fecha
+       AND i.plan = p.plan
+    ORDER BY ev.n
+""")
+
+
+@consulta_nombrada
+def registrar_validaciones(db: Session, eventos: list) -> list:
+    """
+    Registra un lote de eventos (codigo_estudiante, plan, fecha_hora) en un
+    solo round trip y devuelve el resultado de cada uno, en el mismo orden.
+    No hace commit: lo decide quien llama.
+    """
+    try:
+        params = {
+            "codigos": [evento.codigo_estudiante for evento in eventos],
+            "planes": [evento.plan for evento in eventos],
+            "fechas": [evento.fecha_hora for evento in eventos],
+            "codigos_excluidos": CODIGOS_EXCLUIDOS,
+            "grados_excluidos": GRADOS_EXCLUIDOS,
+            "tipos_snack": TIPOS_EXCLUIDOS["SNACK"],
+            "tipos_lunch": TIPOS_EXCLUIDOS["LUNCH"],
+        }
+        estructura = estructura_registros(db)
+        return filas_a_dicts(db.execute(_sql_lote(estructura["grado"], estructura["unico"]), params))
+
+    except Exception as e:
+        logger.error(f"Error al registrar lote de validaciones en Supabase: {e}")
+        raise
@@ -0,0 +1,474 @@
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Driver de carga del benchmark
+# ------------------------------------------------------------------
+# Golpea cada endpoint de /registro/* con concurrencia fija (N hilos con
+# conexiones keep-alive) y corre los dos jobs del scheduler (SNACK y LUNCH)
+# en este mismo proceso contra la misma base. Por escenario reporta
+# throughput, p50/p95/p99 y errores; del servidor, el pico de RSS (VmHWM de
+# /proc). El resultado es un JSON con el commit de git para comparar
+# corridas con bench/comparar.py.
+#
+#   python -m bench.sembrar --estudiantes 5000 --anios 2
+#   python -m bench.carga --lanzar --concurrencia 8 --peticiones 200
+#
+# Con --lanzar se levanta uvicorn (un worker) y se mide su RSS; si la API ya
+# está corriendo, usar --url y opcionalmente --pid para el RSS.
+#
+# Los escenarios de escritura (validaciones/batch, estudiantes/import) y los
+# jobs modifican la base: volver a sembrar con la misma semilla antes de
+# cada corrida que se quiera comparar.
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORIO_RESULTADOS = os.path.join(RAIZ, "bench", "resultados")
+
+TAMANO_LOTE = 50
+TAMANO_IMPORT = 200
+
+
+# ------------------------------------------------------------------
+# Cliente HTTP (una conexión keep-alive por hilo)
+# ------------------------------------------------------------------
+class Cliente:
+
+    def __init__(self, url: str, timeout: float):
+        partes = urlsplit(url)
+        self.host = partes.hostname
+        self.puerto = partes.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conexion(self) -> http.client.HTTPConnection:
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=self.timeout)
+            conexion.connect()
+            # Sin Nagle: http.client manda encabezados y cuerpo por separado
+            conexion.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.conexion = conexion
+        return conexion
+
+    def _cerrar(self) -> None:
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is not None:
+            conexion.close()
+            self._local.conexion = None
+
+    def pedir(self, metodo: str, ruta: str, cuerpo: bytes = None, encabezados: dict = None, solo_encabezados: bool = False):
+        """
+        (status, bytes del cuerpo, encabezados). Con solo_encabezados no lee
+        el cuerpo y cierra la conexión (para /stream).
+        """
+        reutilizada = getattr(self._local, "conexion", None) is not None
+        try:
+            conexion = self._conexion()
+            conexion.request(metodo, ruta, body=cuerpo, headers=encabezados or {})
+            respuesta = conexion.getresponse()
+            if solo_encabezados:
+                self._cerrar()
+                return respuesta.status, b"", dict(respuesta.getheaders())
+            contenido = respuesta.read()
+            if respuesta.getheader("connection", "").lower() == "close":
+                self._cerrar()
+            return respuesta.status, contenido, dict(respuesta.getheaders())
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # El servidor cerró una conexión keep-alive ociosa: un reintento
+            self._cerrar()
+            if not reutilizada:
+                raise
+            return self.pedir(metodo, ruta, cuerpo, encabezados, solo_encabezados)
+        except Exception:
+            self._cerrar()
+            raise
+
+    def json(self, metodo: str, ruta: str, datos=None):
+        cuerpo = json.dumps(datos).encode() if datos is not None else None
+        encabezados = {"Content-Type": "application/json"} if cuerpo else {}
+        status_code, contenido, _ = self.pedir(metodo, ruta, cuerpo, encabezados)
+        if status_code >= 400:
+            raise RuntimeError(f"{metodo} {ruta} -> {status_code}: {contenido[:200]!r}")
+        return json.loads(contenido)
+
+
+def _con_query(ruta: str, **params) -> str:
+    params = {clave: valor for clave, valor in params.items() if valor is not None}
+    return f"{ruta}?{urlencode(params)}" if params else ruta
+
+
+def _multipart(nombre_archivo: str, contenido: bytes) -> tuple:
+    limite = f"----bench{random.getrandbits(64):016x}"
+    cuerpo = (
+        f"--{limite}\r\n"
+        f'Content-Disposition: form-data; name="archivo"; filename="{nombre_archivo}"\r\n'
+        f"Content-Type: text/csv\r\n\r\n"
+    ).encode() + contenido + f"\r\n--{limite}--\r\n".encode()
+    return cuerpo, {"Content-Type": f"multipart/form-data; boundary={limite}"}
+
+
+# ------------------------------------------------------------------
+# Escenarios
+# ------------------------------------------------------------------
+def preparar_contexto(cliente: Cliente) -> dict:
+    """
+    Datos reales del servidor para armar parámetros: códigos y nombres del
+    roster, un ETag vigente y un reporte ya generado para /descargar.
+    """
+    estudiantes = cliente.json("GET", "/registro/estudiantes-con-plan")["data"]
+    if not estudiantes:
+        raise RuntimeError("No hay estudiantes con plan: correr primero python -m bench.sembrar")
+
+    hoy = date.today()
+    _, _, encabezados = cliente.pedir("GET", "/registro/dashboard/snapshot")
+    etag = {clave.lower(): valor for clave, valor in encabezados.items()}.get("etag")
+
+    solicitud = {"formato": "csv", "fecha_inicio": (hoy - timedelta(days=30)).isoformat(), "fecha_fin": hoy.isoformat()}
+    reporte = cliente.json("POST", "/registro/reportes", solicitud)["data"]
+    limite = time.monotonic() + 300
+    while reporte["estado"] not in ("LISTO", "ERROR") and time.monotonic() < limite:
+        time.sleep(0.5)
+        reporte = cliente.json("GET", f"/registro/reportes/{reporte['id']}")["data"]
+    if reporte["estado"] != "LISTO":
+        logger.warning(f"⚠️ El reporte de prueba quedó en {reporte['estado']}; /descargar medirá errores")
+
+    return {
+        "hoy": hoy,
+        "codigos": [e["codigo_estudiante"] for e in estudiantes],
+        "palabras": sorted({palabra for e in estudiantes for palabra in (e["nombre"] or "").split() if len(palabra) > 3}),
+        "estudiantes": estudiantes,
+        "etag": etag,
+        "solicitud_reporte": solicitud,
+        "id_reporte": reporte["id"],
+    }
+
+
+def escenarios(ctx: dict) -> list:
+    """
+    Cada escenario: nombre, peso (fracción de --peticiones) y una función
+    rng -> (método, ruta, cuerpo, encabezados, solo_encabezados).
+    """
+    hoy = ctx["hoy"]
+    hace = lambda dias: (hoy - timedelta(days=dias)).isoformat()
+
+    def get(ruta, **params):
+        return lambda rng: ("GET", _con_query(ruta, **params), None, {}, False)
+
+    def lote(rng):
+        ahora = datetime.now().replace(microsecond=0)
+        eventos = [
+            {"codigo_estudiante": rng.choice(ctx["codigos"]), "plan": rng.choice(["SNACK", "LUNCH"]), "fecha_hora": ahora.isoformat()}
+            for _ in range(TAMANO_LOTE)
+        ]
+        return "POST", "/registro/validaciones/batch", json.dumps({"eventos": eventos}).encode(), {"Content-Type": "application/json"}, False
+
+    def importacion(rng):
+        muestra = rng.sample(ctx["estudiantes"], min(TAMANO_IMPORT, len(ctx["estudiantes"])))
+        filas = ["codigo_estudiante,nombre,grado,tipo_alimentacion"] + [
+            f"{e['codigo_estudiante']},\"{e['nombre']}\",{e.get('grado') or ''},{rng.choice(['COMPLETO', 'SOLO ALMUERZO', 'SOLO REFRIGERIO'])}"
+            for e in muestra
+        ]
+        cuerpo, encabezados = _multipart("roster.csv", "\n".join(filas).encode())
+        return "POST", "/registro/estudiantes/import", cuerpo, encabezados, False
+
+    return [
+        ("recientes", 1, get("/registro/")),
+        ("all_pagina_1", 1, get("/registro/all", page=1, size=50)),
+        ("all_pagina_profunda", 0.5, lambda rng: get("/registro/all", page=rng.randint(50, 200), size=50)(rng)),
+        ("hoy", 1, get("/registro/hoy")),
+        ("hoy_estudiante", 1, lambda rng: get("/registro/hoy", codigo_estudiante=rng.choice(ctx["codigos"]))(rng)),
+        ("filtrar_mes", 1, get("/registro/filtrar", fecha_inicio=hace(30), fecha_fin=hace(0), plan="TODOS", estado="VALIDADO")),
+        ("filtrar_nombre", 1, lambda rng: get("/registro/filtrar", nombre=rng.choice(ctx["palabras"]).lower()[:5])(rng)),
+        ("filtrar_grado", 1, lambda rng: get("/registro/filtrar", grado=str(rng.randint(3, 11)), fecha_inicio=hace(90))(rng)),
+        ("excel_semana", 0.1, get("/registro/excel", fecha_inicio=hace(7), fecha_fin=hace(0))),
+        ("excel_all", 0.02, get("/registro/excel/all")),
+        ("export_csv_mes", 0.1, get("/registro/export", format="csv", fecha_inicio=hace(30))),
+        ("export_ndjson_gzip_mes", 0.1, get("/registro/export", format="ndjson", gzip="true", fecha_inicio=hace(30))),
+        ("reportes_solicitar", 0.5, lambda rng: ("POST", "/registro/reportes", json.dumps(ctx["solicitud_reporte"]).encode(), {"Content-Type": "application/json"}, False)),
+        ("reportes_estado", 1, get(f"/registro/reportes/{ctx['id_reporte']}")),
+        ("reportes_descargar", 0.1, get(f"/registro/reportes/{ctx['id_reporte']}/descargar")),
+        ("total_estudiantes", 1, get("/registro/total-estudiantes")),
+        ("total_estudiantes_hoy", 1, get("/registro/total-estudiantes-hoy")),
+        ("total_planes", 1, get("/registro/total-planes")),
+        ("consumo_mes", 1, get("/registro/dashboard/consumo-mes")),
+        ("snapshot", 1, get("/registro/dashboard/snapshot")),
+        ("snapshot_304", 1, lambda rng: ("GET", "/registro/dashboard/snapshot", None, {"If-None-Match": ctx["etag"] or ""}, False)),
+        ("kpis_trimestre_semana", 1, get("/registro/kpis", desde=hace(90), hasta=hace(0), granularidad="week")),
+        ("kpis_anio_mes", 0.5, get("/registro/kpis", desde=hace(365), hasta=hace(0), granularidad="month")),
+        ("estudiantes_con_plan", 1, get("/registro/estudiantes-con-plan")),
+        ("buscar_nombre", 1, lambda rng: get("/registro/buscar-estudiantes", nombre=rng.choice(ctx["palabras"]).lower()[:4], limit=20)(rng)),
+        ("buscar_codigo", 1, lambda rng: get("/registro/buscar-estudiantes", codigo_estudiante=rng.choice(ctx["codigos"])[:4], limit=20)(rng)),
+        ("validaciones_batch", 0.5, lote),
+        ("estudiantes_import", 0.05, importacion),
+        ("cache_estadisticas", 0.2, get("/registro/cache/estadisticas")),
+        ("roster_estado", 0.2, get("/registro/roster/estado")),
+        ("stream_conexion", 0.2, lambda rng: ("GET", "/registro/stream", None, {}, True)),
+    ]
+
+
+# ------------------------------------------------------------------
+# Medición
+# ------------------------------------------------------------------
+def percentil(valores: list, p: float) -> float:
+    # Rango más cercano sobre la lista ordenada
+    if not valores:
+        return None
+    indice = max(0, math.ceil(p / 100 * len(valores)) - 1)
+    return valores[indice]
+
+
+def resumir(latencias: list, errores: int, duracion: float) -> dict:
+    ordenadas = sorted(latencias)
+    ms = lambda segundos: round(segundos * 1000, 2) if segundos is not None else None
+    return {
+        "peticiones": len(latencias) + errores,
+        "errores": errores,
+        "duracion_s": round(duracion, 3),
+        "rps": round(len(latencias) / duracion, 2) if duracion > 0 else None,
+        "p50_ms": ms(percentil(ordenadas, 50)),
+        "p95_ms": ms(percentil(ordenadas, 95)),
+        "p99_ms": ms(percentil(ordenadas, 99)),
+        "max_ms": ms(ordenadas[-1] if ordenadas else None),
+    }
+
+
+def correr_escenario(cliente: Cliente, generador, peticiones: int, concurrencia: int, semilla: int) -> dict:
+    latencias = []
+    errores = [0]
+    lock = threading.Lock()
+    contador = iter(range(peticiones))
+
+    def trabajador(numero: int) -> None:
+        rng = random.Random(semilla * 1000 + numero)
+        while True:
+            with lock:
+                if next(contador, None) is None:
+                    return
+            metodo, ruta, cuerpo, encabezados, solo_encabezados = generador(rng)
+            inicio = time.perf_counter()
+            try:
+                status_code, _, _ = cliente.pedir(metodo, ruta, cuerpo, encabezados, solo_encabezados)
+                ok = status_code < 400
+            except Exception:
+                ok = False
+            transcurrido = time.perf_counter() - inicio
+            with lock:
+                if ok:
+                    latencias.append(transcurrido)
+                else:
+                    errores[0] += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(trabajador, range(concurrencia)))
+    return resumir(latencias, errores[0], time.perf_counter() - inicio)
+
+
+def correr_jobs(repeticiones: int) -> list:
+    """
+    Corre ejecutar_registro_snack / ejecutar_registro_lunch en este proceso.
+    Antes de cada repetición borra los NO RECLAMO de hoy de ese plan para
+    que el job vuelva a insertar lo mismo (solo en la base del benchmark).
+    """
+    from sqlalchemy import text
+
+    import main as aplicacion
+    from core.database import SessionLocal
+
+    resultados = []
+    for nombre, plan, job in (
+        ("job_snack", "SNACK", aplicacion.ejecutar_registro_snack),
+        ("job_lunch", "LUNCH", aplicacion.ejecutar_registro_lunch),
+    ):
+        latencias = []
+        insertados = 0
+        for _ in range(repeticiones):
+            db = SessionLocal()
+            try:
+                db.execute(
+                    text("DELETE FROM public.registros_validacion_caf WHERE fecha = CURRENT_DATE AND plan = :plan AND estado = 'NO RECLAMO'"),
+                    {"plan": plan}
+                )
+                db.commit()
+                inicio = time.perf_counter()
+                job()
+                latencias.append(time.perf_counter() - inicio)
+                insertados = db.execute(
+                    text("SELECT COUNT(*) FROM public.registros_validacion_caf WHERE fecha = CURRENT_DATE AND plan = :plan AND estado = 'NO RECLAMO'"),
+                    {"plan": plan}
+                ).scalar()
+            finally:
+                db.close()
+        resultado = resumir(latencias, 0, sum(latencias))
+        resultados.append({"nombre": nombre, "filas_insertadas": insertados, **resultado})
+        logger.info(f"⏱️ {nombre}: p50 {resultado['p50_ms']} ms ({insertados} filas)")
+    return resultados
+
+
+# ------------------------------------------------------------------
+# Servidor y entorno
+# ------------------------------------------------------------------
+def _leer_status(pid: int, campo: str) -> int:
+    # kB de un campo de /proc/<pid>/status (VmHWM = pico de RSS, VmRSS = actual)
+    try:
+        with open(f"/proc/{pid}/status") as archivo:
+            for linea in archivo:
+                if linea.startswith(campo + ":"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _procesos(pid: int) -> list:
+    # El proceso y sus hijos directos (uvicorn --workers N)
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as archivo:
+            return [pid] + [int(hijo) for hijo in archivo.read().split()]
+    except OSError:
+        return [pid]
+
+
+def memoria_mb(pid: int, campo: str) -> float:
+    if not pid:
+        return None
+    return round(sum(_leer_status(p, campo) for p in _procesos(pid)) / 1024, 1)
+
+
+def lanzar_servidor(puerto: int) -> subprocess.Popen:
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(puerto), "--log-level", "warning"],
+        cwd=RAIZ
+    )
+    cliente = Cliente(f"http://127.0.0.1:{puerto}", timeout=5)
+    limite = time.monotonic() + 120
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"uvicorn terminó con código {proceso.returncode}")
+        try:
+            if cliente.pedir("GET", "/registro/roster/estado")[0] == 200:
+                return proceso
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proceso.terminate()
+    raise RuntimeError("uvicorn no respondió en 120 s")
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def entorno() -> dict:
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "commit_corto": _git("rev-parse", "--short", "HEAD"),
+        "arbol_modificado": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de /registro/* y de los jobs del scheduler")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="URL base de la API")
+    parser.add_argument("--lanzar", action="store_true", help="Levantar uvicorn (un worker) en --puerto y medir su RSS")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--pid", type=int, help="PID del servidor ya corriendo (para el RSS)")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Peticiones simultáneas")
+    parser.add_argument("--peticiones", type=int, default=200, help="Peticiones por escenario (los pesados usan una fracción)")
+    parser.add_argument("--calentamiento", type=int, default=3, help="Peticiones sin medir antes de cada escenario")
+    parser.add_argument("--repeticiones-jobs", type=int, default=3, help="Corridas de cada job del scheduler (0 = no correrlos)")
+    parser.add_argument("--solo", nargs="*", help="Correr solo estos escenarios (por nombre)")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout por petición (s)")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto bench/resultados/<fecha>_<commit>.json)")
+    args = parser.parse_args()
+
+    proceso = lanzar_servidor(args.puerto) if args.lanzar else None
+    url = f"http://127.0.0.1:{args.puerto}" if args.lanzar else args.url
+    pid = proceso.pid if proceso else args.pid
+
+    try:
+        cliente = Cliente(url, timeout=args.timeout)
+        ctx = preparar_contexto(cliente)
+        logger.info(f"🎯 {url}: {len(ctx['codigos'])} estudiantes con plan, concurrencia {args.concurrencia}")
+
+        resultados = []
+        for indice, (nombre, peso, generador) in enumerate(escenarios(ctx)):
+            if args.solo and nombre not in args.solo:
+                continue
+            peticiones = max(args.concurrencia, int(args.peticiones * peso))
+            rng = random.Random(args.semilla)
+            for _ in range(args.calentamiento):
+                try:
+                    metodo, ruta, cuerpo, encabezados, solo_encabezados = generador(rng)
+                    cliente.pedir(metodo, ruta, cuerpo, encabezados, solo_encabezados)
+                except Exception:
+                    pass
+            resultado = correr_escenario(cliente, generador, peticiones, args.concurrencia, args.semilla + indice)
+            resultado["rss_servidor_mb"] = memoria_mb(pid, "VmRSS")
+            resultados.append({"nombre": nombre, **resultado})
+            logger.info(
+                f"⏱️ {nombre}: {resultado['rps']} req/s, p50 {resultado['p50_ms']} ms, "
+                f"p95 {resultado['p95_ms']} ms, p99 {resultado['p99_ms']} ms, errores {resultado['errores']}"
+            )
+
+        jobs = correr_jobs(args.repeticiones_jobs) if args.repeticiones_jobs > 0 and not args.solo else []
+
+        informe = {
+            "entorno": entorno(),
+            "parametros": {
+                "url": url,
+                "concurrencia": args.concurrencia,
+                "peticiones": args.peticiones,
+                "calentamiento": args.calentamiento,
+                "semilla": args.semilla,
+                "estudiantes_con_plan": len(ctx["codigos"]),
+            },
+            "escenarios": resultados,
+            "jobs": jobs,
+            "memoria": {
+                "servidor_pico_mb": memoria_mb(pid, "VmHWM"),
+                "benchmark_pico_mb": memoria_mb(os.getpid(), "VmHWM"),
+            },
+        }
+    finally:
+        if proceso:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+
+    salida = args.salida
+    if not salida:
+        os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+        marca = datetime.now().strftime("%Y%m%d-%H%M%S")
+        salida = os.path.join(DIRECTORIO_RESULTADOS, f"{marca}_{informe['entorno']['commit_corto'] or 'sin-git'}.json")
+    with open(salida, "w", encoding="utf-8") as archivo:
+        json.dump(informe, archivo, ensure_ascii=False, indent=2)
+    logger.info(f"✅ Resultados en {salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import sys
+
+# ------------------------------------------------------------------
+# Comparación de dos corridas de bench/carga.py
+# ------------------------------------------------------------------
+#   python -m bench.comparar bench/resultados/antes.json bench/resultados/despues.json
+#
+# Muestra p50/p95/p99 y req/s de cada escenario y job con su variación. Con
+# --umbral N termina con código 1 si algún p95 empeoró más de N % (útil en CI).
+
+METRICAS = ("p50_ms", "p95_ms", "p99_ms", "rps")
+
+
+def _cargar(ruta: str) -> dict:
+    with open(ruta, encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+def _por_nombre(informe: dict) -> dict:
+    return {fila["nombre"]: fila for fila in informe.get("escenarios", []) + informe.get("jobs", [])}
+
+
+def _variacion(antes, despues):
+    if antes in (None, 0) or despues is None:
+        return None
+    return (despues - antes) / antes * 100
+
+
+def comparar(antes: dict, despues: dict) -> tuple:
+    """
+    (líneas de la tabla, escenarios cuyo p95 empeoró con su variación %).
+    """
+    filas_antes = _por_nombre(antes)
+    filas_despues = _por_nombre(despues)
+
+    encabezado = f"{'escenario':<26}" + "".join(f"{m:>24}" for m in METRICAS)
+    lineas = [encabezado, "-" * len(encabezado)]
+    regresiones = []
+    for nombre in filas_despues:
+        if nombre not in filas_antes:
+            continue
+        celdas = []
+        for metrica in METRICAS:
+            valor_antes = filas_antes[nombre].get(metrica)
+            valor_despues = filas_despues[nombre].get(metrica)
+            variacion = _variacion(valor_antes, valor_despues)
+            texto = f"{valor_antes} -> {valor_despues}"
+            if variacion is not None:
+                texto += f" ({variacion:+.0f}%)"
+            celdas.append(f"{texto:>24}")
+            if metrica == "p95_ms" and variacion is not None:
+                regresiones.append((nombre, variacion))
+        lineas.append(f"{nombre:<26}" + "".join(celdas))
+
+    memoria_antes = antes.get("memoria", {}).get("servidor_pico_mb")
+    memoria_despues = despues.get("memoria", {}).get("servidor_pico_mb")
+    lineas.append("")
+    lineas.append(f"RSS pico del servidor (MB): {memoria_antes} -> {memoria_despues}")
+    return lineas, regresiones
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compara dos resultados de bench/carga.py")
+    parser.add_argument("antes")
+    parser.add_argument("despues")
+    parser.add_argument("--umbral", type=float, help="Falla si algún p95 empeora más de este porcentaje")
+    args = parser.parse_args()
+
+    antes = _cargar(args.antes)
+    despues = _cargar(args.despues)
+    print(f"antes:   {antes['entorno'].get('commit_corto')} ({antes['entorno'].get('fecha')})")
+    print(f"después: {despues['entorno'].get('commit_corto')} ({despues['entorno'].get('fecha')})")
+    if antes.get("parametros", {}).get("concurrencia") != despues.get("parametros", {}).get("concurrencia"):
+        print("⚠️ Las corridas usaron distinta concurrencia")
+    print()
+
+    lineas, regresiones = comparar(antes, despues)
+    print("\n".join(lineas))
+
+    if args.umbral is not None:
+        peores = [(nombre, variacion) for nombre, variacion in regresiones if variacion > args.umbral]
+        if peores:
+            print()
+            for nombre, variacion in peores:
+                print(f"❌ {nombre}: p95 {variacion:+.0f}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import io
+import logging
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from app.searchs.rollup import reconstruir_consumidores_mes, reconstruir_consumo_diario
+from core.config import settings
+from core.database import SessionLocal, engine
+from core.particiones import particionada
+from core.schema import aplicar_migraciones
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Generador de datos sintéticos para el benchmark
+# ------------------------------------------------------------------
+# Llena una base Postgres LOCAL con estudiantes_caf y varios años escolares
+# de registros_validacion_caf (SNACK / LUNCH) con distribuciones parecidas a
+# las del colegio. Todo se carga con COPY; los triggers se apagan durante la
+# carga (session_replication_role = replica) y al final se reconstruye el
+# rollup diario y se hace ANALYZE. Con la misma --semilla los datos salen
+# idénticos, así que dos corridas del benchmark son comparables.
+#
+#   python -m bench.sembrar --estudiantes 5000 --anios 2
+#
+# ¡Borra (TRUNCATE) las tablas! Por eso se niega a correr contra un host
+# que no sea local salvo con --forzar.
+
+HOSTS_LOCALES = {"localhost", "127.0.0.1", "::1"}
+
+# (valor, peso)
+GRADOS = [
+    ("K2", 3), ("K3", 4), ("K4", 5), ("K5", 5),
+    ("1", 8), ("2", 8), ("3", 8), ("4", 8), ("5", 8),
+    ("6", 8), ("7", 8), ("8", 7), ("9", 7), ("10", 7), ("11", 6),
+]
+TIPOS_ALIMENTACION = [
+    ("COMPLETO", 45), ("SOLO ALMUERZO", 15), ("ALMUERZO", 5),
+    ("SOLO REFRIGERIO", 12), ("REFRIGERIO", 5), ("NINGUNO", 18),
+]
+NOMBRES = [
+    "SANTIAGO", "SOFÍA", "MATÍAS", "VALENTINA", "SEBASTIÁN", "ISABELLA", "NICOLÁS", "MARIANA",
+    "ALEJANDRO", "GABRIELA", "SAMUEL", "LUCÍA", "DANIEL", "SALOMÉ", "MARTÍN", "ANTONELLA",
+    "TOMÁS", "MARÍA JOSÉ", "EMILIANO", "SARA", "JUAN PABLO", "JULIANA", "DAVID", "VALERIA",
+]
+APELLIDOS = [
+    "GARCÍA", "RODRÍGUEZ", "MARTÍNEZ", "LÓPEZ", "GONZÁLEZ", "HERNÁNDEZ", "PÉREZ", "SÁNCHEZ",
+    "RAMÍREZ", "TORRES", "FLÓREZ", "GÓMEZ", "DÍAZ", "MUÑOZ", "ROJAS", "MORENO", "JIMÉNEZ",
+    "CASTRO", "VARGAS", "ORTIZ", "RUIZ", "SUÁREZ", "CÁRDENAS", "OSPINA", "QUINTERO",
+]
+
+# Mismas reglas de elegibilidad que los jobs de main.py
+GRADOS_SIN_PLAN = {"K2", "K3", "K4", "K5", "1", "2"}
+TIPOS_SIN_SNACK = {"NINGUNO", "ALMUERZO", "SOLO ALMUERZO"}
+TIPOS_SIN_LUNCH = {"NINGUNO", "REFRIGERIO", "SOLO REFRIGERIO"}
+
+# Probabilidad de que un estudiante elegible reclame su plan un día dado
+TASA_RECLAMO = {"SNACK": 0.82, "LUNCH": 0.9}
+# Franja (hora, minuto inicial, minutos de duración) de cada servicio
+FRANJAS = {"SNACK": (9, 30, 60), "LUNCH": (12, 0, 90)}
+
+DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS public.estudiantes_caf (
+        codigo_estudiante TEXT PRIMARY KEY,
+        nombre TEXT,
+        grado TEXT,
+        tipo_alimentacion TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS public.registros_validacion_caf (
+        id BIGSERIAL PRIMARY KEY,
+        codigo_estudiante TEXT NOT NULL,
+        nombre TEXT,
+        tipo_alimentacion TEXT,
+        plan TEXT NOT NULL,
+        estado TEXT NOT NULL,
+        fecha_hora TIMESTAMP NOT NULL,
+        fecha DATE NOT NULL
+    )
+    """,
+]
+
+
+class FlujoCopy(io.RawIOBase):
+    """
+    Archivo de solo lectura sobre un generador de líneas CSV: COPY lo va
+    consumiendo sin armar millones de renglones en memoria.
+    """
+
+    def __init__(self, lineas):
+        self._lineas = lineas
+        self._pendiente = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, destino) -> int:
+        while len(self._pendiente) < len(destino):
+            bloque = "".join(linea for _, linea in zip(range(2000), self._lineas))
+            if not bloque:
+                break
+            self._pendiente += bloque.encode("utf-8")
+        cantidad = min(len(destino), len(self._pendiente))
+        destino[:cantidad] = self._pendiente[:cantidad]
+        self._pendiente = self._pendiente[cantidad:]
+        return cantidad
+
+
+def _elegir(rng: random.Random, opciones: list) -> str:
+    valores, pesos = zip(*opciones)
+    return rng.choices(valores, weights=pesos)[0]
+
+
+def generar_estudiantes(rng: random.Random, cantidad: int) -> list:
+    estudiantes = []
+    for i in range(cantidad):
+        nombre = f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)} {rng.choice(NOMBRES)}"
+        estudiantes.append((
+            str(100000 + i),
+            nombre,
+            _elegir(rng, GRADOS),
+            _elegir(rng, TIPOS_ALIMENTACION),
+        ))
+    return estudiantes
+
+
+def dias_escolares(hasta: date, anios: int) -> list:
+    """
+    Lunes a viernes de los últimos 'anios' años, sin las vacaciones de
+    mitad de año (15 jun - 15 jul) ni las de fin de año (1 dic - 20 ene).
+    """
+    dias = []
+    dia = hasta - timedelta(days=365 * anios)
+    while dia <= hasta:
+        vacaciones = (
+            (dia.month == 6 and dia.day >= 15) or (dia.month == 7 and dia.day <= 15)
+            or dia.month == 12 or (dia.month == 1 and dia.day <= 20)
+        )
+        if dia.weekday() < 5 and not vacaciones:
+            dias.append(dia)
+        dia += timedelta(days=1)
+    return dias
+
+
+def _elegible(estudiante: tuple, plan: str) -> bool:
+    codigo, _, grado, tipo = estudiante
+    if codigo == "0000" or grado in GRADOS_SIN_PLAN:
+        return False
+    return tipo not in (TIPOS_SIN_SNACK if plan == "SNACK" else TIPOS_SIN_LUNCH)
+
+
+def lineas_registros(rng: random.Random, estudiantes: list, dias: list):
+    """
+    Un renglón por estudiante elegible, día y plan: VALIDADO si reclamó,
+    NO RECLAMO si no (lo que deja el scheduler). El día de hoy solo lleva
+    las validaciones, como antes de que corran los jobs.
+    """
+    hoy = date.today()
+    por_plan = {plan: [e for e in estudiantes if _elegible(e, plan)] for plan in ("SNACK", "LUNCH")}
+    for dia in dias:
+        for plan, elegibles in por_plan.items():
+            hora, minuto, duracion = FRANJAS[plan]
+            inicio = datetime.combine(dia, datetime.min.time()).replace(hour=hora, minute=minuto)
+            for codigo, nombre, grado, tipo in elegibles:
+                if rng.random() < TASA_RECLAMO[plan]:
+                    estado = "VALIDADO"
+                    momento = inicio + timedelta(seconds=rng.randrange(duracion * 60))
+                elif dia == hoy:
+                    continue
+                else:
+                    estado = "NO RECLAMO"
+                    momento = inicio + timedelta(minutes=duracion + 30)
+                yield f"{codigo},\"{nombre}\",{tipo},{grado},{plan},{estado},{momento.isoformat(sep=' ')},{dia.isoformat()}\n"
+
+
+def _copiar(db, sql: str, lineas) -> None:
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(sql, io.BufferedReader(FlujoCopy(lineas), buffer_size=1 << 20))
+    finally:
+        cursor.close()
+
+
+def sembrar(estudiantes: int, anios: int, semilla: int, particionar: bool = False) -> dict:
+    rng = random.Random(semilla)
+    inicio = time.perf_counter()
+
+    with engine.begin() as connection:
+        for sentencia in DDL:
+            connection.execute(text(sentencia))
+    aplicar_migraciones(manuales=(8,) if particionar else ())
+
+    roster = generar_estudiantes(rng, estudiantes)
+    dias = dias_escolares(date.today(), anios)
+
+    db = SessionLocal()
+    try:
+        db.execute(text("SET session_replication_role = replica"))
+        db.execute(text("TRUNCATE public.registros_validacion_caf, public.estudiantes_caf RESTART IDENTITY"))
+        db.execute(text("TRUNCATE public.consumo_diario_caf, public.consumidores_mes_caf"))
+        if particionada(db):
+            # Un mes por partición (migración 8); si no, todo caería en DEFAULT
+            db.execute(
+                text("SELECT public.fn_crear_particiones_registros_caf(:desde, :hasta)"),
+                {"desde": dias[0], "hasta": dias[-1]}
+            )
+
+        _copiar(
+            db,
+            "COPY public.estudiantes_caf (codigo_estudiante, nombre, grado, tipo_alimentacion) FROM STDIN WITH (FORMAT csv)",
+            (f"{c},\"{n}\",{g},{t}\n" for c, n, g, t in roster)
+        )
+        logger.info(f"👩‍🎓 {len(roster)} estudiantes cargados")
+
+        _copiar(
+            db,
+            "COPY public.registros_validacion_caf "
+            "(codigo_estudiante, nombre, tipo_alimentacion, grado, plan, estado, fecha_hora, fecha) "
+            "FROM STDIN WITH (FORMAT csv)",
+            lineas_registros(rng, roster, dias)
+        )
+        db.execute(text("SET session_replication_role = DEFAULT"))
+
+        registros = db.execute(text("SELECT COUNT(*) FROM public.registros_validacion_caf")).scalar()
+        logger.info(f"🧾 {registros} registros cargados en {len(dias)} días escolares")
+
+        reconstruir_consumo_diario(db, dias[0], dias[-1])
+        reconstruir_consumidores_mes(db, dias[0], dias[-1])
+        # Los triggers de versión no corrieron: que el roster y los ETag se enteren
+        db.execute(text("INSERT INTO public.cambios_tablas_caf (tabla) VALUES ('estudiantes'), ('registros')"))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("VACUUM ANALYZE public.estudiantes_caf"))
+        connection.execute(text("VACUUM ANALYZE public.registros_validacion_caf"))
+        connection.execute(text("ANALYZE public.consumo_diario_caf"))
+
+    return {
+        "estudiantes": len(roster),
+        "registros": registros,
+        "dias_escolares": len(dias),
+        "desde": dias[0].isoformat(),
+        "hasta": dias[-1].isoformat(),
+        "semilla": semilla,
+        "duracion_s": round(time.perf_counter() - inicio, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Siembra datos sintéticos para el benchmark")
+    parser.add_argument("--estudiantes", type=int, default=5000, help="Cantidad de estudiantes (p. ej. 2000 - 50000)")
+    parser.add_argument("--anios", type=int, default=2, help="Años escolares de registros (1 - 5)")
+    parser.add_argument("--semilla", type=int, default=42, help="Semilla del generador (datos reproducibles)")
+    parser.add_argument("--forzar", action="store_true", help="Permitir un DB_HOST que no sea local")
+    parser.add_argument("--particionar", action="store_true", help="Aplicar también la migración manual 8 (particiones por mes)")
+    args = parser.parse_args()
+
+    if settings.DB_HOST not in HOSTS_LOCALES and not args.forzar:
+        sys.exit(f"DB_HOST={settings.DB_HOST} no es local; este script borra las tablas. Use --forzar si es a propósito.")
+
+    resumen = sembrar(args.estudiantes, args.anios, args.semilla, args.particionar)
+    logger.info(f"✅ Siembra terminada: {resumen}")
+
+
+if __name__ == "__main__":
+    main()
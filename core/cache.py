@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import date
+from functools import wraps
+from threading import Lock
+import logging
+import time
+
+from core.config import settings
+
+# ------------------------------------------------------------------
+# Logging
+# ------------------------------------------------------------------
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Caché en proceso con TTL
+# ------------------------------------------------------------------
+# Pensada para los agregados del dashboard: los números solo cambian cuando
+# se registra una validación o se edita el roster, así que varias pantallas
+# abiertas pueden compartir el mismo resultado durante unos segundos.
+# El backend es intercambiable (configurar_backend) siempre que implemente
+# get / set / invalidar / estadisticas con la misma firma que TTLCache.
+#
+# invalidar_cache() solo limpia el proceso que escribió. Para que un GET
+# condicional no sirva un resultado viejo con un ETag nuevo, las versiones de
+# tabla que el request leyó para su ETag (fijar_versiones) entran en la
+# clave: tras una escritura confirmada en cualquier worker la clave cambia y
+# el resultado se vuelve a calcular.
+
+_NO_ENCONTRADO = object()
+
+_versiones_request = ContextVar("versiones_request", default=None)
+
+
+def fijar_versiones(versiones: dict) -> None:
+    """
+    Versiones (core/etag.py) con las que el request actual arma su ETag.
+    """
+    _versiones_request.set(tuple(sorted(versiones.items())))
+
+
+def version_request(recurso: str):
+    """
+    Versión de 'recurso' fijada en el request actual, o None.
+    """
+    versiones = _versiones_request.get()
+    return dict(versiones).get(recurso) if versiones else None
+
+
+class TTLCache:
+    """
+    Diccionario LRU acotado a 'maxsize' entradas, con expiración por entrada
+    y contadores de aciertos/fallos por espacio de nombres.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._datos = OrderedDict()
+        self._lock = Lock()
+        self._aciertos = {}
+        self._fallos = {}
+        self._desalojos = 0
+
+    def get(self, clave):
+        espacio = clave[0]
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is not None:
+                expira, valor = entrada
+                if expira > time.monotonic():
+                    self._datos.move_to_end(clave)
+                    self._aciertos[espacio] = self._aciertos.get(espacio, 0) + 1
+                    return valor
+                del self._datos[clave]
+            self._fallos[espacio] = self._fallos.get(espacio, 0) + 1
+            return _NO_ENCONTRADO
+
+    def set(self, clave, valor, ttl: float) -> None:
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maxsize:
+                self._datos.popitem(last=False)
+                self._desalojos += 1
+
+    def invalidar(self, espacio: str = None) -> None:
+        """
+        Sin argumentos vacía toda la caché; con 'espacio' solo esa función.
+        """
+        with self._lock:
+            if espacio is None:
+                self._datos.clear()
+                return
+            for clave in [c for c in self._datos if c[0] == espacio]:
+                del self._datos[clave]
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            espacios = sorted(set(self._aciertos) | set(self._fallos))
+            return {
+                "entradas": len(self._datos),
+                "maxsize": self.maxsize,
+                "desalojos": self._desalojos,
+                "por_funcion": {
+                    espacio: {
+                        "aciertos": self._aciertos.get(espacio, 0),
+                        "fallos": self._fallos.get(espacio, 0)
+                    }
+                    for espacio in espacios
+                }
+            }
+
+
+_backend = TTLCache(maxsize=settings.CACHE_MAX_ENTRIES)
+
+
+def configurar_backend(backend) -> None:
+    global _backend
+    _backend = backend
+
+
+def invalidar_cache(espacio: str = None) -> None:
+    _backend.invalidar(espacio)
+    logger.info(f"🧹 Caché invalidada: {espacio or 'todas las funciones'}")
+
+
+def estadisticas_cache() -> dict:
+    return {"habilitada": settings.CACHE_ENABLED, **_backend.estadisticas()}
+
+
+def cached(ttl: float, espacio: str = None):
+    """
+    Decorador para funciones de app/searchs con firma (db, *args, **kwargs).
+    La sesión 'db' no forma parte de la clave; la fecha del día sí, para que
+    los agregados sobre CURRENT_DATE no crucen la medianoche, y también las
+    versiones fijadas por el request (fijar_versiones), si las hay.
+    """
+    def decorador(funcion):
+        nombre = espacio or funcion.__name__
+
+        @wraps(funcion)
+        def envoltura(db, *args, **kwargs):
+            if not settings.CACHE_ENABLED:
+                return funcion(db, *args, **kwargs)
+
+            clave = (nombre, date.today(), _versiones_request.get(), args, tuple(sorted(kwargs.items())))
+            valor = _backend.get(clave)
+            if valor is not _NO_ENCONTRADO:
+                return valor
+
+            valor = funcion(db, *args, **kwargs)
+            _backend.set(clave, valor, ttl)
+            return valor
+
+        envoltura.invalidar = lambda: _backend.invalidar(nombre)
+        return envoltura
+
+    return decorador
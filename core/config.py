@@ -13,6 +13,82 @@ class Settings(BaseSettings):
     # Esta variable se construirá automáticamente
     DATABASE_URL: Optional[str] = None
 
+    # Modo asíncrono (asyncpg + AsyncSession) para los endpoints de /registro.
+    # Requiere: pip install asyncpg greenlet
+    DB_ASYNC: bool = False
+    ASYNC_DATABASE_URL: Optional[str] = None
+
+    # Pool de conexiones (core/database.py). Dimensionar para el pico de las
+    # comidas: DB_POOL_SIZE + DB_MAX_OVERFLOW es el máximo de conexiones.
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    # "pre_ping": SELECT 1 en cada checkout (un round trip extra siempre).
+    # "idle": solo se verifica la conexión si estuvo ociosa más de DB_POOL_IDLE_MAX s.
+    DB_POOL_LIVENESS: str = "idle"
+    DB_POOL_IDLE_MAX: float = 60
+
+    # Réplica de lectura (opcional). Listados, exportaciones, reportes y
+    # KPIs van a la réplica mientras responda y su retraso no pase de
+    # DB_REPLICA_MAX_LAG_SEGUNDOS; si no, al primario. El estado se vuelve a
+    # medir cada DB_REPLICA_VERIFICAR_SEGUNDOS. Si no se define
+    # DB_REPLICA_ASYNC_URL se deriva de DB_REPLICA_URL.
+    DB_REPLICA_URL: Optional[str] = None
+    DB_REPLICA_ASYNC_URL: Optional[str] = None
+    DB_REPLICA_MAX_LAG_SEGUNDOS: float = 10
+    DB_REPLICA_VERIFICAR_SEGUNDOS: float = 5
+    DB_REPLICA_CONNECT_TIMEOUT: int = 3
+
+    # Aplica las migraciones de core/schema.py al arrancar la API (las
+    # marcadas como manuales, como el particionado, nunca)
+    DB_AUTO_MIGRATE: bool = True
+
+    # Caché en proceso de los agregados del dashboard (core/cache.py)
+    CACHE_ENABLED: bool = True
+    CACHE_MAX_ENTRIES: int = 512
+
+    # Por encima de este número (según el planificador) el 'total' de los
+    # listados paginados se estima en lugar de hacer COUNT(*)
+    CONTEO_ESTIMADO_MINIMO: int = 10000
+
+    # Índice del roster en memoria (app/searchs/roster.py): búsquedas y
+    # estudiantes-con-plan sin ir a Postgres. Cada ROSTER_REFRESCO_SEGUNDOS se
+    # compara la versión de estudiantes_caf y se aplican solo los cambios.
+    ROSTER_EN_MEMORIA: bool = True
+    ROSTER_REFRESCO_SEGUNDOS: int = 30
+
+    # Reportes en segundo plano (app/exports/reportes.py): directorio de la
+    # caché en disco, hilos que generan archivos, tope de reportes en cola y
+    # cuántas horas se conservan los archivos generados.
+    REPORTES_DIR: str = "reportes_cache"
+    REPORTES_WORKERS: int = 2
+    REPORTES_MAX_PENDIENTES: int = 20
+    REPORTES_RETENCION_HORAS: int = 24
+
+    # Compresión de respuestas (main.py): solo por encima de este tamaño.
+    # Brotli se usa si brotli-asgi está instalado; si no, gzip.
+    COMPRESION_MINIMO_BYTES: int = 1024
+    COMPRESION_NIVEL_GZIP: int = 6
+    COMPRESION_BROTLI: bool = True
+
+    # Registro de consultas lentas (core/consultas_lentas.py): toda sentencia
+    # del engine que pase de CONSULTAS_LENTAS_MS (0 = apagado) se escribe en
+    # CONSULTAS_LENTAS_LOG (rotativo). A una fracción de ellas (solo lecturas)
+    # se le captura además el EXPLAIN (ANALYZE, BUFFERS), que vuelve a
+    # ejecutar la consulta: mantener la muestra baja.
+    CONSULTAS_LENTAS_MS: float = 500
+    CONSULTAS_LENTAS_EXPLAIN_MUESTRA: float = 0.1
+    CONSULTAS_LENTAS_LOG: str = "logs/consultas_lentas.log"
+    CONSULTAS_LENTAS_LOG_MB: int = 10
+    CONSULTAS_LENTAS_LOG_RESPALDOS: int = 5
+
+    # Particiones mensuales de registros_validacion_caf (core/particiones.py):
+    # meses futuros que se mantienen creados y meses que se conservan
+    # enganchados (contando el actual; 0 = sin retención, nunca se desprenden).
+    PARTICIONES_MESES_ADELANTE: int = 3
+    PARTICIONES_RETENCION_MESES: int = 0
+
     # En core/config.py, cambia la línea de DATABASE_URL así:
 
     def model_post_init(self, __context) -> None:
@@ -20,6 +96,17 @@ class Settings(BaseSettings):
             f"postgresql+psycopg2://{self.DB_USER}:{self.DB_PASSWORD}"
             f"@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}?sslmode=disable"
         )
+        # asyncpg no entiende 'sslmode': el SSL se desactiva en connect_args
+        self.ASYNC_DATABASE_URL = (
+            f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}"
+            f"@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        )
+        if self.DB_REPLICA_URL and not self.DB_REPLICA_ASYNC_URL:
+            self.DB_REPLICA_ASYNC_URL = (
+                self.DB_REPLICA_URL.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+                .replace("postgresql://", "postgresql+asyncpg://", 1)
+                .split("?", 1)[0]
+            )
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,215 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+from threading import Lock
+import logging
+import os
+import random
+import re
+import time
+
+from sqlalchemy import event
+
+from core.config import settings
+from core.database import engine, read_engine
+from core.metricas import consulta_actual
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Registro de consultas lentas + EXPLAIN automático
+# ------------------------------------------------------------------
+# Filtros como DATE(rv.fecha_hora) BETWEEN ... o los casts de grado de
+# count_students_today se degradan en silencio a medida que crece
+# registros_validacion_caf. Cada sentencia del engine principal que pase de
+# CONSULTAS_LENTAS_MS queda en un log rotativo con su SQL normalizado,
+# parámetros, duración y la función de app/searchs que la lanzó. A una
+# muestra de las lecturas se le agrega el plan de EXPLAIN (ANALYZE, BUFFERS)
+# para ver qué consultas caen en Seq Scan.
+#
+# El EXPLAIN ANALYZE vuelve a ejecutar la consulta, así que:
+#   - solo se hace con SELECT / WITH sin INSERT, UPDATE ni DELETE; un
+#     DECLARE ... CURSOR FOR <consulta> se desenvuelve y se explica la
+#     consulta de adentro (EXPLAIN no acepta DECLARE)
+#   - corre en un hilo aparte (uno a la vez; si hay uno en curso se omite)
+#   - usa su propia conexión del pool, solo si el pool no está saturado
+#   - tiene statement_timeout y termina en rollback
+#
+# Lo que NO queda cubierto:
+#   - cursores de servidor (yield_per / stream_results, p. ej.
+#     iter_registers): psycopg2 arma el DECLARE por su cuenta y los eventos
+#     solo miden la apertura del cursor, no los FETCH que lo recorren; una
+#     exportación lenta casi nunca pasa el umbral. Se mide en los reportes
+#     (duración y filas de cada trabajo en app/exports/reportes.py).
+#   - COPY por raw_connection (app/exports/copia.py, importación, bench):
+#     no pasan por los eventos del engine.
+
+_registro = logging.getLogger("consultas_lentas")
+_registro.propagate = False
+
+_explicador = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+_explain_en_curso = Lock()
+
+_LECTURA = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# DECLARE nombre [BINARY] [ASENSITIVE | INSENSITIVE] [[NO] SCROLL] CURSOR [WITH | WITHOUT HOLD] FOR ...
+_DECLARE = re.compile(
+    r"^\s*declare\s+(?:\"(?:[^\"]|\"\")+\"|\w+)"
+    r"(?:\s+binary)?(?:\s+(?:asensitive|insensitive))?(?:\s+(?:no\s+)?scroll)?"
+    r"\s+cursor(?:\s+with(?:out)?\s+hold)?\s+for\s+",
+    re.IGNORECASE
+)
+_ESCRITURA = re.compile(r"\b(insert|update|delete|merge)\b", re.IGNORECASE)
+_COMENTARIOS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r"\s+")
+
+MAX_PARAMETRO = 200
+MAX_ELEMENTOS = 5
+
+
+def normalizar_sql(sentencia: str) -> str:
+    """
+    Una sola línea, sin comentarios y con los literales como '?': dos
+    ejecuciones de la misma consulta dan el mismo texto (fácil de agrupar).
+    """
+    sentencia = _COMENTARIOS.sub(" ", sentencia)
+    sentencia = _LITERALES.sub("?", sentencia)
+    return _ESPACIOS.sub(" ", sentencia).strip()
+
+
+def _resumir_valor(valor):
+    # Los lotes (/validaciones/batch) mandan arreglos de hasta 1000 elementos
+    if isinstance(valor, (list, tuple)) and len(valor) > MAX_ELEMENTOS:
+        return f"{list(valor[:MAX_ELEMENTOS])!r}… ({len(valor)} elementos)"
+    texto = repr(valor)
+    return texto if len(texto) <= MAX_PARAMETRO else texto[:MAX_PARAMETRO] + "…"
+
+
+def resumir_parametros(parametros) -> str:
+    if parametros is None:
+        return "{}"
+    if isinstance(parametros, dict):
+        return "{" + ", ".join(f"{clave}: {_resumir_valor(valor)}" for clave, valor in parametros.items()) + "}"
+    return _resumir_valor(parametros)
+
+
+def consulta_de_cursor(sentencia: str) -> str:
+    """
+    La consulta de un DECLARE ... CURSOR FOR <consulta>; cualquier otra
+    sentencia se devuelve igual.
+    """
+    declaracion = _DECLARE.match(_COMENTARIOS.sub(" ", sentencia))
+    if declaracion is None:
+        return sentencia
+    return _COMENTARIOS.sub(" ", sentencia)[declaracion.end():]
+
+
+def _admite_explain(sentencia: str, executemany: bool) -> bool:
+    if executemany or not _LECTURA.match(sentencia):
+        return False
+    return not _ESCRITURA.search(_COMENTARIOS.sub(" ", sentencia))
+
+
+def _pool_con_holgura(motor) -> bool:
+    # No quitarle una conexión a los requests en el pico de las comidas
+    pool = motor.pool
+    return not hasattr(pool, "checkedout") or pool.checkedout() < settings.DB_POOL_SIZE
+
+
+def _capturar_explain(motor, sentencia: str, parametros, consulta: str, duracion_ms: float) -> None:
+    try:
+        # En el mismo servidor (primario o réplica) donde corrió la consulta
+        conexion = motor.raw_connection()
+        try:
+            cursor = conexion.cursor()
+            try:
+                # Tope: 4 veces lo que tardó la original (mínimo 5 s)
+                limite_ms = int(max(5000, duracion_ms * 4))
+                cursor.execute(f"SET LOCAL statement_timeout = {limite_ms}")
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sentencia, parametros)
+                plan = "\n".join(fila[0] for fila in cursor.fetchall())
+            finally:
+                cursor.close()
+                conexion.rollback()
+        finally:
+            conexion.close()
+
+        _registro.warning(
+            f"EXPLAIN consulta={consulta} duracion_ms={duracion_ms:.1f}\n"
+            f"  sql: {normalizar_sql(sentencia)}\n{plan}"
+        )
+    except Exception as e:
+        logger.error(f"No se pudo capturar el EXPLAIN de '{consulta}': {e}")
+    finally:
+        _explain_en_curso.release()
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_lentas", []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("inicio_lentas")
+    if not inicios:
+        return
+    duracion_ms = (time.perf_counter() - inicios.pop()) * 1000
+    if duracion_ms < settings.CONSULTAS_LENTAS_MS:
+        return
+
+    consulta = consulta_actual.get()
+    _registro.warning(
+        f"LENTA consulta={consulta} duracion_ms={duracion_ms:.1f}\n"
+        f"  sql: {normalizar_sql(statement)}\n"
+        f"  params: {resumir_parametros(parameters)}"
+    )
+    logger.warning(f"🐢 Consulta lenta ({consulta}): {duracion_ms:.0f} ms")
+
+    sentencia = consulta_de_cursor(statement)
+    if (
+        random.random() < settings.CONSULTAS_LENTAS_EXPLAIN_MUESTRA
+        and _admite_explain(sentencia, executemany)
+        and _pool_con_holgura(conn.engine)
+        and _explain_en_curso.acquire(blocking=False)
+    ):
+        try:
+            _explicador.submit(_capturar_explain, conn.engine, sentencia, parameters, consulta, duracion_ms)
+        except RuntimeError:
+            # Executor cerrado (apagando la API)
+            _explain_en_curso.release()
+
+
+def _error_al_ejecutar(contexto_excepcion):
+    conn = contexto_excepcion.connection
+    if conn is not None and conn.info.get("inicio_lentas"):
+        conn.info["inicio_lentas"].pop()
+
+
+def instalar_registro_lento() -> None:
+    """
+    Engancha los eventos del engine principal (psycopg2) y, si existe, el de
+    la réplica, y abre el log rotativo. Con CONSULTAS_LENTAS_MS = 0 no hace
+    nada.
+    """
+    if settings.CONSULTAS_LENTAS_MS <= 0:
+        return
+    if event.contains(engine, "before_cursor_execute", _antes_de_ejecutar):
+        return
+
+    if not _registro.handlers:
+        directorio = os.path.dirname(settings.CONSULTAS_LENTAS_LOG)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        manejador = RotatingFileHandler(
+            settings.CONSULTAS_LENTAS_LOG,
+            maxBytes=settings.CONSULTAS_LENTAS_LOG_MB * 1024 * 1024,
+            backupCount=settings.CONSULTAS_LENTAS_LOG_RESPALDOS,
+            encoding="utf-8"
+        )
+        manejador.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        _registro.addHandler(manejador)
+        _registro.setLevel(logging.WARNING)
+
+    for destino in filter(None, [engine, read_engine]):
+        event.listen(destino, "before_cursor_execute", _antes_de_ejecutar)
+        event.listen(destino, "after_cursor_execute", _despues_de_ejecutar)
+        event.listen(destino, "handle_error", _error_al_ejecutar)
+    logger.info(f"🐢 Registro de consultas lentas: > {settings.CONSULTAS_LENTAS_MS} ms en {settings.CONSULTAS_LENTAS_LOG}")
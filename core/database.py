@@ -1,7 +1,11 @@
-from typing import Generator
+from threading import Lock
+from typing import AsyncGenerator, Generator
 import logging
+import time
 
-from sqlalchemy import create_engine, text
+from starlette.concurrency import run_in_threadpool
+
+from sqlalchemy import create_engine, event, exc, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.pool import QueuePool
@@ -22,14 +26,128 @@ logger = logging.getLogger(__name__)
 # 2. pool_recycle: Evita "Stale connections" (conexiones viejas).
 # 3. sslmode: 'require' es fundamental para la seguridad en la nube.
 
+class MetricasPool:
+    """
+    Contadores de espera en el checkout del pool (tiempo hasta obtener una
+    conexión, incluida la apertura de conexiones de overflow) y timeouts.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.timeouts = 0
+        self.descartadas_ociosas = 0
+        self.observadores = []
+
+    def registrar_espera(self, segundos: float) -> None:
+        with self._lock:
+            self.esperas += 1
+            self.espera_total += segundos
+            self.espera_max = max(self.espera_max, segundos)
+        for observador in self.observadores:
+            observador(segundos)
+
+    def registrar_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def registrar_descarte(self) -> None:
+        with self._lock:
+            self.descartadas_ociosas += 1
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.esperas,
+                "espera_promedio_ms": round(self.espera_total / self.esperas * 1000, 3) if self.esperas else 0.0,
+                "espera_max_ms": round(self.espera_max * 1000, 3),
+                "timeouts": self.timeouts,
+                "descartadas_ociosas": self.descartadas_ociosas
+            }
+
+metricas_pool = MetricasPool()
+
+class QueuePoolMedido(QueuePool):
+    """
+    QueuePool que mide cuánto espera cada checkout.
+    """
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metricas_pool.registrar_timeout()
+            raise
+        finally:
+            metricas_pool.registrar_espera(time.perf_counter() - inicio)
+
+def _opciones_pool() -> dict:
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_LIVENESS == "pre_ping",
+    }
+
 # En core/database.py
 engine = create_engine(
     settings.DATABASE_URL,
     echo=False,             
-    pool_pre_ping=True,
+    poolclass=QueuePoolMedido,
+    **_opciones_pool()
     # Asegúrate de que NO haya un connect_args pidiendo sslmode require aquí
 )
 
+# Liveness "idle": en lugar de un SELECT 1 en cada checkout (pool_pre_ping),
+# solo se prueba la conexión si estuvo ociosa más de DB_POOL_IDLE_MAX segundos.
+# Durante el pico de las comidas las conexiones se reutilizan sin round trip extra.
+# Con "idle" _opciones_pool() apaga pool_pre_ping, así que estos dos eventos
+# se registran en TODOS los engines (réplica y asyncpg incluidos).
+@event.listens_for(engine, "checkin")
+def _marcar_ultimo_uso(dbapi_connection, connection_record):
+    connection_record.info["ultimo_uso"] = time.monotonic()
+
+@event.listens_for(engine, "checkout")
+def _verificar_conexion_ociosa(dbapi_connection, connection_record, connection_proxy):
+    if settings.DB_POOL_LIVENESS != "idle":
+        return
+    ultimo_uso = connection_record.info.get("ultimo_uso")
+    if ultimo_uso is None or time.monotonic() - ultimo_uso < settings.DB_POOL_IDLE_MAX:
+        return
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+    except Exception:
+        metricas_pool.registrar_descarte()
+        # El pool descarta esta conexión y reintenta con una nueva
+        raise exc.DisconnectionError("Conexión ociosa cerrada por el servidor")
+
+def estado_pool() -> dict:
+    """
+    Foto del pool principal: conexiones en uso, ociosas, overflow y esperas.
+    """
+    pool = engine.pool
+    return {
+        "configuracion": {
+            "pool_size": settings.DB_POOL_SIZE,
+            "max_overflow": settings.DB_MAX_OVERFLOW,
+            "pool_timeout": settings.DB_POOL_TIMEOUT,
+            "pool_recycle": settings.DB_POOL_RECYCLE,
+            "liveness": settings.DB_POOL_LIVENESS,
+            "idle_max": settings.DB_POOL_IDLE_MAX
+        },
+        "en_uso": pool.checkedout(),
+        "ociosas": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "esperas": metricas_pool.resumen(),
+        "replica": estado_replica.resumen()
+    }
+
 # ------------------------------------------------------------------
 # Session & Base
 # ------------------------------------------------------------------
@@ -63,6 +181,297 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+# ------------------------------------------------------------------
+# Réplica de lectura (opcional)
+# ------------------------------------------------------------------
+# Con DB_REPLICA_URL los endpoints de solo lectura (listados, exportaciones,
+# reportes, KPIs) usan un segundo pool contra la réplica, y la carga de
+# reportes no compite con las validaciones que escriben en el primario.
+# estado_replica mide el retraso cada DB_REPLICA_VERIFICAR_SEGUNDOS: si la
+# réplica no responde o se atrasa más de DB_REPLICA_MAX_LAG_SEGUNDOS, todo
+# vuelve al primario hasta la siguiente medición en que esté sana.
+read_engine = None
+ReadSessionLocal = None
+
+if settings.DB_REPLICA_URL:
+    read_engine = create_engine(
+        settings.DB_REPLICA_URL,
+        echo=False,
+        connect_args={"connect_timeout": settings.DB_REPLICA_CONNECT_TIMEOUT},
+        **_opciones_pool()
+    )
+    event.listen(read_engine, "checkin", _marcar_ultimo_uso)
+    event.listen(read_engine, "checkout", _verificar_conexion_ociosa)
+
+    ReadSessionLocal = sessionmaker(
+        bind=read_engine,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        future=True
+    )
+
+# Segundos de retraso de la réplica. Sin WAL pendiente y con el receptor
+# conectado es 0 (en un primario ocioso la última transacción reproducida
+# puede ser vieja sin que haya retraso real). Sobre un servidor que no es
+# réplica también es 0.
+_SQL_RETRASO_REPLICA = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+             AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 1e9)
+    END
+""")
+
+# ¿La réplica ya reprodujo esta posición del WAL del primario?
+_SQL_REPLICA_ALCANZO = text("""
+    SELECT CASE
+        WHEN pg_is_in_recovery() THEN COALESCE(pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn), FALSE)
+        ELSE TRUE
+    END
+""")
+
+class EstadoReplica:
+    """
+    Último resultado de la medición de la réplica. Solo un hilo mide a la
+    vez; los demás usan el resultado anterior sin esperar.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._verificado = None
+        self._sana = False
+        self.retraso = None
+        self.error = None
+
+    def por_verificar(self) -> bool:
+        return (
+            read_engine is not None
+            and (self._verificado is None
+                 or time.monotonic() - self._verificado >= settings.DB_REPLICA_VERIFICAR_SEGUNDOS)
+        )
+
+    @property
+    def en_uso(self) -> bool:
+        """Resultado de la última medición, sin volver a medir."""
+        return self._sana
+
+    def sana(self) -> bool:
+        if read_engine is None:
+            return False
+        if self.por_verificar() and self._lock.acquire(blocking=False):
+            try:
+                self._sana = self._medir()
+                self._verificado = time.monotonic()
+            finally:
+                self._lock.release()
+        return self._sana
+
+    def _medir(self) -> bool:
+        try:
+            with read_engine.connect() as connection:
+                retraso = float(connection.execute(_SQL_RETRASO_REPLICA).scalar())
+        except Exception as e:
+            if self._sana or self.error is None:
+                logger.warning(f"⚠️ Réplica de lectura no disponible, se usa el primario: {str(e)}")
+            self.error = str(e)
+            self.retraso = None
+            return False
+
+        self.error = None
+        self.retraso = retraso
+        sana = retraso <= settings.DB_REPLICA_MAX_LAG_SEGUNDOS
+        if sana != self._sana:
+            if sana:
+                logger.info(f"✅ Réplica de lectura en uso (retraso {retraso:.1f} s)")
+            else:
+                logger.warning(f"⚠️ Réplica atrasada {retraso:.1f} s, se usa el primario")
+        return sana
+
+    def resumen(self) -> dict:
+        return {
+            "configurada": read_engine is not None,
+            "en_uso": self._sana,
+            "retraso_segundos": self.retraso,
+            "error": self.error,
+            "pool_en_uso": read_engine.pool.checkedout() if read_engine is not None else None
+        }
+
+estado_replica = EstadoReplica()
+
+def replica_alcanzo(db, lsn: str) -> bool:
+    """
+    True si la réplica (sesión o conexión 'db') ya reprodujo 'lsn'.
+    """
+    return bool(db.execute(_SQL_REPLICA_ALCANZO, {"lsn": lsn}).scalar())
+
+def lsn_primario(db):
+    """
+    Posición actual del WAL en el primario (None si no hay réplica configurada).
+    """
+    if read_engine is None:
+        return None
+    return db.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()
+
+def _replica_utilizable(lsn_minimo: str = None) -> bool:
+    if not estado_replica.sana():
+        return False
+    if lsn_minimo is None:
+        return True
+    try:
+        with read_engine.connect() as connection:
+            return replica_alcanzo(connection, lsn_minimo)
+    except Exception:
+        return False
+
+def sesion_lectura(lsn_minimo: str = None):
+    """
+    Session (sync) en la réplica si está sana y, si se indica, ya reprodujo
+    'lsn_minimo'; si no, en el primario. db.info["replica"] dice cuál tocó.
+    """
+    if _replica_utilizable(lsn_minimo):
+        return ReadSessionLocal(info={"replica": True})
+    return SessionLocal()
+
+def motor_lectura(lsn_minimo: str = None):
+    """
+    Engine para lecturas con conexión propia (COPY de exportación).
+    """
+    return read_engine if _replica_utilizable(lsn_minimo) else engine
+
+def es_replica(db) -> bool:
+    return bool(db.info.get("replica"))
+
+async def _replica_en_uso() -> bool:
+    """
+    ¿Esta petición lee de la réplica? La medición del retraso abre una
+    conexión (sync, con timeout): cuando toca medir corre en el threadpool,
+    y si no se usa el último resultado sin salir del event loop.
+    """
+    if estado_replica.por_verificar():
+        return await run_in_threadpool(estado_replica.sana)
+    return estado_replica.en_uso
+
+async def get_read_db() -> AsyncGenerator:
+    """
+    Como get_db, pero en la réplica cuando está disponible.
+    """
+    if await _replica_en_uso():
+        db = ReadSessionLocal(info={"replica": True})
+    else:
+        db = SessionLocal()
+    try:
+        yield db
+    except SQLAlchemyError as e:
+        await run_in_threadpool(db.rollback)
+        logger.error(f"❌ SQLAlchemy Error (lectura): {str(e)}")
+        raise
+    finally:
+        await run_in_threadpool(db.close)
+
+# ------------------------------------------------------------------
+# Modo asíncrono (opcional): asyncpg + AsyncSession
+# ------------------------------------------------------------------
+# Con DB_ASYNC=true las consultas de /registro corren sobre asyncpg y no
+# ocupan un hilo del threadpool mientras esperan a Supabase. Los imports
+# van aquí adentro porque sqlalchemy.ext.asyncio exige greenlet instalado.
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        settings.ASYNC_DATABASE_URL,
+        echo=False,
+        connect_args={"ssl": False},
+        **_opciones_pool()
+    )
+
+    # El checkout de asyncpg corre dentro del greenlet de SQLAlchemy: el
+    # cursor del adaptador ejecuta el SELECT 1 igual que con psycopg2
+    event.listen(async_engine.sync_engine, "checkin", _marcar_ultimo_uso)
+    event.listen(async_engine.sync_engine, "checkout", _verificar_conexion_ociosa)
+
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+async_read_engine = None
+AsyncReadSessionLocal = None
+
+if settings.DB_ASYNC and settings.DB_REPLICA_URL:
+    async_read_engine = create_async_engine(
+        settings.DB_REPLICA_ASYNC_URL,
+        echo=False,
+        connect_args={"ssl": False, "timeout": settings.DB_REPLICA_CONNECT_TIMEOUT},
+        **_opciones_pool()
+    )
+
+    event.listen(async_read_engine.sync_engine, "checkin", _marcar_ultimo_uso)
+    event.listen(async_read_engine.sync_engine, "checkout", _verificar_conexion_ociosa)
+
+    AsyncReadSessionLocal = async_sessionmaker(
+        bind=async_read_engine,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+async def get_async_db() -> AsyncGenerator:
+    """
+    Igual que get_db pero con AsyncSession (solo con DB_ASYNC=true).
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"❌ SQLAlchemy Error (async): {str(e)}")
+            raise
+
+async def get_async_read_db() -> AsyncGenerator:
+    """
+    Como get_async_db, pero en la réplica cuando está disponible. La
+    medición de la réplica (sync, con timeout) nunca corre en el event loop.
+    """
+    replica = AsyncReadSessionLocal is not None and await _replica_en_uso()
+    fabrica = AsyncReadSessionLocal if replica else AsyncSessionLocal
+    async with fabrica() as db:
+        db.info["replica"] = replica
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"❌ SQLAlchemy Error (async, lectura): {str(e)}")
+            raise
+
+# Dependencias que usan los endpoints: sesión sync o async según DB_ASYNC.
+# get_read_session es para los endpoints de solo lectura (réplica si hay).
+get_session = get_async_db if settings.DB_ASYNC else get_db
+get_read_session = get_async_read_db if settings.DB_ASYNC else get_read_db
+
+async def run_db(db, funcion, *args, **kwargs):
+    """
+    Ejecuta una función de app/searchs (firma (db, ...)) sin bloquear el
+    event loop: con AsyncSession usa run_sync (greenlet sobre asyncpg, sin
+    hilos); con Session clásica la manda al threadpool como antes.
+    """
+    if settings.DB_ASYNC:
+        return await db.run_sync(funcion, *args, **kwargs)
+    return await run_in_threadpool(funcion, db, *args, **kwargs)
+
+async def commit_db(db) -> None:
+    """
+    Commit de la sesión que entrega get_session, sea AsyncSession o Session.
+    """
+    if settings.DB_ASYNC:
+        await db.commit()
+    else:
+        await run_in_threadpool(db.commit)
+
 # ------------------------------------------------------------------
 # Utilidades de Diagnóstico
 # ------------------------------------------------------------------
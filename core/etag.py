@@ -0,0 +1,88 @@
+import hashlib
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# ------------------------------------------------------------------
+# ETags a partir de versiones de tabla (GET condicional)
+# ------------------------------------------------------------------
+# La versión de una tabla es la suma de sus filas en public.cambios_tablas_caf
+# (migración 5): un trigger por sentencia agrega una fila en cada
+# INSERT/UPDATE/DELETE/TRUNCATE, dentro de la misma transacción que escribe.
+# La suma nueva solo se ve cuando los datos nuevos ya están confirmados, un
+# rollback la deshace, y como los triggers solo insertan, dos escrituras
+# nunca se esperan por la versión. Leerla es un SUM sobre unas pocas filas
+# (compactar_versiones las junta), así que un endpoint puede calcular su
+# ETag sin correr la consulta completa y responder 304 si el cliente ya
+# tiene esa versión. La versión se lee ANTES de armar la respuesta: el
+# cuerpo nunca es más viejo que el ETag (a lo sumo más nuevo, y entonces el
+# ETag cambia en el siguiente request).
+
+_SQL_VERSIONES = """
+    SELECT tabla, SUM(cambios)
+    FROM public.cambios_tablas_caf
+    WHERE tabla = ANY(:tablas)
+    GROUP BY tabla
+"""
+
+# Cambia las filas de cada tabla por una con la misma suma, en una sola
+# sentencia: quien lea antes o después del COMMIT ve la misma versión. Dos
+# workers a la vez no descuadran nada: el segundo DELETE salta las filas que
+# el primero ya borró.
+_SQL_COMPACTAR = """
+    WITH borradas AS (
+        DELETE FROM public.cambios_tablas_caf
+        WHERE tabla IN (
+            SELECT tabla FROM public.cambios_tablas_caf
+            GROUP BY tabla
+            HAVING COUNT(*) > 1
+        )
+        RETURNING tabla, cambios
+    )
+    INSERT INTO public.cambios_tablas_caf (tabla, cambios)
+    SELECT tabla, SUM(cambios) FROM borradas GROUP BY tabla
+"""
+
+
+def version_recursos(db: Session, recursos: tuple) -> dict:
+    """
+    Versión actual de cada recurso ('estudiantes', 'registros') en una sola ida.
+    """
+    filas = dict(db.execute(text(_SQL_VERSIONES), {"tablas": list(recursos)}).all())
+    return {recurso: int(filas.get(recurso) or 0) for recurso in recursos}
+
+
+def compactar_versiones(db: Session) -> int:
+    """
+    Junta las filas de cambios_tablas_caf (una por tabla). Devuelve cuántas
+    tablas compactó. No hace commit.
+    """
+    return db.execute(text(_SQL_COMPACTAR)).rowcount
+
+
+def calcular_etag(versiones: dict, *partes) -> str:
+    """
+    ETag fuerte: versiones de las tablas + lo que varíe la respuesta
+    (filtros, fecha del día, ruta).
+    """
+    base = "|".join(
+        [f"{recurso}={versiones[recurso]}" for recurso in sorted(versiones)]
+        + [str(parte) for parte in partes]
+    )
+    return '"' + hashlib.sha1(base.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def coincide_if_none_match(request: Request, etag: str) -> bool:
+    """
+    True si algún valor de If-None-Match coincide con 'etag'
+    (acepta listas separadas por coma, '*' y el prefijo débil W/).
+    """
+    encabezado = request.headers.get("if-none-match")
+    if not encabezado:
+        return False
+    for valor in encabezado.split(","):
+        valor = valor.strip()
+        if valor == "*" or valor.removeprefix("W/") == etag:
+            return True
+    return False
@@ -0,0 +1,315 @@
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+import logging
+import time
+
+from sqlalchemy import event
+
+from core.database import async_engine, async_read_engine, engine, estado_pool, metricas_pool, read_engine
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Métricas en formato Prometheus (/metrics)
+# ------------------------------------------------------------------
+# Histogramas y contadores propios (sin dependencias) para saber a dónde se
+# va el tiempo en el pico del almuerzo:
+#   caf_http_request_duration_seconds   latencia por ruta (plantilla, no URL)
+#   caf_db_query_duration_seconds       cada sentencia, con el nombre de la
+#                                       función de app/searchs que la lanzó
+#   caf_db_pool_wait_seconds            espera en el checkout del pool
+#   caf_scheduler_job_duration_seconds  duración de los jobs de main.py
+# Los valores son por proceso: con varios workers, Prometheus debe
+# scrapear cada uno (o sumar por instancia).
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_POOL = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+BUCKETS_JOBS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _etiquetas(nombres: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+class Histograma:
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = Lock()
+
+    def observar(self, segundos: float, *valores) -> None:
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                # [conteos por bucket..., suma, total]
+                serie = self._series[valores] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    serie[i] += 1
+            serie[-2] += segundos
+            serie[-1] += 1
+
+    def exportar(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = {valores: list(serie) for valores, serie in self._series.items()}
+        for valores, serie in sorted(series.items()):
+            for limite, conteo in zip(self.buckets, serie):
+                le = f'le="{limite}"'
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {conteo}")
+            le = 'le="+Inf"'
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {serie[-1]}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_numero(serie[-2])}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {serie[-1]}")
+        return lineas
+
+
+class Contador:
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._series = {}
+        self._lock = Lock()
+
+    def incrementar(self, *valores, cantidad: float = 1) -> None:
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + cantidad
+
+    def exportar(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for valores, total in sorted(series.items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {_numero(total)}")
+        return lineas
+
+
+latencia_http = Histograma(
+    "caf_http_request_duration_seconds",
+    "Tiempo hasta el inicio de la respuesta HTTP, por ruta",
+    ("method", "route", "status")
+)
+duracion_consultas = Histograma(
+    "caf_db_query_duration_seconds",
+    "Duración de cada sentencia SQL, por consulta de app/searchs",
+    ("consulta",)
+)
+errores_consultas = Contador(
+    "caf_db_query_errors_total",
+    "Sentencias SQL que terminaron en error, por consulta",
+    ("consulta",)
+)
+espera_pool = Histograma(
+    "caf_db_pool_wait_seconds",
+    "Espera para obtener una conexión del pool",
+    buckets=BUCKETS_POOL
+)
+duracion_jobs = Histograma(
+    "caf_scheduler_job_duration_seconds",
+    "Duración de los jobs del scheduler",
+    ("job", "resultado"),
+    buckets=BUCKETS_JOBS
+)
+
+_REGISTRO = [latencia_http, duracion_consultas, errores_consultas, espera_pool, duracion_jobs]
+
+
+def _metricas_pool() -> list:
+    estado = estado_pool()
+    lineas = [
+        "# HELP caf_db_pool_connections Conexiones del pool por estado",
+        "# TYPE caf_db_pool_connections gauge",
+    ]
+    for clave in ("en_uso", "ociosas", "overflow"):
+        lineas.append(f'caf_db_pool_connections{{estado="{clave}"}} {estado[clave]}')
+    lineas += [
+        "# HELP caf_db_pool_timeouts_total Checkouts que agotaron DB_POOL_TIMEOUT",
+        "# TYPE caf_db_pool_timeouts_total counter",
+        f"caf_db_pool_timeouts_total {estado['esperas']['timeouts']}",
+    ]
+    return lineas
+
+
+def exportar_metricas() -> str:
+    lineas = []
+    for metrica in _REGISTRO:
+        lineas += metrica.exportar()
+    lineas += _metricas_pool()
+    return "\n".join(lineas) + "\n"
+
+
+# ------------------------------------------------------------------
+# Nombre de la consulta en curso
+# ------------------------------------------------------------------
+# Las funciones de app/searchs se decoran con @consulta_nombrada; cada
+# sentencia que ejecuten queda etiquetada con su nombre. Corre bien en el
+# threadpool y con run_sync porque el contextvar viaja con la llamada.
+consulta_actual: ContextVar = ContextVar("consulta_actual", default="sin_nombre")
+
+
+def consulta_nombrada(funcion):
+    nombre = funcion.__name__
+
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        token = consulta_actual.set(nombre)
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            consulta_actual.reset(token)
+
+    return envoltura
+
+
+def _antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_consultas", []).append(time.perf_counter())
+
+
+def _despues_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get("inicio_consultas")
+    if inicios:
+        duracion_consultas.observar(time.perf_counter() - inicios.pop(), consulta_actual.get())
+
+
+def _error_al_ejecutar(contexto_excepcion):
+    conn = contexto_excepcion.connection
+    if conn is not None and conn.info.get("inicio_consultas"):
+        conn.info["inicio_consultas"].pop()
+    errores_consultas.incrementar(consulta_actual.get())
+
+
+def instalar_metricas_bd() -> None:
+    """
+    Engancha los eventos de SQLAlchemy (engine sync y, si existen, el async
+    y los de la réplica) y la espera del pool. Se llama una vez al importar
+    main.py.
+    """
+    motores = [
+        engine,
+        async_engine.sync_engine if async_engine else None,
+        read_engine,
+        async_read_engine.sync_engine if async_read_engine else None,
+    ]
+    for destino in filter(None, motores):
+        if event.contains(destino, "before_cursor_execute", _antes_de_ejecutar):
+            continue
+        event.listen(destino, "before_cursor_execute", _antes_de_ejecutar)
+        event.listen(destino, "after_cursor_execute", _despues_de_ejecutar)
+        event.listen(destino, "handle_error", _error_al_ejecutar)
+
+    if espera_pool.observar not in metricas_pool.observadores:
+        metricas_pool.observadores.append(espera_pool.observar)
+
+
+# ------------------------------------------------------------------
+# Scheduler
+# ------------------------------------------------------------------
+def medir_job(nombre: str):
+    """
+    Decorador para los jobs de main.py: registra la duración con
+    resultado "ok" o "error" (los jobs atrapan sus propias excepciones,
+    así que "error" solo aparece si algo se escapa).
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            resultado = "error"
+            try:
+                valor = funcion(*args, **kwargs)
+                resultado = "ok"
+                return valor
+            finally:
+                duracion_jobs.observar(time.perf_counter() - inicio, nombre, resultado)
+        return envoltura
+    return decorador
+
+
+# ------------------------------------------------------------------
+# Middleware HTTP
+# ------------------------------------------------------------------
+# scope["route"] es la ruta tal como se declaró en su APIRouter: según la
+# versión de FastAPI su path no trae el prefijo de include_router
+# ("/roster/estado" en vez de "/registro/roster/estado") y "/registro/"
+# quedaría en la misma serie que "/" de la app. main.py registra cada router
+# con su prefijo y la etiqueta es la plantilla completa. Las rutas no son
+# hashables: la clave es id(ruta), que vive lo mismo que la app.
+_plantillas_ruta = {}
+
+
+def registrar_router(router, prefijo: str) -> None:
+    """
+    Guarda prefijo + plantilla de cada ruta de 'router' (llamar junto a
+    app.include_router con el mismo prefijo).
+    """
+    for ruta in router.routes:
+        plantilla = getattr(ruta, "path_format", None)
+        if plantilla is not None:
+            _plantillas_ruta[id(ruta)] = prefijo + plantilla
+
+
+def plantilla_ruta(ruta) -> str:
+    if ruta is None:
+        return "sin_ruta"
+    return _plantillas_ruta.get(id(ruta)) or getattr(ruta, "path_format", None) or getattr(ruta, "path", "sin_ruta")
+
+
+class MiddlewareMetricas:
+    """
+    Mide cada request hasta que sale el encabezado de la respuesta (en los
+    JSON eso incluye consultas y serialización; en los streams, el tiempo
+    hasta el primer byte). La ruta es la plantilla ("/reportes/{id_reporte}")
+    para no crear una serie por URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        medido = False
+
+        def medir(status_code: int) -> None:
+            nonlocal medido
+            medido = True
+            latencia_http.observar(
+                time.perf_counter() - inicio,
+                scope["method"],
+                plantilla_ruta(scope.get("route")),
+                status_code
+            )
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start" and not medido:
+                medir(mensaje["status"])
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        except Exception:
+            # Excepción sin respuesta: la convierte en 500 el middleware de Starlette
+            if not medido:
+                medir(500)
+            raise
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from datetime import date
+
+import psycopg2
+
+from core.cache import invalidar_cache
+from core.config import settings
+
+# ------------------------------------------------------------------
+# Logging
+# ------------------------------------------------------------------
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Difusión de cambios en registros_validacion_caf (LISTEN/NOTIFY)
+# ------------------------------------------------------------------
+# El trigger de la migración 4 hace pg_notify('registros_caf', ...) en cada
+# INSERT/UPDATE. Por proceso hay UN solo hilo con UNA conexión escuchando
+# (fuera del pool), que reparte cada evento a las colas asyncio de todos los
+# clientes SSE conectados (/registro/stream). N dashboards abiertos cuestan
+# una conexión, no N consultas periódicas.
+
+CANAL = "registros_caf"
+
+# Eventos pendientes por cliente antes de considerarlo atrasado
+_MAX_PENDIENTES = 100
+
+
+def _nivel(grado) -> str:
+    # Mismo criterio que count_students_today: 1-5 elementary, 6-12 highschool
+    if grado and str(grado).isdigit():
+        numero = int(grado)
+        if 1 <= numero <= 5:
+            return "elementary"
+        if 6 <= numero <= 12:
+            return "highschool"
+    return None
+
+
+def calcular_deltas(registros: list) -> dict:
+    """
+    Cambio en los contadores de hoy (estado VALIDADO) por plan y nivel, para
+    que el dashboard actualice las cartas sin volver a consultar.
+    """
+    hoy = date.today().isoformat()
+    deltas = {
+        plan: {"elementary": 0, "highschool": 0, "total": 0}
+        for plan in ("snack", "lunch")
+    }
+    for registro in registros:
+        plan = (registro.get("plan") or "").lower()
+        if plan not in deltas or str(registro.get("fecha")) != hoy:
+            continue
+        cambio = int(registro.get("estado") == "VALIDADO") - int(registro.get("estado_anterior") == "VALIDADO")
+        if not cambio:
+            continue
+        deltas[plan]["total"] += cambio
+        nivel = _nivel(registro.get("grado"))
+        if nivel:
+            deltas[plan][nivel] += cambio
+    return deltas
+
+
+class BrokerRegistros:
+    """
+    Un oyente LISTEN por proceso y muchas colas de suscriptores.
+    El hilo arranca con el primer suscriptor y se reconecta solo.
+    """
+
+    def __init__(self, canal: str = CANAL):
+        self.canal = canal
+        self._clientes = {}
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    # -- Suscriptores (event loop de FastAPI) --------------------------
+    def suscribir(self) -> asyncio.Queue:
+        cola = asyncio.Queue(maxsize=_MAX_PENDIENTES)
+        with self._lock:
+            self._clientes[cola] = asyncio.get_running_loop()
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._escuchar, name="listen-registros", daemon=True)
+                self._hilo.start()
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue) -> None:
+        with self._lock:
+            self._clientes.pop(cola, None)
+
+    def clientes(self) -> int:
+        with self._lock:
+            return len(self._clientes)
+
+    def detener(self) -> None:
+        self._detener.set()
+
+    # -- Hilo oyente ---------------------------------------------------
+    def _publicar(self, evento: dict) -> None:
+        with self._lock:
+            destinos = list(self._clientes.items())
+        for cola, loop in destinos:
+            try:
+                loop.call_soon_threadsafe(self._encolar, cola, evento)
+            except RuntimeError:
+                # El event loop de ese cliente ya se cerró
+                self.desuscribir(cola)
+
+    @staticmethod
+    def _encolar(cola: asyncio.Queue, evento: dict) -> None:
+        try:
+            cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Cliente atrasado: se le pide recargar todo en lugar de acumular
+            while not cola.empty():
+                cola.get_nowait()
+            cola.put_nowait({"tipo": "recarga", "motivo": "cliente_atrasado"})
+
+    def _procesar(self, payload: str) -> None:
+        try:
+            evento = json.loads(payload)
+        except ValueError:
+            logger.warning(f"⚠️ NOTIFY con payload inválido en '{self.canal}'")
+            return
+
+        # Los agregados en caché de este proceso ya no son válidos
+        invalidar_cache()
+
+        if evento.get("tipo") == "cambios":
+            evento["contadores"] = calcular_deltas(evento.get("registros", []))
+        self._publicar(evento)
+
+    def _conectar(self):
+        conexion = psycopg2.connect(
+            host=settings.DB_HOST,
+            port=settings.DB_PORT,
+            user=settings.DB_USER,
+            password=settings.DB_PASSWORD,
+            dbname=settings.DB_NAME,
+            sslmode="disable",
+        )
+        conexion.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conexion.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.canal}")
+        return conexion
+
+    def _escuchar(self) -> None:
+        espera_reintento = 1
+        conectado_antes = False
+        while not self._detener.is_set():
+            conexion = None
+            try:
+                conexion = self._conectar()
+                logger.info(f"📡 Escuchando NOTIFY en '{self.canal}'")
+                espera_reintento = 1
+                # Mientras estuvo caída pudo perderse algo: que los clientes recarguen
+                if conectado_antes:
+                    self._publicar({"tipo": "recarga", "motivo": "reconexion"})
+                conectado_antes = True
+
+                while not self._detener.is_set():
+                    if select.select([conexion], [], [], 5) == ([], [], []):
+                        continue
+                    conexion.poll()
+                    while conexion.notifies:
+                        self._procesar(conexion.notifies.pop(0).payload)
+
+            except Exception as e:
+                logger.error(f"❌ Error en el oyente de '{self.canal}': {str(e)}")
+                self._detener.wait(espera_reintento)
+                espera_reintento = min(espera_reintento * 2, 30)
+            finally:
+                if conexion is not None:
+                    conexion.close()
+
+
+broker_registros = BrokerRegistros()
@@ -0,0 +1,85 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Particiones mensuales de registros_validacion_caf
+# ------------------------------------------------------------------
+# Con la migración 8 (manual: python -m core.schema --manual 8) la tabla
+# queda particionada por RANGE (fecha), una partición por mes
+# (registros_validacion_caf_pYYYYMM) más una DEFAULT de respaldo. Las
+# consultas del día (fecha = CURRENT_DATE) solo tocan la partición del mes
+# en curso. Mientras no se aplique, todo lo de este módulo se omite.
+#
+# El job de main.py mantiene siempre creados los próximos meses y, si hay
+# retención configurada, DESPRENDE (DETACH) las particiones viejas: la tabla
+# sigue existiendo con sus datos, pero ya no forma parte de
+# registros_validacion_caf. Los agregados de consumo_diario_caf de esos
+# meses se conservan (los KPIs históricos no cambian), pero no se deben
+# reconstruir (app/searchs/rollup.py) rangos ya desprendidos.
+
+TABLA = "registros_validacion_caf"
+PATRON_PARTICION = "^registros_validacion_caf_p[0-9]{6}$"
+
+
+def particionada(db: Session) -> bool:
+    return bool(db.execute(text("""
+        SELECT relkind = 'p'
+        FROM pg_class
+        WHERE oid = to_regclass('public.registros_validacion_caf')
+    """)).scalar())
+
+
+def crear_particiones_futuras(db: Session, meses_adelante: int) -> int:
+    """
+    Asegura las particiones desde el mes actual hasta 'meses_adelante'
+    meses después. Devuelve cuántas creó. No hace commit.
+    """
+    try:
+        return db.execute(text("""
+            SELECT public.fn_crear_particiones_registros_caf(
+                CURRENT_DATE,
+                (CURRENT_DATE + make_interval(months => :meses))::date
+            )
+        """), {"meses": meses_adelante}).scalar() or 0
+
+    except Exception as e:
+        logger.error(f"Error al crear particiones de {TABLA} en Supabase: {e}")
+        raise
+
+
+def desprender_particiones_antiguas(db: Session, meses_retencion: int) -> list:
+    """
+    DETACH de las particiones mensuales anteriores a los últimos
+    'meses_retencion' meses (contando el actual). Devuelve sus nombres.
+    No hace commit.
+    """
+    try:
+        # Sin esperar detrás de consultas largas: si no obtiene el lock se
+        # reintenta en la próxima corrida del job
+        db.execute(text("SET LOCAL lock_timeout = '5s'"))
+
+        viejas = db.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'public.registros_validacion_caf'::regclass
+              AND c.relname ~ :patron
+              AND to_date(right(c.relname, 6), 'YYYYMM')
+                  < date_trunc('month', CURRENT_DATE) - make_interval(months => :meses - 1)
+            ORDER BY c.relname
+        """), {"patron": PATRON_PARTICION, "meses": meses_retencion}).scalars().all()
+
+        for nombre in viejas:
+            # 'nombre' viene del catálogo y cumple PATRON_PARTICION
+            db.execute(text(f'ALTER TABLE public.{TABLA} DETACH PARTITION public."{nombre}"'))
+            logger.info(f"📦 Partición desprendida: {nombre}")
+
+        return list(viejas)
+
+    except Exception as e:
+        logger.error(f"Error al desprender particiones de {TABLA} en Supabase: {e}")
+        raise
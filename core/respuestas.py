@@ -0,0 +1,44 @@
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import JSONResponse
+from sqlalchemy.engine import Result
+
+# ------------------------------------------------------------------
+# Respuesta JSON rápida (orjson)
+# ------------------------------------------------------------------
+# Los listados devuelven cientos o miles de filas. Con 'return {...}'
+# FastAPI pasa todo por jsonable_encoder (recorre y copia cada valor en
+# Python) y luego por json.dumps. Devolviendo ORJSONRespuesta(...) desde el
+# endpoint ambos pasos se saltan: orjson serializa en C, entiende datetime /
+# date / UUID por su cuenta.
+#
+# orjson no conoce los RowMapping de SQLAlchemy: pasarlos por el hook
+# 'default' es una llamada Python por fila, justo lo que se quería evitar.
+# Las consultas convierten sus filas una sola vez con filas_a_dicts y el
+# hook queda para los tipos raros (Decimal, set).
+
+
+def filas_a_dicts(resultado: Result) -> list:
+    """
+    Filas de un Result como dicts: las claves se leen una vez y cada fila
+    (una tupla) se arma con zip, sin pasar por RowMapping.
+    """
+    claves = list(resultado.keys())
+    return [dict(zip(claves, fila)) for fila in resultado]
+
+
+def _por_defecto(valor):
+    if isinstance(valor, Decimal):
+        # Igual que jsonable_encoder: entero si no tiene decimales
+        return int(valor) if valor.as_tuple().exponent >= 0 else float(valor)
+    if isinstance(valor, (set, frozenset)):
+        return list(valor)
+    raise TypeError(f"Tipo no serializable a JSON: {type(valor).__name__}")
+
+
+class ORJSONRespuesta(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_por_defecto, option=orjson.OPT_NON_STR_KEYS)
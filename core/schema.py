@@ -0,0 +1,945 @@
+import argparse
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from core.config import settings
+from core.database import engine
+
+# ------------------------------------------------------------------
+# Logging
+# ------------------------------------------------------------------
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Migraciones versionadas
+# ------------------------------------------------------------------
+# Cada migración se aplica una sola vez y queda registrada en
+# public.schema_migrations_caf. Las sentencias deben ser idempotentes
+# (IF NOT EXISTS) para poder aplicarlas sobre una base que ya tenga
+# alguno de los objetos creados a mano desde el panel de Supabase.
+# Para cambiar el esquema se AGREGA una migración nueva al final;
+# nunca se edita una que ya fue aplicada.
+#
+# Las migraciones con "manual": True (cambios que bloquean o reconstruyen
+# tablas grandes) nunca corren al arrancar la API; solo con
+#   python -m core.schema --manual <versión>
+
+MIGRACIONES = [
+    {
+        "version": 1,
+        "descripcion": "Índices compuestos para listados, filtros por fecha y KPIs",
+        "sql": [
+            # KPIs del día/mes: WHERE fecha = ... AND plan = ... AND estado = ...
+            """
+            CREATE INDEX IF NOT EXISTS ix_registros_caf_fecha_plan_estado
+                ON public.registros_validacion_caf (fecha, plan, estado)
+            """,
+            # Registros de un estudiante y anti-joins del scheduler
+            """
+            CREATE INDEX IF NOT EXISTS ix_registros_caf_codigo_fecha
+                ON public.registros_validacion_caf (codigo_estudiante, fecha)
+            """,
+            # ORDER BY fecha_hora DESC, id DESC + rangos de fecha + keyset
+            """
+            CREATE INDEX IF NOT EXISTS ix_registros_caf_fecha_hora_id
+                ON public.registros_validacion_caf (fecha_hora DESC, id DESC)
+            """,
+            # Totales por tipo de alimentación en estudiantes_caf
+            """
+            CREATE INDEX IF NOT EXISTS ix_estudiantes_caf_tipo_alimentacion
+                ON public.estudiantes_caf (tipo_alimentacion)
+            """,
+        ],
+    },
+    {
+        "version": 2,
+        "descripcion": "Búsqueda por subcadena con pg_trgm y normalización sin tildes",
+        "sql": [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            "CREATE EXTENSION IF NOT EXISTS unaccent",
+            # unaccent() no es IMMUTABLE y no sirve para índices de expresión:
+            # se envuelve en una función IMMUTABLE con el esquema calificado
+            # (en Supabase las extensiones suelen vivir en 'extensions')
+            """
+            DO $$
+            DECLARE
+                esquema TEXT;
+            BEGIN
+                SELECT n.nspname INTO esquema
+                FROM pg_extension x
+                JOIN pg_namespace n ON n.oid = x.extnamespace
+                WHERE x.extname = 'unaccent';
+
+                EXECUTE format(
+                    'CREATE OR REPLACE FUNCTION public.f_normalizar(texto TEXT) RETURNS TEXT '
+                    'LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS '
+                    '$f$ SELECT lower(%1$I.unaccent(%2$L::regdictionary, texto)) $f$',
+                    esquema, esquema || '.unaccent'
+                );
+            END
+            $$
+            """,
+            # Subcadenas ('%term%') en nombre y código
+            """
+            CREATE INDEX IF NOT EXISTS ix_estudiantes_caf_nombre_trgm
+                ON public.estudiantes_caf USING gin (public.f_normalizar(nombre) gin_trgm_ops)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_estudiantes_caf_codigo_trgm
+                ON public.estudiantes_caf USING gin (codigo_estudiante gin_trgm_ops)
+            """,
+            # Prefijos ('term%') y código exacto
+            """
+            CREATE INDEX IF NOT EXISTS ix_estudiantes_caf_codigo_pattern
+                ON public.estudiantes_caf (codigo_estudiante text_pattern_ops)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_estudiantes_caf_nombre_pattern
+                ON public.estudiantes_caf (public.f_normalizar(nombre) text_pattern_ops)
+            """,
+        ],
+    },
+    {
+        "version": 3,
+        "descripcion": "Rollup diario de consumos y consumidores por mes, mantenidos por trigger",
+        "sql": [
+            # Un renglón por (día, plan, estado, grado, tipo de alimentación).
+            # grado/tipo_alimentacion se toman de estudiantes_caf al momento
+            # del registro ('' si vienen NULL, para poder ser parte de la PK).
+            # Desde la migración 9 salen del propio registro.
+            """
+            CREATE TABLE IF NOT EXISTS public.consumo_diario_caf (
+                fecha DATE NOT NULL,
+                plan TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                grado TEXT NOT NULL,
+                tipo_alimentacion TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (fecha, plan, estado, grado, tipo_alimentacion)
+            )
+            """,
+            # Consumidores distintos por mes (no se puede derivar de sumas diarias)
+            """
+            CREATE TABLE IF NOT EXISTS public.consumidores_mes_caf (
+                mes DATE NOT NULL,
+                codigo_estudiante TEXT NOT NULL,
+                PRIMARY KEY (mes, codigo_estudiante)
+            )
+            """,
+            # Trigger por sentencia con tablas de transición: el INSERT masivo
+            # del scheduler actualiza el rollup con un solo GROUP BY
+            """
+            CREATE OR REPLACE FUNCTION public.fn_consumo_diario_caf() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    INSERT INTO public.consumo_diario_caf AS c
+                        (fecha, plan, estado, grado, tipo_alimentacion, total)
+                    SELECT
+                        COALESCE(o.fecha, o.fecha_hora::date), COALESCE(o.plan, ''), COALESCE(o.estado, ''),
+                        COALESCE(e.grado, ''), COALESCE(e.tipo_alimentacion, ''), -COUNT(*)
+                    FROM viejos o
+                    INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = o.codigo_estudiante
+                    GROUP BY 1, 2, 3, 4, 5
+                    ON CONFLICT (fecha, plan, estado, grado, tipo_alimentacion)
+                    DO UPDATE SET total = c.total + EXCLUDED.total;
+                END IF;
+
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO public.consumo_diario_caf AS c
+                        (fecha, plan, estado, grado, tipo_alimentacion, total)
+                    SELECT
+                        COALESCE(n.fecha, n.fecha_hora::date), COALESCE(n.plan, ''), COALESCE(n.estado, ''),
+                        COALESCE(e.grado, ''), COALESCE(e.tipo_alimentacion, ''), COUNT(*)
+                    FROM nuevos n
+                    INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = n.codigo_estudiante
+                    GROUP BY 1, 2, 3, 4, 5
+                    ON CONFLICT (fecha, plan, estado, grado, tipo_alimentacion)
+                    DO UPDATE SET total = c.total + EXCLUDED.total;
+
+                    INSERT INTO public.consumidores_mes_caf (mes, codigo_estudiante)
+                    SELECT DISTINCT date_trunc('month', n.fecha_hora)::date, n.codigo_estudiante
+                    FROM nuevos n
+                    INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = n.codigo_estudiante
+                    WHERE n.fecha_hora IS NOT NULL
+                    ON CONFLICT DO NOTHING;
+                END IF;
+
+                RETURN NULL;
+            END
+            $$
+            """,
+            "DROP TRIGGER IF EXISTS tr_consumo_diario_caf_ins ON public.registros_validacion_caf",
+            "DROP TRIGGER IF EXISTS tr_consumo_diario_caf_upd ON public.registros_validacion_caf",
+            "DROP TRIGGER IF EXISTS tr_consumo_diario_caf_del ON public.registros_validacion_caf",
+            """
+            CREATE TRIGGER tr_consumo_diario_caf_ins
+                AFTER INSERT ON public.registros_validacion_caf
+                REFERENCING NEW TABLE AS nuevos
+                FOR EACH STATEMENT EXECUTE FUNCTION public.fn_consumo_diario_caf()
+            """,
+            """
+            CREATE TRIGGER tr_consumo_diario_caf_upd
+                AFTER UPDATE ON public.registros_validacion_caf
+                REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+                FOR EACH STATEMENT EXECUTE FUNCTION public.fn_consumo_diario_caf()
+            """,
+            """
+            CREATE TRIGGER tr_consumo_diario_caf_del
+                AFTER DELETE ON public.registros_validacion_caf
+                REFERENCING OLD TABLE AS viejos
+                FOR EACH STATEMENT EXECUTE FUNCTION public.fn_consumo_diario_caf()
+            """,
+            # Carga inicial con el histórico existente
+            "TRUNCATE public.consumo_diario_caf, public.consumidores_mes_caf",
+            """
+            INSERT INTO public.consumo_diario_caf
+                (fecha, plan, estado, grado, tipo_alimentacion, total)
+            SELECT
+                COALESCE(rv.fecha, rv.fecha_hora::date), COALESCE(rv.plan, ''), COALESCE(rv.estado, ''),
+                COALESCE(e.grado, ''), COALESCE(e.tipo_alimentacion, ''), COUNT(*)
+            FROM public.registros_validacion_caf rv
+            INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = rv.codigo_estudiante
+            GROUP BY 1, 2, 3, 4, 5
+            """,
+            """
+            INSERT INTO public.consumidores_mes_caf (mes, codigo_estudiante)
+            SELECT DISTINCT date_trunc('month', rv.fecha_hora)::date, rv.codigo_estudiante
+            FROM public.registros_validacion_caf rv
+            INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = rv.codigo_estudiante
+            WHERE rv.fecha_hora IS NOT NULL
+            """,
+        ],
+    },
+    {
+        "version": 4,
+        "descripcion": "NOTIFY en 'registros_caf' con cada INSERT/UPDATE de registros_validacion_caf",
+        "sql": [
+            # Un solo NOTIFY por sentencia. Las inserciones masivas del
+            # scheduler (o lotes grandes) mandan solo un aviso de 'recarga';
+            # el payload de NOTIFY no puede pasar de 8000 bytes.
+            """
+            CREATE OR REPLACE FUNCTION public.fn_notificar_registros_caf() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                cantidad INTEGER;
+                payload TEXT;
+            BEGIN
+                SELECT COUNT(*) INTO cantidad FROM nuevos;
+                IF cantidad = 0 THEN
+                    RETURN NULL;
+                END IF;
+
+                IF cantidad <= 20 THEN
+                    IF TG_OP = 'INSERT' THEN
+                        SELECT json_build_object(
+                            'tipo', 'cambios',
+                            'registros', json_agg(json_build_object(
+                                'id', n.id,
+                                'codigo_estudiante', n.codigo_estudiante,
+                                'nombre', e.nombre,
+                                'grado', e.grado,
+                                'tipo_alimentacion', e.tipo_alimentacion,
+                                'fecha_hora', n.fecha_hora,
+                                'fecha', n.fecha,
+                                'plan', n.plan,
+                                'estado', n.estado,
+                                'estado_anterior', NULL
+                            ))
+                        )::text INTO payload
+                        FROM nuevos n
+                        LEFT JOIN public.estudiantes_caf e ON e.codigo_estudiante = n.codigo_estudiante;
+                    ELSE
+                        SELECT json_build_object(
+                            'tipo', 'cambios',
+                            'registros', json_agg(json_build_object(
+                                'id', n.id,
+                                'codigo_estudiante', n.codigo_estudiante,
+                                'nombre', e.nombre,
+                                'grado', e.grado,
+                                'tipo_alimentacion', e.tipo_alimentacion,
+                                'fecha_hora', n.fecha_hora,
+                                'fecha', n.fecha,
+                                'plan', n.plan,
+                                'estado', n.estado,
+                                'estado_anterior', o.estado
+                            ))
+                        )::text INTO payload
+                        FROM nuevos n
+                        LEFT JOIN viejos o ON o.id = n.id
+                        LEFT JOIN public.estudiantes_caf e ON e.codigo_estudiante = n.codigo_estudiante;
+                    END IF;
+                END IF;
+
+                IF payload IS NULL OR octet_length(payload) > 7900 THEN
+                    payload := json_build_object('tipo', 'recarga', 'operacion', TG_OP, 'cantidad', cantidad)::text;
+                END IF;
+
+                PERFORM pg_notify('registros_caf', payload);
+                RETURN NULL;
+            END
+            $$
+            """,
+            "DROP TRIGGER IF EXISTS tr_notificar_registros_caf_ins ON public.registros_validacion_caf",
+            "DROP TRIGGER IF EXISTS tr_notificar_registros_caf_upd ON public.registros_validacion_caf",
+            """
+            CREATE TRIGGER tr_notificar_registros_caf_ins
+                AFTER INSERT ON public.registros_validacion_caf
+                REFERENCING NEW TABLE AS nuevos
+                FOR EACH STATEMENT EXECUTE FUNCTION public.fn_notificar_registros_caf()
+            """,
+            """
+            CREATE TRIGGER tr_notificar_registros_caf_upd
+                AFTER UPDATE ON public.registros_validacion_caf
+                REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+                FOR EACH STATEMENT EXECUTE FUNCTION public.fn_notificar_registros_caf()
+            """,
+        ],
+    },
+    {
+        "version": 5,
+        "descripcion": "Contadores de cambios por tabla para ETags (core/etag.py)",
+        "sql": [
+            # Un trigger por sentencia AGREGA una fila por cada escritura y la
+            # versión de una tabla es la suma de sus filas:
+            #   - la fila nueva solo se ve cuando la escritura confirma y un
+            #     ROLLBACK la deshace (un nextval() se vería antes del COMMIT
+            #     y no se deshace: un GET entre medio se quedaría con el ETag
+            #     nuevo y los datos viejos)
+            #   - solo INSERT, sin UPDATE de una fila común: las escrituras
+            #     concurrentes (los escáneres en el pico del almuerzo) no se
+            #     esperan unas a otras por un lock de fila
+            # compactar_versiones (core/etag.py, job del scheduler) junta las
+            # filas de cada tabla en una sola con la misma suma.
+            """
+            CREATE TABLE IF NOT EXISTS public.cambios_tablas_caf (
+                tabla TEXT NOT NULL,
+                cambios BIGINT NOT NULL DEFAULT 1
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_cambios_tablas_caf_tabla ON public.cambios_tablas_caf (tabla)",
+            # Supabase expone el esquema public por PostgREST: sin políticas,
+            # nadie más que el dueño lee o escribe la tabla
+            "ALTER TABLE public.cambios_tablas_caf ENABLE ROW LEVEL SECURITY",
+            # SECURITY DEFINER: el trigger también corre con escrituras de
+            # roles sin permiso sobre cambios_tablas_caf (RLS sin políticas)
+            """
+            CREATE OR REPLACE FUNCTION public.fn_incrementar_version_caf() RETURNS trigger
+            LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp AS $$
+            BEGIN
+                INSERT INTO public.cambios_tablas_caf (tabla) VALUES (TG_ARGV[0]);
+                RETURN NULL;
+            END
+            $$
+            """,
+            "DROP TRIGGER IF EXISTS tr_version_estudiantes_caf ON public.estudiantes_caf",
+            "DROP TRIGGER IF EXISTS tr_version_registros_caf ON public.registros_validacion_caf",
+            """
+            CREATE TRIGGER tr_version_estudiantes_caf
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.estudiantes_caf
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION public.fn_incrementar_version_caf('estudiantes')
+            """,
+            """
+            CREATE TRIGGER tr_version_registros_caf
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.registros_validacion_caf
+                FOR EACH STATEMENT
+                EXECUTE FUNCTION public.fn_incrementar_version_caf('registros')
+            """,
+        ],
+    },
+    {
+        "version": 6,
+        "descripcion": "Un registro por estudiante, fecha y plan (scheduler con varios workers)",
+        "sql": [
+            # Duplicados que dejaron los jobs corriendo en paralelo: la
+            # migración NO los borra (son registros del negocio). Si los hay,
+            # deja un WARNING con el resumen, no crea el índice único y sigue
+            # (las migraciones siguientes no dependen de él). El índice lo
+            # crea el script de depuración, que se corre a mano:
+            #   python -m scripts.depurar_duplicados --aplicar
+            # Mientras falte, los INSERT de la API no usan ON CONFLICT (ver
+            # estructura_registros) y verificar_indices lo reporta al arrancar.
+            """
+            DO $$
+            DECLARE
+                grupos BIGINT;
+                sobrantes BIGINT;
+                ejemplos TEXT;
+            BEGIN
+                WITH repetidos AS (
+                    SELECT codigo_estudiante, fecha, plan, COUNT(*) AS n
+                    FROM public.registros_validacion_caf
+                    WHERE codigo_estudiante IS NOT NULL AND fecha IS NOT NULL AND plan IS NOT NULL
+                    GROUP BY codigo_estudiante, fecha, plan
+                    HAVING COUNT(*) > 1
+                )
+                SELECT
+                    COUNT(*),
+                    COALESCE(SUM(n - 1), 0),
+                    (SELECT string_agg(format('%s %s %s (x%s)', codigo_estudiante, fecha, plan, n), ', ')
+                     FROM (SELECT * FROM repetidos ORDER BY fecha DESC LIMIT 10) m)
+                INTO grupos, sobrantes, ejemplos
+                FROM repetidos;
+
+                IF grupos > 0 THEN
+                    RAISE WARNING
+                        'registros_validacion_caf tiene % grupos (codigo_estudiante, fecha, plan) repetidos, % filas de más; no se crea ux_registros_caf_codigo_fecha_plan. Ejemplos: %',
+                        grupos, sobrantes, ejemplos
+                        USING HINT = 'Revíselos y depúrelos con: python -m scripts.depurar_duplicados (respalda las filas antes de borrarlas)';
+                    RETURN;
+                END IF;
+
+                -- Destino de los ON CONFLICT de main.py; su prefijo
+                -- (codigo, fecha) cubre lo que hacía ix_registros_caf_codigo_fecha
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_registros_caf_codigo_fecha_plan
+                    ON public.registros_validacion_caf (codigo_estudiante, fecha, plan);
+                DROP INDEX IF EXISTS public.ix_registros_caf_codigo_fecha;
+            END
+            $$
+            """,
+        ],
+    },
+    {
+        "version": 7,
+        "descripcion": "Código de estudiante único (upsert de /registro/estudiantes/import)",
+        "sql": [
+            # Solo si la tabla no trae ya una PK/UNIQUE sobre codigo_estudiante.
+            # Si hay códigos repetidos falla y hay que depurarlos primero.
+            """
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1
+                    FROM pg_index i
+                    JOIN pg_attribute a
+                        ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                    WHERE i.indrelid = 'public.estudiantes_caf'::regclass
+                      AND i.indisunique
+                      AND i.indnkeyatts = 1
+                      AND a.attname = 'codigo_estudiante'
+                ) THEN
+                    CREATE UNIQUE INDEX ux_estudiantes_caf_codigo
+                        ON public.estudiantes_caf (codigo_estudiante);
+                END IF;
+            END
+            $$
+            """,
+        ],
+    },
+    {
+        "version": 8,
+        "descripcion": "registros_validacion_caf particionada por mes (RANGE sobre fecha)",
+        # Reconstruye toda la tabla bajo ACCESS EXCLUSIVE: no corre al arrancar
+        # la API. Se aplica a mano, en una ventana sin validaciones:
+        #   python -m core.schema --manual 8
+        "manual": True,
+        "sql": [
+            # Crea (y engancha) una partición por cada mes de [desde, hasta].
+            # Se arma como tabla suelta, se le pasan las filas de ese mes que
+            # hubieran caído en la partición DEFAULT y luego se hace ATTACH:
+            # así nunca falla por filas "huérfanas" en DEFAULT. Una tabla con
+            # el mismo nombre ya existente (p. ej. una partición desprendida
+            # por la retención) se respeta y no se vuelve a enganchar.
+            # Cada partición lleva RLS sin políticas: en Supabase las tablas
+            # nuevas de public quedan expuestas por PostgREST y una consulta
+            # directa a la partición no pasa por las políticas de la tabla
+            # padre.
+            """
+            CREATE OR REPLACE FUNCTION public.fn_crear_particiones_registros_caf(desde DATE, hasta DATE)
+            RETURNS INTEGER
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                mes DATE := date_trunc('month', desde)::date;
+                siguiente DATE;
+                nombre TEXT;
+                creadas INTEGER := 0;
+            BEGIN
+                WHILE mes <= hasta LOOP
+                    siguiente := (mes + INTERVAL '1 month')::date;
+                    nombre := 'registros_validacion_caf_p' || to_char(mes, 'YYYYMM');
+
+                    IF to_regclass('public.' || nombre) IS NULL THEN
+                        EXECUTE format(
+                            'CREATE TABLE public.%I (LIKE public.registros_validacion_caf INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                            nombre
+                        );
+                        EXECUTE format('ALTER TABLE public.%I ENABLE ROW LEVEL SECURITY', nombre);
+                        IF to_regclass('public.registros_validacion_caf_default') IS NOT NULL THEN
+                            EXECUTE format(
+                                'WITH movidas AS ('
+                                '    DELETE FROM public.registros_validacion_caf_default'
+                                '    WHERE fecha >= %L AND fecha < %L RETURNING *'
+                                ') INSERT INTO public.%I SELECT * FROM movidas',
+                                mes, siguiente, nombre
+                            );
+                        END IF;
+                        EXECUTE format(
+                            'ALTER TABLE public.registros_validacion_caf ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+                            nombre, mes, siguiente
+                        );
+                        creadas := creadas + 1;
+                    END IF;
+
+                    mes := siguiente;
+                END LOOP;
+                RETURN creadas;
+            END
+            $$
+            """,
+            # Reconstrucción: la tabla actual se renombra a
+            # registros_validacion_caf_sin_particion (con sus triggers
+            # desactivados) y se crea la particionada con las mismas columnas,
+            # dueño, RLS, políticas, permisos, llaves foráneas, índices y
+            # triggers de la original. El respaldo NO se borra: después de
+            # revisar la copia se elimina a mano con
+            #   DROP TABLE public.registros_validacion_caf_sin_particion;
+            # El id pasa a una secuencia propia (las columnas IDENTITY no se
+            # admiten en tablas particionadas antes de PG 17). Las vistas
+            # siguen apuntando al respaldo: hay que recrearlas.
+            """
+            DO $$
+            DECLARE
+                original OID := 'public.registros_validacion_caf'::regclass;
+                desde DATE;
+                hasta DATE;
+                maximo BIGINT;
+                filas_origen BIGINT;
+                filas_copia BIGINT;
+                dueno NAME;
+                con_rls BOOLEAN;
+                rls_forzado BOOLEAN;
+                indices TEXT[];
+                restricciones TEXT[];
+                triggers TEXT[];
+                sentencia TEXT;
+                r RECORD;
+            BEGIN
+                IF (SELECT relkind FROM pg_class WHERE oid = original) = 'p' THEN
+                    RETURN;
+                END IF;
+                IF to_regclass('public.registros_validacion_caf_sin_particion') IS NOT NULL THEN
+                    RAISE EXCEPTION 'Ya existe public.registros_validacion_caf_sin_particion de una corrida anterior; revísela y bórrela antes de volver a particionar';
+                END IF;
+                -- Una FK solo podría apuntar a la nueva PK (id, fecha)
+                IF EXISTS (SELECT 1 FROM pg_constraint WHERE confrelid = original AND contype = 'f') THEN
+                    RAISE EXCEPTION 'Hay llaves foráneas que apuntan a registros_validacion_caf: %',
+                        (SELECT string_agg(conrelid::regclass || '.' || conname, ', ')
+                         FROM pg_constraint WHERE confrelid = original AND contype = 'f');
+                END IF;
+
+                LOCK TABLE public.registros_validacion_caf IN ACCESS EXCLUSIVE MODE;
+
+                -- Registros viejos sin fecha: se deduce de fecha_hora
+                UPDATE public.registros_validacion_caf
+                SET fecha = fecha_hora::date
+                WHERE fecha IS NULL AND fecha_hora IS NOT NULL;
+
+                -- Lo que LIKE no copia, leído antes de renombrar (las
+                -- definiciones salen con el nombre actual de la tabla)
+                SELECT pg_get_userbyid(relowner), relrowsecurity, relforcerowsecurity
+                INTO dueno, con_rls, rls_forzado
+                FROM pg_class WHERE oid = original;
+
+                SELECT array_agg(pg_get_indexdef(i.indexrelid)) INTO indices
+                FROM pg_index i
+                WHERE i.indrelid = original
+                  AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conrelid = original AND c.conindid = i.indexrelid);
+
+                SELECT array_agg(format('ALTER TABLE public.registros_validacion_caf ADD CONSTRAINT %I %s', conname, pg_get_constraintdef(oid)))
+                INTO restricciones
+                FROM pg_constraint
+                WHERE conrelid = original AND contype IN ('f', 'u', 'x');
+
+                SELECT array_agg(pg_get_triggerdef(oid)) INTO triggers
+                FROM pg_trigger
+                WHERE tgrelid = original AND NOT tgisinternal;
+
+                ALTER TABLE public.registros_validacion_caf RENAME TO registros_validacion_caf_sin_particion;
+                ALTER TABLE public.registros_validacion_caf_sin_particion DISABLE TRIGGER USER;
+                -- Los índices (y restricciones con índice) del respaldo liberan sus nombres
+                FOR r IN
+                    SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indrelid = original
+                LOOP
+                    EXECUTE format('ALTER INDEX public.%I RENAME TO %I', r.relname, left(r.relname, 50) || '_sin_part');
+                END LOOP;
+
+                CREATE TABLE public.registros_validacion_caf (
+                    LIKE public.registros_validacion_caf_sin_particion INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+                ) PARTITION BY RANGE (fecha);
+
+                IF dueno <> current_user THEN
+                    EXECUTE format('ALTER TABLE public.registros_validacion_caf OWNER TO %I', dueno);
+                END IF;
+
+                CREATE SEQUENCE IF NOT EXISTS public.registros_validacion_caf_id_particion_seq AS BIGINT;
+                SELECT MAX(id), MIN(fecha), MAX(fecha), COUNT(*) INTO maximo, desde, hasta, filas_origen
+                FROM public.registros_validacion_caf_sin_particion;
+                PERFORM setval('public.registros_validacion_caf_id_particion_seq', COALESCE(maximo, 0) + 1, false);
+                ALTER TABLE public.registros_validacion_caf
+                    ALTER COLUMN id SET DEFAULT nextval('public.registros_validacion_caf_id_particion_seq');
+                ALTER SEQUENCE public.registros_validacion_caf_id_particion_seq
+                    OWNED BY public.registros_validacion_caf.id;
+
+                -- Red de seguridad para fechas sin partición (y fecha NULL)
+                CREATE TABLE public.registros_validacion_caf_default
+                    PARTITION OF public.registros_validacion_caf DEFAULT;
+                ALTER TABLE public.registros_validacion_caf_default ENABLE ROW LEVEL SECURITY;
+
+                PERFORM public.fn_crear_particiones_registros_caf(
+                    LEAST(COALESCE(desde, CURRENT_DATE), CURRENT_DATE),
+                    GREATEST(COALESCE(hasta, CURRENT_DATE), (CURRENT_DATE + INTERVAL '3 months')::date)
+                );
+
+                INSERT INTO public.registros_validacion_caf
+                SELECT * FROM public.registros_validacion_caf_sin_particion;
+                GET DIAGNOSTICS filas_copia = ROW_COUNT;
+                IF filas_copia <> filas_origen THEN
+                    RAISE EXCEPTION 'La copia tiene % filas y el original %', filas_copia, filas_origen;
+                END IF;
+
+                -- La PK de una tabla particionada debe incluir la llave de partición
+                IF NOT EXISTS (SELECT 1 FROM public.registros_validacion_caf WHERE fecha IS NULL) THEN
+                    ALTER TABLE public.registros_validacion_caf
+                        ADD CONSTRAINT registros_validacion_caf_pkey PRIMARY KEY (id, fecha);
+                ELSE
+                    CREATE INDEX ix_registros_caf_id ON public.registros_validacion_caf (id);
+                END IF;
+
+                -- Un índice o restricción UNIQUE sin 'fecha' no se puede
+                -- crear sobre la particionada: falla aquí y nada se aplica
+                FOREACH sentencia IN ARRAY COALESCE(indices, '{}') || COALESCE(restricciones, '{}') || COALESCE(triggers, '{}') LOOP
+                    EXECUTE sentencia;
+                END LOOP;
+
+                -- RLS, políticas y permisos de la tabla original
+                IF con_rls THEN
+                    ALTER TABLE public.registros_validacion_caf ENABLE ROW LEVEL SECURITY;
+                END IF;
+                IF rls_forzado THEN
+                    ALTER TABLE public.registros_validacion_caf FORCE ROW LEVEL SECURITY;
+                END IF;
+
+                FOR r IN
+                    SELECT * FROM pg_policies
+                    WHERE schemaname = 'public' AND tablename = 'registros_validacion_caf_sin_particion'
+                LOOP
+                    EXECUTE format(
+                        'CREATE POLICY %I ON public.registros_validacion_caf AS %s FOR %s TO %s%s%s',
+                        r.policyname, r.permissive, r.cmd,
+                        (SELECT string_agg(CASE WHEN rol = 'public' THEN 'public' ELSE quote_ident(rol) END, ', ')
+                         FROM unnest(r.roles) AS rol),
+                        CASE WHEN r.qual IS NOT NULL THEN ' USING (' || r.qual || ')' ELSE '' END,
+                        CASE WHEN r.with_check IS NOT NULL THEN ' WITH CHECK (' || r.with_check || ')' ELSE '' END
+                    );
+                END LOOP;
+
+                FOR r IN
+                    SELECT a.privilege_type, a.is_grantable,
+                           CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END AS rol
+                    FROM pg_class c, aclexplode(c.relacl) a
+                    WHERE c.oid = original
+                LOOP
+                    EXECUTE format(
+                        'GRANT %s ON public.registros_validacion_caf TO %s%s',
+                        r.privilege_type, r.rol, CASE WHEN r.is_grantable THEN ' WITH GRANT OPTION' ELSE '' END
+                    );
+                END LOOP;
+
+                RAISE NOTICE 'registros_validacion_caf particionada (% filas). Respaldo en registros_validacion_caf_sin_particion', filas_copia;
+            END
+            $$
+            """,
+            "ANALYZE public.registros_validacion_caf",
+        ],
+    },
+    {
+        "version": 9,
+        "descripcion": "Grado del estudiante guardado en cada registro (el rollup ya no lo busca al reconstruir)",
+        "sql": [
+            # El grado queda como foto del momento del registro, igual que
+            # nombre y tipo_alimentacion. Antes los triggers del rollup lo
+            # tomaban de estudiantes_caf al insertar y la reconstrucción lo
+            # volvía a buscar después: si el estudiante cambiaba de grado,
+            # los dos caminos dejaban los mismos registros en renglones
+            # distintos. Los registros viejos quedan con NULL y siguen
+            # usando el grado actual en ambos caminos.
+            "ALTER TABLE public.registros_validacion_caf ADD COLUMN IF NOT EXISTS grado TEXT",
+            # Quien inserte sin el grado (PostgREST, cargas a mano) lo hereda
+            # del estudiante; las inserciones de la API ya lo mandan
+            """
+            CREATE OR REPLACE FUNCTION public.fn_grado_registro_caf() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF NEW.grado IS NULL THEN
+                    SELECT e.grado INTO NEW.grado
+                    FROM public.estudiantes_caf e
+                    WHERE e.codigo_estudiante = NEW.codigo_estudiante;
+                END IF;
+                RETURN NEW;
+            END
+            $$
+            """,
+            "DROP TRIGGER IF EXISTS tr_grado_registro_caf ON public.registros_validacion_caf",
+            """
+            CREATE TRIGGER tr_grado_registro_caf
+                BEFORE INSERT ON public.registros_validacion_caf
+                FOR EACH ROW EXECUTE FUNCTION public.fn_grado_registro_caf()
+            """,
+            # El rollup usa lo guardado en el registro (grado y tipo de
+            # alimentación) y solo cae a estudiantes_caf para los viejos
+            """
+            CREATE OR REPLACE FUNCTION public.fn_consumo_diario_caf() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    INSERT INTO public.consumo_diario_caf AS c
+                        (fecha, plan, estado, grado, tipo_alimentacion, total)
+                    SELECT
+                        COALESCE(o.fecha, o.fecha_hora::date), COALESCE(o.plan, ''), COALESCE(o.estado, ''),
+                        COALESCE(o.grado, e.grado, ''), COALESCE(o.tipo_alimentacion, e.tipo_alimentacion, ''), -COUNT(*)
+                    FROM viejos o
+                    INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = o.codigo_estudiante
+                    GROUP BY 1, 2, 3, 4, 5
+                    ON CONFLICT (fecha, plan, estado, grado, tipo_alimentacion)
+                    DO UPDATE SET total = c.total + EXCLUDED.total;
+                END IF;
+
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO public.consumo_diario_caf AS c
+                        (fecha, plan, estado, grado, tipo_alimentacion, total)
+                    SELECT
+                        COALESCE(n.fecha, n.fecha_hora::date), COALESCE(n.plan, ''), COALESCE(n.estado, ''),
+                        COALESCE(n.grado, e.grado, ''), COALESCE(n.tipo_alimentacion, e.tipo_alimentacion, ''), COUNT(*)
+                    FROM nuevos n
+                    INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = n.codigo_estudiante
+                    GROUP BY 1, 2, 3, 4, 5
+                    ON CONFLICT (fecha, plan, estado, grado, tipo_alimentacion)
+                    DO UPDATE SET total = c.total + EXCLUDED.total;
+
+                    INSERT INTO public.consumidores_mes_caf (mes, codigo_estudiante)
+                    SELECT DISTINCT date_trunc('month', n.fecha_hora)::date, n.codigo_estudiante
+                    FROM nuevos n
+                    INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = n.codigo_estudiante
+                    WHERE n.fecha_hora IS NOT NULL
+                    ON CONFLICT DO NOTHING;
+                END IF;
+
+                RETURN NULL;
+            END
+            $$
+            """,
+            # Recarga del rollup diario con la regla nueva (como la carga
+            # inicial de la migración 3); consumidores_mes_caf no depende
+            # del grado
+            "TRUNCATE public.consumo_diario_caf",
+            """
+            INSERT INTO public.consumo_diario_caf
+                (fecha, plan, estado, grado, tipo_alimentacion, total)
+            SELECT
+                COALESCE(rv.fecha, rv.fecha_hora::date), COALESCE(rv.plan, ''), COALESCE(rv.estado, ''),
+                COALESCE(rv.grado, e.grado, ''), COALESCE(rv.tipo_alimentacion, e.tipo_alimentacion, ''), COUNT(*)
+            FROM public.registros_validacion_caf rv
+            INNER JOIN public.estudiantes_caf e ON e.codigo_estudiante = rv.codigo_estudiante
+            GROUP BY 1, 2, 3, 4, 5
+            """,
+        ],
+    },
+]
+
+# Índices que las consultas de app/searchs esperan encontrar
+INDICES_REQUERIDOS = [
+    ("registros_validacion_caf", "ix_registros_caf_fecha_plan_estado"),
+    ("registros_validacion_caf", "ux_registros_caf_codigo_fecha_plan"),
+    ("registros_validacion_caf", "ix_registros_caf_fecha_hora_id"),
+    ("estudiantes_caf", "ix_estudiantes_caf_tipo_alimentacion"),
+    ("estudiantes_caf", "ix_estudiantes_caf_nombre_trgm"),
+    ("estudiantes_caf", "ix_estudiantes_caf_codigo_trgm"),
+    ("estudiantes_caf", "ix_estudiantes_caf_codigo_pattern"),
+    ("estudiantes_caf", "ix_estudiantes_caf_nombre_pattern"),
+]
+
+# Índice único de la migración 6: falta mientras haya duplicados sin depurar
+INDICE_UNICO_REGISTROS = ("registros_validacion_caf", "ux_registros_caf_codigo_fecha_plan")
+
+# estructura_registros se vuelve a consultar cada tantos segundos
+_ESTRUCTURA_TTL = 300
+_estructura = (0.0, None)
+
+# Clave arbitraria para pg_advisory_xact_lock: evita que dos workers
+# apliquen las mismas migraciones al mismo tiempo
+_LOCK_MIGRACIONES = 74_310_001
+
+
+def version_actual(bind: Engine = engine) -> int:
+    """
+    Última versión aplicada (0 si la tabla de control aún no existe).
+    """
+    with bind.connect() as connection:
+        existe = connection.execute(
+            text("SELECT to_regclass('public.schema_migrations_caf') IS NOT NULL")
+        ).scalar()
+        if not existe:
+            return 0
+        return connection.execute(
+            text("SELECT COALESCE(MAX(version), 0) FROM public.schema_migrations_caf")
+        ).scalar()
+
+
+def aplicar_migraciones(bind: Engine = engine, manuales: tuple = ()) -> int:
+    """
+    Aplica en orden las migraciones pendientes, cada una en su propia
+    transacción. Las manuales solo si su versión está en 'manuales'.
+    Devuelve cuántas se aplicaron.
+    """
+    aplicadas = 0
+    with bind.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS public.schema_migrations_caf (
+                version INTEGER PRIMARY KEY,
+                descripcion TEXT NOT NULL,
+                aplicada_en TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """))
+
+    for migracion in MIGRACIONES:
+        if migracion.get("manual") and migracion["version"] not in manuales:
+            continue
+        with bind.begin() as connection:
+            connection.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_MIGRACIONES})
+            ya_aplicada = connection.execute(
+                text("SELECT 1 FROM public.schema_migrations_caf WHERE version = :v"),
+                {"v": migracion["version"]}
+            ).scalar()
+            if ya_aplicada:
+                continue
+
+            logger.info(f"🧱 Aplicando migración {migracion['version']}: {migracion['descripcion']}")
+            for sentencia in migracion["sql"]:
+                connection.execute(text(sentencia))
+            connection.execute(
+                text("INSERT INTO public.schema_migrations_caf (version, descripcion) VALUES (:v, :d)"),
+                {"v": migracion["version"], "d": migracion["descripcion"]}
+            )
+            aplicadas += 1
+
+    return aplicadas
+
+
+def manuales_pendientes(bind: Engine = engine) -> list:
+    """
+    Versiones de las migraciones manuales que aún no se aplicaron.
+    """
+    with bind.connect() as connection:
+        aplicadas = set(connection.execute(
+            text("SELECT version FROM public.schema_migrations_caf")
+        ).scalars())
+    return [
+        migracion["version"] for migracion in MIGRACIONES
+        if migracion.get("manual") and migracion["version"] not in aplicadas
+    ]
+
+
+def verificar_indices(bind: Engine = engine) -> list:
+    """
+    Devuelve la lista de (tabla, índice) requeridos que NO existen.
+    """
+    with bind.connect() as connection:
+        existentes = {
+            (row.tablename, row.indexname)
+            for row in connection.execute(text("""
+                SELECT tablename, indexname
+                FROM pg_indexes
+                WHERE schemaname = 'public'
+            """))
+        }
+    return [indice for indice in INDICES_REQUERIDOS if indice not in existentes]
+
+
+def estructura_registros(db) -> dict:
+    """
+    Qué partes opcionales del esquema de registros_validacion_caf existen:
+    'unico' (índice único de la migración 6, destino de ON CONFLICT) y
+    'grado' (columna de la migración 9). Se guarda en memoria
+    _ESTRUCTURA_TTL segundos; 'db' es una Session o Connection.
+    """
+    global _estructura
+    expira, valor = _estructura
+    if valor is not None and time.monotonic() < expira:
+        return valor
+
+    fila = db.execute(text("""
+        SELECT
+            EXISTS (
+                SELECT 1 FROM pg_indexes
+                WHERE schemaname = 'public' AND tablename = :tabla AND indexname = :indice
+            ) AS unico,
+            EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = :tabla AND column_name = 'grado'
+            ) AS grado
+    """), {"tabla": INDICE_UNICO_REGISTROS[0], "indice": INDICE_UNICO_REGISTROS[1]}).mappings().one()
+
+    valor = dict(fila)
+    _estructura = (time.monotonic() + _ESTRUCTURA_TTL, valor)
+    return valor
+
+
+def olvidar_estructura() -> None:
+    """
+    Descarta la estructura en memoria (tras migrar o depurar duplicados).
+    """
+    global _estructura
+    _estructura = (0.0, None)
+
+
+def migrar_al_iniciar() -> None:
+    """
+    Hook de arranque: aplica migraciones si DB_AUTO_MIGRATE está activo.
+    Un fallo aquí se registra pero no impide levantar la API.
+    """
+    if not settings.DB_AUTO_MIGRATE:
+        return
+    try:
+        aplicadas = aplicar_migraciones()
+        if aplicadas:
+            logger.info(f"✅ {aplicadas} migración(es) aplicada(s).")
+        olvidar_estructura()
+        faltantes = verificar_indices()
+        if faltantes:
+            logger.warning(f"⚠️ Índices faltantes: {faltantes}")
+        if INDICE_UNICO_REGISTROS in faltantes:
+            logger.warning(
+                "⚠️ registros_validacion_caf tiene duplicados por (estudiante, fecha, plan): "
+                "los INSERT siguen sin ON CONFLICT hasta depurarlos con "
+                "python -m scripts.depurar_duplicados --aplicar"
+            )
+        for version in manuales_pendientes():
+            logger.info(f"ℹ️ Migración manual {version} pendiente: python -m core.schema --manual {version}")
+    except Exception as e:
+        logger.error(f"❌ No se pudieron aplicar las migraciones: {str(e)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica las migraciones de esquema")
+    parser.add_argument(
+        "--manual", type=int, action="append", default=[], metavar="VERSION",
+        help="Aplicar también esta migración manual (se puede repetir)"
+    )
+    args = parser.parse_args()
+
+    print("--- Migraciones de esquema ---")
+    print(f"Versión actual: {version_actual()}")
+    print(f"Aplicadas ahora: {aplicar_migraciones(manuales=tuple(args.manual))}")
+    pendientes = manuales_pendientes()
+    if pendientes:
+        print(f"ℹ️ Migraciones manuales pendientes: {pendientes}")
+    faltantes = verificar_indices()
+    if faltantes:
+        print(f"❌ Índices faltantes: {faltantes}")
+    else:
+        print("✅ Todos los índices requeridos existen.")
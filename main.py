@@ -1,11 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 import logging
 from typing import Generator
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pytz import timezone
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -13,7 +15,23 @@ from sqlalchemy import text
 
 # Importaciones locales
 from app.router import registro, auth
-from core.database import SessionLocal
+from app.exports.reportes import gestor_reportes
+from app.searchs.rollup import reconstruir_consumidores_mes, reconstruir_consumo_diario
+from app.searchs.roster import indice_roster
+from core.cache import invalidar_cache
+from core.config import settings
+from core.consultas_lentas import instalar_registro_lento
+from core.database import SessionLocal, estado_pool
+from core.etag import compactar_versiones
+from core.metricas import MiddlewareMetricas, exportar_metricas, instalar_metricas_bd, medir_job, registrar_router
+from core.notificaciones import broker_registros
+from core.particiones import crear_particiones_futuras, desprender_particiones_antiguas, particionada
+from core.schema import estructura_registros, migrar_al_iniciar
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # Opcional: pip install brotli-asgi
+    BrotliMiddleware = None
 
 # Configuración de Logging
 logging.basicConfig(level=logging.INFO)
@@ -45,11 +63,49 @@ def descargar_manual():
         filename="MANUAL_PANEL_RESTURANTE.pdf"
     )
 
+@app.get("/diagnostico/pool")
+def diagnostico_pool():
+    # Conexiones en uso/ociosas/overflow y tiempos de espera del checkout
+    return estado_pool()
+
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    # Formato de texto de Prometheus (latencias por ruta, consultas, pool y jobs)
+    return PlainTextResponse(exportar_metricas(), media_type="text/plain; version=0.0.4")
+
 # ------------------------------------------------------------------
 # Routers y Middleware
 # ------------------------------------------------------------------
 app.include_router(registro.router, prefix="/registro", tags=["registros"])
 app.include_router(auth.router, prefix="/access", tags=["servicios de loggin"])
+# Etiqueta 'route' de /metrics con el prefijo de cada router
+registrar_router(registro.router, "/registro")
+registrar_router(auth.router, "/access")
+
+# Compresión: los listados JSON (cientos/miles de filas) bajan varias veces
+# más livianos a los PCs del restaurante. Se excluyen el SSE (/stream) y los
+# archivos que ya vienen comprimidos (xlsx, parquet, .gz de /export).
+_NO_COMPRIMIR = DEFAULT_EXCLUDED_CONTENT_TYPES + (
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.apache.parquet",
+    "application/pdf",
+)
+
+if settings.COMPRESION_BROTLI and BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        quality=4,
+        minimum_size=settings.COMPRESION_MINIMO_BYTES,
+        gzip_fallback=True,
+        excluded_handlers=[r"^/registro/stream", r"^/registro/export", r"^/registro/excel", r"^/registro/reportes/.+/descargar", r"^/download/"],
+    )
+else:
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=settings.COMPRESION_MINIMO_BYTES,
+        compresslevel=settings.COMPRESION_NIVEL_GZIP,
+        exclude_content_types=_NO_COMPRIMIR,
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -59,25 +115,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Métricas: se agrega al final para quedar como el middleware más externo
+# y medir también CORS y compresión
+instalar_metricas_bd()
+instalar_registro_lento()
+app.add_middleware(MiddlewareMetricas)
+
 # ------------------------------------------------------------------
 # Scheduler - Lógica para Supabase (PostgreSQL)
 # ------------------------------------------------------------------
 colombia_tz = timezone('America/Bogota')
 scheduler = BackgroundScheduler(timezone=colombia_tz)
 
+# Con varios workers (uvicorn --workers N) o réplicas, cada proceso tiene su
+# propio scheduler y todos disparan a la misma hora. Cada job toma un
+# pg_try_advisory_xact_lock con su propia clave: solo uno lo ejecuta y los
+# demás lo saltan. El lock se libera solo con el commit/rollback. Además el
+# índice único (codigo_estudiante, fecha, plan) + ON CONFLICT DO NOTHING
+# hace que una segunda ejecución (p. ej. en otra réplica un minuto después)
+# no inserte nada.
+LOCK_JOB_SNACK = 74_310_101
+LOCK_JOB_LUNCH = 74_310_102
+LOCK_JOB_ROLLUP = 74_310_103
+LOCK_JOB_PARTICIONES = 74_310_104
+
+def tomar_lock_job(db, clave: int) -> bool:
+    return bool(db.execute(
+        text("SELECT pg_try_advisory_xact_lock(:clave)"), {"clave": clave}
+    ).scalar())
+
+def _partes_insercion(db) -> dict:
+    # 'grado' solo si ya corrió la migración 9, y ON CONFLICT solo con el
+    # índice único de la migración 6 (no existe mientras haya duplicados sin
+    # depurar): el LEFT JOIN ya evita repetir y el lock del job evita dos
+    # corridas a la vez
+    estructura = estructura_registros(db)
+    return {
+        "grado_columna": "grado, " if estructura["grado"] else "",
+        "grado_valor": "e.grado, " if estructura["grado"] else "",
+        "conflicto": "ON CONFLICT (codigo_estudiante, fecha, plan) DO NOTHING" if estructura["unico"] else "",
+    }
+
+@medir_job("snack")
 def ejecutar_registro_snack():
     # Usamos NOW() AT TIME ZONE 'America/Bogota' para que coincida con tu hora local
     print(f"--- INICIANDO INSERCIÓN AUTOMÁTICA SNACK: {datetime.now(colombia_tz)} ---")
     db = SessionLocal()
     try:
-        query = text("""
+        if not tomar_lock_job(db, LOCK_JOB_SNACK):
+            print("⏭️ SNACK ya se está ejecutando en otro worker; se omite.")
+            return
+        partes = _partes_insercion(db)
+        query = text(f"""
             INSERT INTO public.registros_validacion_caf (
-                codigo_estudiante, nombre, tipo_alimentacion, plan, estado, fecha_hora, fecha
+                codigo_estudiante, nombre, tipo_alimentacion, {partes["grado_columna"]}plan, estado, fecha_hora, fecha
             )
             SELECT 
                 e.codigo_estudiante, 
                 e.nombre, 
                 e.tipo_alimentacion, 
+                {partes["grado_valor"]}
                 'SNACK', 
                 'NO RECLAMO', 
                 (NOW() AT TIME ZONE 'America/Bogota'),
@@ -89,10 +186,13 @@ def ejecutar_registro_snack():
             WHERE r.codigo_estudiante IS NULL
                 AND e.codigo_estudiante <> '0000' -- Nueva validación
                 AND e.tipo_alimentacion NOT IN ('NINGUNO', 'ALMUERZO', 'SOLO ALMUERZO')
-                AND e.grado NOT IN ('K2', 'K3', 'K4', 'K5', '1', '2');
+                AND e.grado NOT IN ('K2', 'K3', 'K4', 'K5', '1', '2')
+            {partes["conflicto"]};
         """)
         db.execute(query)
         db.commit()
+        # Los agregados del dashboard cambiaron: que no se sirvan desde caché
+        invalidar_cache()
         print("✅ Inserción de SNACK completada exitosamente.")
     except Exception as e:
         db.rollback()
@@ -100,18 +200,24 @@ def ejecutar_registro_snack():
     finally:
         db.close()
 
+@medir_job("lunch")
 def ejecutar_registro_lunch():
     print(f"--- INICIANDO INSERCIÓN AUTOMÁTICA LUNCH: {datetime.now(colombia_tz)} ---")
     db = SessionLocal()
     try:
-        query = text("""
+        if not tomar_lock_job(db, LOCK_JOB_LUNCH):
+            print("⏭️ LUNCH ya se está ejecutando en otro worker; se omite.")
+            return
+        partes = _partes_insercion(db)
+        query = text(f"""
             INSERT INTO public.registros_validacion_caf (
-                codigo_estudiante, nombre, tipo_alimentacion, plan, estado, fecha_hora, fecha
+                codigo_estudiante, nombre, tipo_alimentacion, {partes["grado_columna"]}plan, estado, fecha_hora, fecha
             )
             SELECT 
                 e.codigo_estudiante, 
                 e.nombre, 
                 e.tipo_alimentacion, 
+                {partes["grado_valor"]}
                 'LUNCH', 
                 'NO RECLAMO', 
                 (NOW() AT TIME ZONE 'America/Bogota'),
@@ -123,10 +229,12 @@ def ejecutar_registro_lunch():
             WHERE r.codigo_estudiante IS NULL
                 AND e.codigo_estudiante <> '0000' -- Nueva validación
                 AND e.tipo_alimentacion NOT IN ('NINGUNO', 'REFRIGERIO', 'SOLO REFRIGERIO')
-                AND e.grado NOT IN ('K2', 'K3', 'K4', 'K5', '1', '2');
+                AND e.grado NOT IN ('K2', 'K3', 'K4', 'K5', '1', '2')
+            {partes["conflicto"]};
         """)
         db.execute(query)
         db.commit()
+        invalidar_cache()
         print("✅ Inserción de LUNCH completada exitosamente.")
     except Exception as e:
         db.rollback()
@@ -134,22 +242,127 @@ def ejecutar_registro_lunch():
     finally:
         db.close()
 
+@medir_job("rollup")
+def ejecutar_reconciliacion_rollup():
+    # Los triggers mantienen el rollup al día; esto recalcula la última semana
+    # desde los registros crudos por si algo quedó desfasado (cambios de grado,
+    # cargas manuales con triggers deshabilitados, etc.)
+    print(f"--- INICIANDO RECONCILIACIÓN DEL ROLLUP DIARIO: {datetime.now(colombia_tz)} ---")
+    db = SessionLocal()
+    try:
+        if not tomar_lock_job(db, LOCK_JOB_ROLLUP):
+            print("⏭️ ROLLUP ya se está ejecutando en otro worker; se omite.")
+            return
+        hoy = datetime.now(colombia_tz).date()
+        desde = hoy - timedelta(days=7)
+        renglones = reconstruir_consumo_diario(db, desde, hoy)
+        # Consumidores distintos del mes en curso (y del anterior si la
+        # semana lo toca): no se pueden derivar del rollup diario
+        consumidores = reconstruir_consumidores_mes(db, desde, hoy)
+        db.commit()
+        invalidar_cache()
+        print(
+            f"✅ Rollup reconciliado ({renglones} renglones diarios, "
+            f"{consumidores} consumidores desde {desde.replace(day=1)})."
+        )
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error en el scheduler (ROLLUP): {e}")
+    finally:
+        db.close()
+
+@medir_job("particiones")
+def mantener_particiones():
+    # Particiones de los próximos meses y, con retención, DETACH de las viejas
+    db = SessionLocal()
+    try:
+        if not particionada(db):
+            return
+        if not tomar_lock_job(db, LOCK_JOB_PARTICIONES):
+            print("⏭️ PARTICIONES ya se está ejecutando en otro worker; se omite.")
+            return
+        creadas = crear_particiones_futuras(db, settings.PARTICIONES_MESES_ADELANTE)
+        desprendidas = []
+        if settings.PARTICIONES_RETENCION_MESES > 0:
+            desprendidas = desprender_particiones_antiguas(db, settings.PARTICIONES_RETENCION_MESES)
+        db.commit()
+        if creadas or desprendidas:
+            print(f"✅ Particiones: {creadas} creada(s), {len(desprendidas)} desprendida(s).")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error en el scheduler (PARTICIONES): {e}")
+    finally:
+        db.close()
+
+@medir_job("roster")
+def refrescar_roster():
+    # Solo compara la versión de estudiantes_caf; lee el roster si cambió
+    db = SessionLocal()
+    try:
+        indice_roster.refrescar(db)
+    except Exception as e:
+        # Se sigue respondiendo con la última copia en memoria
+        print(f"❌ Error en el scheduler (ROSTER): {e}")
+    finally:
+        db.rollback()
+        db.close()
+
+@medir_job("versiones")
+def compactar_versiones_etag():
+    # Una fila por escritura en cambios_tablas_caf: juntarlas mantiene
+    # barata la lectura de versiones de los ETags
+    db = SessionLocal()
+    try:
+        compactar_versiones(db)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error en el scheduler (VERSIONES): {e}")
+    finally:
+        db.close()
+
+@medir_job("reportes")
+def limpiar_reportes():
+    # Archivos de reportes en segundo plano que ya pasaron la retención
+    try:
+        borrados = gestor_reportes.limpiar(settings.REPORTES_RETENCION_HORAS)
+        if borrados:
+            print(f"🧹 Reportes expirados eliminados: {borrados}")
+    except Exception as e:
+        print(f"❌ Error en el scheduler (REPORTES): {e}")
+
 # ------------------------------------------------------------------
 # Tareas Programadas
 # ------------------------------------------------------------------
 scheduler.add_job(ejecutar_registro_snack, 'cron', hour=11, minute=30)
 scheduler.add_job(ejecutar_registro_lunch, 'cron', hour=14, minute=15)
+scheduler.add_job(ejecutar_reconciliacion_rollup, 'cron', hour=23, minute=45)
+scheduler.add_job(mantener_particiones, 'cron', hour=0, minute=30)
+scheduler.add_job(limpiar_reportes, 'interval', hours=1)
+scheduler.add_job(compactar_versiones_etag, 'interval', minutes=1)
+if settings.ROSTER_EN_MEMORIA:
+    scheduler.add_job(refrescar_roster, 'interval', seconds=settings.ROSTER_REFRESCO_SEGUNDOS)
 
 # ------------------------------------------------------------------
 # Eventos de Ciclo de Vida
 # ------------------------------------------------------------------
 @app.on_event("startup")
 def startup_event():
+    # Índices y objetos de esquema que necesitan las consultas
+    migrar_al_iniciar()
+    mantener_particiones()
+
+    # Roster en memoria para las búsquedas (si falla, se consulta la base
+    # hasta que el job de refresco logre cargarlo)
+    if settings.ROSTER_EN_MEMORIA:
+        refrescar_roster()
+
     if not scheduler.running:
         scheduler.start()
         logger.info("🚀 SCHEDULER INICIADO: Buscando faltantes en Supabase.")
 
 @app.on_event("shutdown")
 def shutdown_event():
+    broker_registros.detener()
     scheduler.shutdown()
     logger.info("🛑 SCHEDULER APAGADO.")
\ No newline at end of file
@@ -0,0 +1,147 @@
+import argparse
+import logging
+import sys
+
+from sqlalchemy import text
+
+from core.database import SessionLocal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# Depuración manual de registros duplicados
+# ------------------------------------------------------------------
+# La migración 6 no crea el índice único por estudiante, fecha y plan
+# mientras registros_validacion_caf tenga duplicados (los que dejaron los
+# jobs del scheduler corriendo en varios workers a la vez). Este script los
+# muestra y, solo con --aplicar, los borra y crea el índice:
+#
+#   python -m scripts.depurar_duplicados            # solo el resumen
+#   python -m scripts.depurar_duplicados --aplicar  # respalda y borra
+#
+# De cada grupo se conserva el VALIDADO si lo hay y, entre iguales, el de
+# menor id. Antes de borrar, las filas sobrantes se copian (con la fecha de
+# la depuración) a public.registros_validacion_caf_duplicados, en la misma
+# transacción que el borrado y el índice: si algo falla no se borra nada.
+
+TABLA_RESPALDO = "registros_validacion_caf_duplicados"
+
+_SQL_SOBRANTES = """
+    SELECT id
+    FROM (
+        SELECT
+            id,
+            ROW_NUMBER() OVER (
+                PARTITION BY codigo_estudiante, fecha, plan
+                ORDER BY (estado = 'VALIDADO') DESC, id ASC
+            ) AS n
+        FROM public.registros_validacion_caf
+        WHERE codigo_estudiante IS NOT NULL AND fecha IS NOT NULL AND plan IS NOT NULL
+    ) d
+    WHERE d.n > 1
+"""
+
+
+def resumen(db) -> dict:
+    fila = db.execute(text("""
+        SELECT COUNT(*) AS grupos, COALESCE(SUM(n - 1), 0) AS sobrantes
+        FROM (
+            SELECT COUNT(*) AS n
+            FROM public.registros_validacion_caf
+            WHERE codigo_estudiante IS NOT NULL AND fecha IS NOT NULL AND plan IS NOT NULL
+            GROUP BY codigo_estudiante, fecha, plan
+            HAVING COUNT(*) > 1
+        ) d
+    """)).mappings().one()
+    ejemplos = db.execute(text("""
+        SELECT codigo_estudiante, fecha, plan, array_agg(estado ORDER BY id) AS estados
+        FROM public.registros_validacion_caf
+        WHERE codigo_estudiante IS NOT NULL AND fecha IS NOT NULL AND plan IS NOT NULL
+        GROUP BY codigo_estudiante, fecha, plan
+        HAVING COUNT(*) > 1
+        ORDER BY fecha DESC
+        LIMIT 20
+    """)).mappings().all()
+    return {**fila, "ejemplos": [dict(ejemplo) for ejemplo in ejemplos]}
+
+
+def depurar(db) -> int:
+    """
+    Respalda y borra las filas sobrantes. Devuelve cuántas borró. No hace commit.
+    """
+    db.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS public.{TABLA_RESPALDO}
+            (LIKE public.registros_validacion_caf)
+    """))
+    db.execute(text(f"""
+        ALTER TABLE public.{TABLA_RESPALDO}
+            ADD COLUMN IF NOT EXISTS depurado_en TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    """))
+    # Historial de estudiantes: que PostgREST no lo exponga
+    db.execute(text(f"ALTER TABLE public.{TABLA_RESPALDO} ENABLE ROW LEVEL SECURITY"))
+
+    db.execute(text(f"CREATE TEMP TABLE ids_duplicados ON COMMIT DROP AS {_SQL_SOBRANTES}"))
+    respaldadas = db.execute(text(f"""
+        INSERT INTO public.{TABLA_RESPALDO}
+        SELECT r.*, NOW()
+        FROM public.registros_validacion_caf r
+        JOIN ids_duplicados d ON d.id = r.id
+    """)).rowcount
+    borradas = db.execute(text("""
+        DELETE FROM public.registros_validacion_caf r
+        USING ids_duplicados d
+        WHERE r.id = d.id
+    """)).rowcount
+
+    if respaldadas != borradas:
+        raise RuntimeError(f"Se respaldaron {respaldadas} filas pero se iban a borrar {borradas}")
+    return borradas
+
+
+def crear_indice_unico(db) -> None:
+    """
+    Lo que la migración 6 omitió por los duplicados. No hace commit.
+    """
+    db.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_registros_caf_codigo_fecha_plan
+            ON public.registros_validacion_caf (codigo_estudiante, fecha, plan)
+    """))
+    db.execute(text("DROP INDEX IF EXISTS public.ix_registros_caf_codigo_fecha"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Depura registros duplicados por estudiante, fecha y plan")
+    parser.add_argument("--aplicar", action="store_true", help="Respaldar y borrar (sin esto solo muestra el resumen)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        datos = resumen(db)
+        logger.info(f"🔎 {datos['grupos']} grupos repetidos, {datos['sobrantes']} filas de más")
+        for ejemplo in datos["ejemplos"]:
+            logger.info(
+                f"   {ejemplo['codigo_estudiante']} {ejemplo['fecha']} {ejemplo['plan']}: {ejemplo['estados']}"
+            )
+        if not args.aplicar:
+            if datos["grupos"]:
+                logger.info("ℹ️ Nada se borró. Use --aplicar para respaldar y borrar las filas de más.")
+            return
+
+        borradas = depurar(db) if datos["grupos"] else 0
+        crear_indice_unico(db)
+        db.commit()
+        logger.info(
+            f"✅ {borradas} filas borradas; copia en public.{TABLA_RESPALDO}. "
+            "Índice único ux_registros_caf_codigo_fecha_plan creado."
+        )
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ No se pudo depurar: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
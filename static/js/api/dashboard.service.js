@@ -1,5 +1,5 @@
 
-import { request } from './apiClient.js';
+import { request, API_BASE_URL } from './apiClient.js';
 
 export const dashboardService = {
     getStudents: () => {
@@ -21,5 +21,13 @@ export const dashboardService = {
     },
     getConsumoMes: async () => {
         return await request("/registro/dashboard/consumo-mes");
+    },
+    // Todos los indicadores y los últimos registros en una sola petición
+    getSnapshot: async () => {
+        return await request("/registro/dashboard/snapshot");
+    },
+    // Feed en vivo (SSE) de validaciones: reemplaza el sondeo periódico
+    abrirStream: () => {
+        return new EventSource(`${API_BASE_URL}/registro/stream`);
     }
 };
\ No newline at end of file
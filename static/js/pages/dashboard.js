@@ -2,7 +2,7 @@ import { dashboardService } from "../api/dashboard.service.js";
 
 function CrearFila(data) {
     return `
-        <tr>
+        <tr data-id="${data.id}">
             <td>${data.codigo_estudiante}</td>
             <td>${data.nombre}</td>
             <td>${data.grado || ""}</td>
@@ -41,11 +41,11 @@ function cargarCartas(totalestudiantes, consumoshoy, planes, consumosmes) {
                     <div class="text-center">
                         <div class="d-flex justify-content-around align-items-center">
                             <span class="text-secondary fw-bold small">SNACKS</span>
-                            <span class="fw-bold text-primary" style="font-size: 2.5rem;">${snack.total}</span>
+                            <span class="fw-bold text-primary" style="font-size: 2.5rem;" id="snack-total">${snack.total}</span>
                         </div>
                         <div class="d-flex justify-content-center gap-3">
-                            <small class="text-muted">Elem: <span class="fw-bold">${snack.elementary}</span></small>
-                            <small class="text-muted">High: <span class="fw-bold">${snack.highschool}</span></small>
+                            <small class="text-muted">Elem: <span class="fw-bold" id="snack-elementary">${snack.elementary}</span></small>
+                            <small class="text-muted">High: <span class="fw-bold" id="snack-highschool">${snack.highschool}</span></small>
                         </div>
                     </div>
 
@@ -54,11 +54,11 @@ function cargarCartas(totalestudiantes, consumoshoy, planes, consumosmes) {
                     <div class="text-center">
                         <div class="d-flex justify-content-around align-items-center">
                             <span class="text-secondary fw-bold small">LUNCH</span>
-                            <span class="fw-bold text-success" style="font-size: 2.5rem;">${lunch.total}</span>
+                            <span class="fw-bold text-success" style="font-size: 2.5rem;" id="lunch-total">${lunch.total}</span>
                         </div>
                         <div class="d-flex justify-content-center gap-3">
-                            <small class="text-muted">Elem: <span class="fw-bold">${lunch.elementary}</span></small>
-                            <small class="text-muted">High: <span class="fw-bold">${lunch.highschool}</span></small>
+                            <small class="text-muted">Elem: <span class="fw-bold" id="lunch-elementary">${lunch.elementary}</span></small>
+                            <small class="text-muted">High: <span class="fw-bold" id="lunch-highschool">${lunch.highschool}</span></small>
                         </div>
                     </div>
                 </div>
@@ -74,49 +74,114 @@ function cargarCartas(totalestudiantes, consumoshoy, planes, consumosmes) {
     `;
 }
 
-async function init() {
-    console.log("✅ dashboard.js cargado correctamente");
+const MAX_FILAS_RECIENTES = 15;
+let fuenteEventos = null;
+let recargaPendiente = null;
+
+const formatDateTime = (isoString) => {
+    if (!isoString) return "";
+    return isoString.replace("T", " - ").split('.')[0];
+};
+
+function formatearFila(item) {
+    const estudiante = { ...item };
+    for (const key in estudiante) {
+        if (typeof estudiante[key] === "string" && estudiante[key].includes("T")) {
+            estudiante[key] = formatDateTime(estudiante[key]);
+        }
+    }
+    return CrearFila(estudiante);
+}
+
+function renderizar(snapshot) {
+    const totalestudiantes = snapshot.total_estudiantes;
+    const consumoshoy = snapshot.consumos_hoy;
+    const planes = snapshot.planes;
+    const consumosmes = snapshot.consumo_mes;
+    const estudiantes_info = snapshot.recientes;
 
+    let divcartas = document.getElementById("cartas");
+    if (divcartas) {
+        divcartas.innerHTML = cargarCartas(totalestudiantes, consumoshoy, planes, consumosmes);
+    }
+
+    const tbody = document.getElementById("cuerpodedashboard");
+    if (tbody) {
+        const data = estudiantes_info.data || [];
+        const filas = data.map(formatearFila).join("");
+        tbody.innerHTML = filas || `<tr><td colspan="7" class="text-center">No hay registros recientes</td></tr>`;
+    }
+}
+
+async function recargar() {
     try {
-        const [totalestudiantes, consumoshoy, planes, consumosmes, estudiantes_info] = await Promise.all([
-            dashboardService.getTotalEstudiantes(),
-            dashboardService.getConsumidoresHoy(),
-            dashboardService.getPlanesActivos(),
-            dashboardService.getConsumoMes(),
-            dashboardService.getStudents()
-        ]);
-
-        let divcartas = document.getElementById("cartas");
-        if (divcartas) {
-            divcartas.innerHTML = cargarCartas(totalestudiantes, consumoshoy, planes, consumosmes);
+        renderizar(await dashboardService.getSnapshot());
+    } catch (error) {
+        console.error("❌ Error recargando el dashboard:", error);
+    }
+}
+
+// Aplica un evento 'cambios' del stream: suma los deltas a las cartas de hoy
+// y pone arriba los registros nuevos/actualizados, sin volver a consultar.
+function aplicarCambios(evento) {
+    const contadores = evento.contadores || {};
+    for (const plan of ["snack", "lunch"]) {
+        for (const campo of ["elementary", "highschool", "total"]) {
+            const delta = contadores[plan]?.[campo] || 0;
+            const el = document.getElementById(`${plan}-${campo}`);
+            if (el && delta) el.innerText = (parseInt(el.innerText) || 0) + delta;
         }
+    }
 
-        const tbody = document.getElementById("cuerpodedashboard");
-        if (tbody) {
-            const data = estudiantes_info.data || [];
-            
-            const formatDateTime = (isoString) => {
-                if (!isoString) return "";
-                return isoString.replace("T", " - ").split('.')[0];
-            };
-
-            let filas = "";
-            data.forEach(item => {
-                const estudiante = { ...item };
-                for (const key in estudiante) {
-                    if (typeof estudiante[key] === "string" && estudiante[key].includes("T")) {
-                        estudiante[key] = formatDateTime(estudiante[key]);
-                    }
-                }
-                filas += CrearFila(estudiante);
-            });
-
-            tbody.innerHTML = filas || `<tr><td colspan="7" class="text-center">No hay registros recientes</td></tr>`;
+    const tbody = document.getElementById("cuerpodedashboard");
+    if (!tbody) return;
+    if (!tbody.querySelector("tr[data-id]")) tbody.innerHTML = "";
+
+    (evento.registros || []).forEach(registro => {
+        tbody.querySelector(`tr[data-id="${registro.id}"]`)?.remove();
+        tbody.insertAdjacentHTML("afterbegin", formatearFila(registro));
+    });
+
+    const filas = tbody.querySelectorAll("tr[data-id]");
+    for (let i = MAX_FILAS_RECIENTES; i < filas.length; i++) filas[i].remove();
+}
+
+function conectarStream() {
+    if (fuenteEventos) fuenteEventos.close();
+    fuenteEventos = dashboardService.abrirStream();
+
+    fuenteEventos.addEventListener("cambios", (e) => {
+        // Si el usuario ya salió del dashboard se cierra el stream
+        if (!document.getElementById("cartas")) {
+            fuenteEventos.close();
+            return;
         }
+        aplicarCambios(JSON.parse(e.data));
+    });
 
+    // Cambios masivos (scheduler) o reconexión: se pide un snapshot nuevo,
+    // agrupando varios avisos seguidos en una sola petición
+    fuenteEventos.addEventListener("recarga", () => {
+        if (!document.getElementById("cartas")) {
+            fuenteEventos.close();
+            return;
+        }
+        clearTimeout(recargaPendiente);
+        recargaPendiente = setTimeout(recargar, 1000);
+    });
+}
+
+async function init() {
+    console.log("✅ dashboard.js cargado correctamente");
+
+    try {
+        // Una sola petición trae las cartas y la tabla de registros recientes
+        renderizar(await dashboardService.getSnapshot());
+        // A partir de aquí los cambios llegan por el stream (sin sondeo)
+        conectarStream();
     } catch (error) {
         console.error("❌ Error inicializando el dashboard:", error);
     }
 }
 
-export { init };
\ No newline at end of file
+export { init };
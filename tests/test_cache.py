@@ -0,0 +1,116 @@
+import contextvars
+
+import pytest
+
+from core import cache
+from core.cache import TTLCache, _NO_ENCONTRADO, cached, fijar_versiones
+
+
+class Reloj:
+    """
+    Reemplazo de time.monotonic que solo avanza cuando el test lo pide.
+    """
+
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(cache.time, "monotonic", reloj)
+    return reloj
+
+
+def test_entrada_expira_al_cumplir_el_ttl(reloj):
+    c = TTLCache(maxsize=4)
+    c.set(("f", 1), "valor", ttl=10)
+
+    reloj.ahora += 9.9
+    assert c.get(("f", 1)) == "valor"
+
+    reloj.ahora += 0.1
+    assert c.get(("f", 1)) is _NO_ENCONTRADO
+    # La entrada vencida se borra al leerla
+    assert c.estadisticas()["entradas"] == 0
+
+
+def test_desaloja_la_menos_usada_recientemente(reloj):
+    c = TTLCache(maxsize=2)
+    c.set(("f", "a"), 1, ttl=60)
+    c.set(("f", "b"), 2, ttl=60)
+    # Leer 'a' la vuelve la más reciente: al pasar del tope sale 'b'
+    assert c.get(("f", "a")) == 1
+    c.set(("f", "c"), 3, ttl=60)
+
+    assert c.get(("f", "b")) is _NO_ENCONTRADO
+    assert c.get(("f", "a")) == 1
+    assert c.get(("f", "c")) == 3
+    stats = c.estadisticas()
+    assert stats["entradas"] == 2
+    assert stats["desalojos"] == 1
+
+
+def test_reescribir_una_clave_no_desaloja(reloj):
+    c = TTLCache(maxsize=2)
+    c.set(("f", "a"), 1, ttl=60)
+    c.set(("f", "b"), 2, ttl=60)
+    c.set(("f", "a"), 10, ttl=60)
+
+    assert c.get(("f", "a")) == 10
+    assert c.get(("f", "b")) == 2
+    assert c.estadisticas()["desalojos"] == 0
+
+
+def test_invalidar_un_espacio_deja_los_demas(reloj):
+    c = TTLCache(maxsize=8)
+    c.set(("f", 1), "f1", ttl=60)
+    c.set(("f", 2), "f2", ttl=60)
+    c.set(("g", 1), "g1", ttl=60)
+
+    c.invalidar("f")
+    assert c.get(("f", 1)) is _NO_ENCONTRADO
+    assert c.get(("f", 2)) is _NO_ENCONTRADO
+    assert c.get(("g", 1)) == "g1"
+
+    c.invalidar()
+    assert c.get(("g", 1)) is _NO_ENCONTRADO
+
+
+def test_aciertos_y_fallos_por_espacio(reloj):
+    c = TTLCache(maxsize=8)
+    c.get(("f", 1))
+    c.set(("f", 1), "f1", ttl=60)
+    c.get(("f", 1))
+    c.get(("f", 1))
+    c.get(("g", 1))
+
+    assert c.estadisticas()["por_funcion"] == {
+        "f": {"aciertos": 2, "fallos": 1},
+        "g": {"aciertos": 0, "fallos": 1}
+    }
+
+
+def test_cached_separa_por_versiones_del_request(reloj, monkeypatch):
+    monkeypatch.setattr(cache, "_backend", TTLCache(maxsize=8))
+    monkeypatch.setattr(cache.settings, "CACHE_ENABLED", True)
+    llamadas = []
+
+    @cached(ttl=60)
+    def total(db, plan):
+        llamadas.append(plan)
+        return len(llamadas)
+
+    def con_versiones(version):
+        fijar_versiones({"registros": version})
+        return total(None, "SNACK")
+
+    # Cada request corre en su propio contexto, como en ASGI
+    assert contextvars.copy_context().run(con_versiones, 1) == 1
+    assert contextvars.copy_context().run(con_versiones, 1) == 1
+    # Otra versión (otro worker escribió): no se sirve el resultado viejo
+    assert contextvars.copy_context().run(con_versiones, 2) == 2
+    assert llamadas == ["SNACK", "SNACK"]
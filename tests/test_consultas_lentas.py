@@ -0,0 +1,37 @@
+from core.consultas_lentas import _admite_explain, consulta_de_cursor, normalizar_sql, resumir_parametros
+
+
+def test_normalizar_sql_agrupa_la_misma_consulta():
+    una = """
+        SELECT * FROM public.registros_validacion_caf  -- listado
+        WHERE plan = 'SNACK' AND id > 42 /* cursor */
+    """
+    otra = "SELECT * FROM public.registros_validacion_caf WHERE plan = 'LUNCH' AND id > 7"
+
+    assert normalizar_sql(una) == "SELECT * FROM public.registros_validacion_caf WHERE plan = ? AND id > ?"
+    assert normalizar_sql(una) == normalizar_sql(otra)
+    # Comillas escapadas y decimales también son un solo literal
+    assert normalizar_sql("SELECT 'O''Brien', 1.5") == "SELECT ?, ?"
+
+
+def test_consulta_de_cursor_quita_el_declare():
+    consulta = "SELECT id FROM public.estudiantes_caf"
+
+    assert consulta_de_cursor(f'DECLARE "c_1" NO SCROLL CURSOR WITH HOLD FOR {consulta}') == consulta
+    assert consulta_de_cursor(f"declare c_2 binary insensitive cursor for {consulta}") == consulta
+    # Cualquier otra sentencia queda igual
+    assert consulta_de_cursor(consulta) == consulta
+
+
+def test_explain_solo_para_lecturas():
+    assert _admite_explain("SELECT 1", False)
+    assert _admite_explain("WITH t AS (SELECT 1) SELECT * FROM t", False)
+    assert not _admite_explain("WITH t AS (DELETE FROM x RETURNING *) SELECT * FROM t", False)
+    assert not _admite_explain("SELECT 1", True)
+    assert not _admite_explain("UPDATE x SET y = 1", False)
+
+
+def test_resumir_parametros_recorta_lotes():
+    resumen = resumir_parametros({"codigos": list(range(1000)), "plan": "SNACK"})
+
+    assert resumen == "{codigos: [0, 1, 2, 3, 4]… (1000 elementos), plan: 'SNACK'}"
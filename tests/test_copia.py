@@ -0,0 +1,40 @@
+import pytest
+
+from app.exports import copia
+
+
+@pytest.fixture(autouse=True)
+def espera_corta(monkeypatch):
+    monkeypatch.setattr(copia, "_ESPERA_COLA", 0.05)
+
+
+def test_error_al_pedir_la_conexion_llega_al_consumidor(monkeypatch):
+    class MotorCaido:
+        def raw_connection(self):
+            raise ConnectionError("réplica caída")
+
+    monkeypatch.setattr(copia, "motor_lectura", lambda lsn_minimo=None: MotorCaido())
+
+    with pytest.raises(ConnectionError, match="réplica caída"):
+        list(copia.exportar_copy("csv"))
+
+
+def test_hilo_muerto_sin_fin_no_cuelga_la_descarga(monkeypatch):
+    # Un productor que termina sin entregar _FIN ni una excepción
+    monkeypatch.setattr(copia, "_ejecutar_copy", lambda *args: None)
+
+    with pytest.raises(RuntimeError, match="sin completar"):
+        list(copia.exportar_copy("ndjson", comprimir=True))
+
+
+def test_entrega_los_bloques_y_termina(monkeypatch):
+    def productor(formato, filtros, cola, cancelado, lsn_minimo):
+        escritor = copia._EscritorCola(cola, cancelado)
+        escritor.write("id,plan\n")
+        escritor.write(b"1,SNACK\n")
+        escritor.flush()
+        escritor.entregar(copia._FIN)
+
+    monkeypatch.setattr(copia, "_ejecutar_copy", productor)
+
+    assert b"".join(copia.exportar_copy("csv")) == b"id,plan\n1,SNACK\n"
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+from core import database
+
+
+def _abrir_y_cerrar(dependencia):
+    async def correr():
+        generador = dependencia()
+        db = await generador.__anext__()
+        await generador.aclose()
+        return db
+    return asyncio.run(correr())
+
+
+def _no_medir():
+    raise AssertionError("no debería medir la réplica")
+
+
+def test_medicion_de_replica_fuera_del_event_loop(monkeypatch):
+    hilos = []
+
+    def sana():
+        hilos.append(threading.get_ident())
+        return False
+
+    monkeypatch.setattr(database.estado_replica, "por_verificar", lambda: True)
+    monkeypatch.setattr(database.estado_replica, "sana", sana)
+
+    async def hilo_del_loop():
+        return threading.get_ident()
+
+    db = _abrir_y_cerrar(database.get_read_db)
+
+    assert len(hilos) == 1
+    assert hilos[0] != asyncio.run(hilo_del_loop())
+    assert not database.es_replica(db)
+
+
+def test_sin_medicion_pendiente_usa_el_ultimo_resultado(monkeypatch):
+    monkeypatch.setattr(database.estado_replica, "por_verificar", lambda: False)
+    monkeypatch.setattr(database.estado_replica, "sana", _no_medir)
+
+    db = _abrir_y_cerrar(database.get_read_db)
+
+    assert not database.es_replica(db)
@@ -0,0 +1,33 @@
+from datetime import date
+
+from starlette.requests import Request
+
+from core.etag import calcular_etag, coincide_if_none_match
+
+
+def _request(if_none_match: str = None) -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match is not None else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_etag_depende_de_versiones_y_partes():
+    base = calcular_etag({"registros": 7, "estudiantes": 3}, "/registro/hoy", date(2026, 3, 2))
+
+    # El orden de las tablas no importa
+    assert calcular_etag({"estudiantes": 3, "registros": 7}, "/registro/hoy", date(2026, 3, 2)) == base
+    assert calcular_etag({"registros": 8, "estudiantes": 3}, "/registro/hoy", date(2026, 3, 2)) != base
+    assert calcular_etag({"registros": 7, "estudiantes": 3}, "/registro/hoy", date(2026, 3, 3)) != base
+    assert calcular_etag({"registros": 7, "estudiantes": 3}, "/registro/kpis", date(2026, 3, 2)) != base
+    # ETag fuerte entre comillas
+    assert base.startswith('"') and base.endswith('"') and not base.startswith("W/")
+
+
+def test_if_none_match():
+    etag = calcular_etag({"registros": 1}, "/registro/hoy")
+
+    assert coincide_if_none_match(_request(etag), etag)
+    assert coincide_if_none_match(_request(f'"otro", W/{etag}'), etag)
+    assert coincide_if_none_match(_request("*"), etag)
+    assert not coincide_if_none_match(_request('"otro"'), etag)
+    assert not coincide_if_none_match(_request(""), etag)
+    assert not coincide_if_none_match(_request(), etag)
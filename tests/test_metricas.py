@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from core import metricas
+
+
+def _pedir(app, ruta: str) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": ruta, "raw_path": ruta.encode(),
+        "root_path": "", "query_string": b"", "headers": [],
+        "server": ("prueba", 80), "client": ("cliente", 1234),
+    }
+    estado = {}
+
+    async def recibir():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def enviar(mensaje):
+        if mensaje["type"] == "http.response.start":
+            estado["status"] = mensaje["status"]
+
+    asyncio.run(app(scope, recibir, enviar))
+    return estado["status"]
+
+
+@pytest.fixture
+def etiquetas(monkeypatch):
+    observadas = []
+    monkeypatch.setattr(
+        metricas.latencia_http, "observar",
+        lambda valor, metodo, ruta, status: observadas.append((metodo, ruta, status))
+    )
+    return observadas
+
+
+def test_etiqueta_route_incluye_el_prefijo_de_cada_router(etiquetas):
+    from main import app
+
+    assert _pedir(app, "/registro/roster/estado") == 200
+    assert _pedir(app, "/access/auth/ping") == 200
+    assert _pedir(app, "/") == 200
+    _pedir(app, "/no-existe")
+
+    assert etiquetas == [
+        ("GET", "/registro/roster/estado", 200),
+        ("GET", "/access/auth/ping", 200),
+        ("GET", "/", 200),
+        ("GET", "sin_ruta", 404),
+    ]
+
+
+def test_plantilla_conserva_los_parametros():
+    from app.router import registro
+
+    ruta = next(r for r in registro.router.routes if getattr(r, "path", "") == "/reportes/{id_reporte}")
+
+    assert metricas.plantilla_ruta(ruta) == "/registro/reportes/{id_reporte}"
+    assert metricas.plantilla_ruta(None) == "sin_ruta"
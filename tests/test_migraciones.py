@@ -0,0 +1,237 @@
+import os
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.searchs import validaciones
+from core import schema
+
+# ------------------------------------------------------------------
+# Las pruebas con Postgres necesitan una base DESECHABLE: borran y crean
+# las tablas de public. Sin TEST_DATABASE_URL se omiten.
+#   TEST_DATABASE_URL=postgresql://... python -m pytest -q tests/test_migraciones.py
+# ------------------------------------------------------------------
+URL_PRUEBAS = os.environ.get("TEST_DATABASE_URL")
+
+con_postgres = pytest.mark.skipif(not URL_PRUEBAS, reason="TEST_DATABASE_URL no definida")
+
+
+class _SesionFalsa:
+    """
+    Responde la consulta de estructura_registros y cuenta las llamadas.
+    """
+
+    def __init__(self, unico: bool, grado: bool):
+        self.fila = {"unico": unico, "grado": grado}
+        self.consultas = 0
+
+    def execute(self, *args, **kwargs):
+        self.consultas += 1
+        fila = self.fila
+
+        class _Resultado:
+            def mappings(self):
+                return self
+
+            def one(self):
+                return fila
+
+        return _Resultado()
+
+
+@pytest.fixture(autouse=True)
+def estructura_limpia():
+    schema.olvidar_estructura()
+    yield
+    schema.olvidar_estructura()
+
+
+def test_estructura_se_guarda_en_memoria():
+    db = _SesionFalsa(unico=False, grado=True)
+
+    assert schema.estructura_registros(db) == {"unico": False, "grado": True}
+    assert schema.estructura_registros(db) == {"unico": False, "grado": True}
+    assert db.consultas == 1
+
+    schema.olvidar_estructura()
+    schema.estructura_registros(db)
+    assert db.consultas == 2
+
+
+def test_lote_sin_indice_unico_no_usa_on_conflict():
+    sql = str(validaciones._sql_lote(grado=False, unico=False))
+
+    assert "ON CONFLICT" not in sql
+    assert "grado, plan" not in sql
+    assert "AND NOT EXISTS" in sql
+
+
+def test_lote_con_indice_unico_y_grado():
+    sql = str(validaciones._sql_lote(grado=True, unico=True))
+
+    assert "ON CONFLICT (codigo_estudiante, fecha, plan) DO NOTHING" in sql
+    assert "grado, plan" in sql
+
+
+@pytest.fixture
+def motor_con_duplicados():
+    from bench.sembrar import DDL
+
+    motor = create_engine(URL_PRUEBAS)
+    with motor.begin() as conexion:
+        conexion.execute(text("""
+            DROP TABLE IF EXISTS
+                public.registros_validacion_caf, public.estudiantes_caf,
+                public.consumo_diario_caf, public.consumidores_mes_caf,
+                public.cambios_tablas_caf, public.schema_migrations_caf,
+                public.registros_validacion_caf_duplicados
+            CASCADE
+        """))
+        for sentencia in DDL:
+            conexion.execute(text(sentencia))
+        conexion.execute(text("""
+            INSERT INTO public.estudiantes_caf VALUES ('A100', 'ANA GÓMEZ', '5', 'COMPLETO')
+        """))
+        # El mismo NO RECLAMO dos veces: lo que dejaban dos workers a la vez
+        conexion.execute(text("""
+            INSERT INTO public.registros_validacion_caf
+                (codigo_estudiante, nombre, tipo_alimentacion, plan, estado, fecha_hora, fecha)
+            VALUES
+                ('A100', 'ANA GÓMEZ', 'COMPLETO', 'SNACK', 'NO RECLAMO', '2026-03-02 10:00', '2026-03-02'),
+                ('A100', 'ANA GÓMEZ', 'COMPLETO', 'SNACK', 'NO RECLAMO', '2026-03-02 10:00', '2026-03-02')
+        """))
+    yield motor
+    motor.dispose()
+
+
+@con_postgres
+def test_duplicados_no_frenan_las_demas_migraciones(motor_con_duplicados):
+    motor = motor_con_duplicados
+
+    schema.aplicar_migraciones(bind=motor)
+
+    with motor.connect() as conexion:
+        aplicadas = set(conexion.execute(text("SELECT version FROM public.schema_migrations_caf")).scalars())
+        filas = conexion.execute(text("SELECT COUNT(*) FROM public.registros_validacion_caf")).scalar()
+    automaticas = {m["version"] for m in schema.MIGRACIONES if not m.get("manual")}
+    assert automaticas <= aplicadas
+    # Nada se borró y el índice único quedó pendiente
+    assert filas == 2
+    assert schema.INDICE_UNICO_REGISTROS in schema.verificar_indices(bind=motor)
+
+    with Session(motor) as db:
+        assert schema.estructura_registros(db) == {"unico": False, "grado": True}
+        class Evento:
+            codigo_estudiante = "A100"
+            plan = "SNACK"
+            fecha_hora = datetime(2026, 3, 2, 9, 45)
+
+        class Otro:
+            codigo_estudiante = "A100"
+            plan = "LUNCH"
+            fecha_hora = datetime(2026, 3, 2, 12, 30)
+
+        resultado = validaciones.registrar_validaciones(db, [Evento, Otro])
+        db.commit()
+
+    assert [r["resultado"] for r in resultado] == ["ACTUALIZADO", "INSERTADO"]
+    with motor.connect() as conexion:
+        grado = conexion.execute(text(
+            "SELECT grado FROM public.registros_validacion_caf WHERE plan = 'LUNCH' AND fecha = :f"
+        ), {"f": date(2026, 3, 2)}).scalar()
+    assert grado == "5"
+
+
+@con_postgres
+def test_depurar_respalda_y_crea_el_indice(motor_con_duplicados):
+    from scripts.depurar_duplicados import TABLA_RESPALDO, crear_indice_unico, depurar, resumen
+
+    motor = motor_con_duplicados
+    schema.aplicar_migraciones(bind=motor)
+
+    with Session(motor) as db:
+        assert resumen(db)["sobrantes"] == 1
+        assert depurar(db) == 1
+        crear_indice_unico(db)
+        db.commit()
+
+    with motor.connect() as conexion:
+        respaldadas = conexion.execute(text(f"SELECT COUNT(*) FROM public.{TABLA_RESPALDO}")).scalar()
+        filas = conexion.execute(text("SELECT COUNT(*) FROM public.registros_validacion_caf")).scalar()
+    assert (respaldadas, filas) == (1, 1)
+    assert schema.INDICE_UNICO_REGISTROS not in schema.verificar_indices(bind=motor)
+
+
+@con_postgres
+def test_version_cambia_solo_al_confirmar_y_sobrevive_la_compactacion(motor_con_duplicados):
+    from core.etag import compactar_versiones, version_recursos
+
+    motor = motor_con_duplicados
+    schema.aplicar_migraciones(bind=motor)
+
+    with Session(motor) as lector:
+        inicial = version_recursos(lector, ("registros",))["registros"]
+        lector.rollback()
+
+        with motor.connect() as escritor:
+            transaccion = escritor.begin()
+            escritor.execute(text("UPDATE public.registros_validacion_caf SET estado = 'VALIDADO' WHERE id = 1"))
+            # Sin COMMIT nadie más ve la versión nueva
+            assert version_recursos(lector, ("registros",))["registros"] == inicial
+            lector.rollback()
+            transaccion.commit()
+
+        assert version_recursos(lector, ("registros",))["registros"] == inicial + 1
+        lector.rollback()
+
+        compactar_versiones(lector)
+        lector.commit()
+        assert version_recursos(lector, ("registros",))["registros"] == inicial + 1
+        filas = lector.execute(text(
+            "SELECT COUNT(*) FROM public.cambios_tablas_caf WHERE tabla = 'registros'"
+        )).scalar()
+        assert filas == 1
+
+
+@con_postgres
+def test_reconstruir_rollup_cuenta_los_registros_sin_fecha_como_el_trigger(motor_con_duplicados):
+    from app.searchs.rollup import reconstruir_consumo_diario
+
+    motor = motor_con_duplicados
+    schema.aplicar_migraciones(bind=motor)
+    dia = date(2026, 3, 3)
+
+    with motor.begin() as conexion:
+        conexion.execute(text("ALTER TABLE public.registros_validacion_caf ALTER COLUMN fecha DROP NOT NULL"))
+        # Sin 'fecha' el trigger cuenta el registro en el día de fecha_hora
+        conexion.execute(text("""
+            INSERT INTO public.registros_validacion_caf
+                (codigo_estudiante, nombre, tipo_alimentacion, plan, estado, fecha_hora, fecha)
+            VALUES ('A100', 'ANA GÓMEZ', 'COMPLETO', 'LUNCH', 'VALIDADO', '2026-03-03 12:30', NULL)
+        """))
+
+    consulta = text("SELECT COALESCE(SUM(total), 0) FROM public.consumo_diario_caf WHERE fecha = :dia")
+    with Session(motor) as db:
+        por_trigger = db.execute(consulta, {"dia": dia}).scalar()
+        reconstruir_consumo_diario(db, dia, dia)
+        db.commit()
+        reconstruido = db.execute(consulta, {"dia": dia}).scalar()
+
+    assert por_trigger == reconstruido == 1
+
+
+def test_versiones_de_migraciones_unicas_y_en_orden():
+    versiones = [m["version"] for m in schema.MIGRACIONES]
+
+    assert versiones == sorted(set(versiones))
+    assert all(m["descripcion"] and m["sql"] for m in schema.MIGRACIONES)
+
+
+def test_cada_indice_requerido_lo_crea_alguna_migracion():
+    sql = "\n".join(sentencia for m in schema.MIGRACIONES for sentencia in m["sql"])
+
+    for _, indice in schema.INDICES_REQUERIDOS:
+        assert f"INDEX IF NOT EXISTS {indice}" in sql or f"INDEX {indice}" in sql, indice
+    assert schema.INDICE_UNICO_REGISTROS in schema.INDICES_REQUERIDOS
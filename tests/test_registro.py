@@ -0,0 +1,55 @@
+from datetime import date, datetime
+
+import pytest
+
+from app.searchs.registro import _filtros_registros, decode_cursor, encode_cursor
+
+
+def test_rango_de_fechas_semiabierto_sobre_fecha_hora():
+    where, params = _filtros_registros(fecha_inicio=date(2026, 3, 1), fecha_fin=date(2026, 3, 31))
+
+    # Sin DATE(...) sobre la columna: el índice de fecha_hora sirve
+    assert "DATE(" not in where
+    assert "rv.fecha_hora >= :fecha_desde AND rv.fecha_hora < :fecha_hasta" in where
+    assert params["fecha_desde"] == datetime(2026, 3, 1, 0, 0)
+    # El último día entra completo: hasta el 1 de abril a las 00:00, excluido
+    assert params["fecha_hasta"] == datetime(2026, 4, 1, 0, 0)
+
+
+def test_rango_sobre_la_llave_de_particion_con_un_dia_de_holgura():
+    where, params = _filtros_registros(fecha_inicio=date(2026, 3, 1), fecha_fin=date(2026, 3, 31))
+
+    assert "rv.fecha BETWEEN :fecha_particion_desde AND :fecha_particion_hasta" in where
+    assert params["fecha_particion_desde"] == date(2026, 2, 28)
+    assert params["fecha_particion_hasta"] == date(2026, 4, 1)
+
+
+def test_sin_las_dos_fechas_no_filtra_por_fecha():
+    where, params = _filtros_registros(fecha_inicio=date(2026, 3, 1))
+
+    assert where == ""
+    assert params == {}
+
+
+def test_todos_no_filtra_plan_ni_estado():
+    where, params = _filtros_registros(plan="TODOS", estado="todos", grado="5")
+
+    assert where == " WHERE e.grado = :grado"
+    assert params == {"grado": "5"}
+
+
+def test_cursor_ida_y_vuelta():
+    fecha_hora = datetime(2026, 3, 2, 12, 30, 15, 250000)
+
+    cursor = encode_cursor(fecha_hora, 4815)
+
+    # Seguro para URL y sin relleno '='
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+    assert decode_cursor(cursor) == (fecha_hora, 4815)
+
+
+@pytest.mark.parametrize("cursor", ["", "no-es-base64!", "eyJmIjoiYXllciJ9", "bnVsbA"])
+def test_cursor_invalido_lanza_value_error(cursor):
+    # "eyJmIjoiYXllciJ9" = {"f":"ayer"} y "bnVsbA" = null
+    with pytest.raises(ValueError, match="Cursor de paginación inválido"):
+        decode_cursor(cursor)
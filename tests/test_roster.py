@@ -0,0 +1,147 @@
+import pytest
+
+from app.searchs.roster import Estudiante, IndiceRoster
+
+
+def _indice(*filas, version=1) -> IndiceRoster:
+    indice = IndiceRoster()
+    indice._estado = IndiceRoster._diferencias(None, _por_codigo(filas), version)
+    return indice
+
+
+def _por_codigo(filas) -> dict:
+    return {fila[0]: Estudiante(*fila) for fila in filas}
+
+
+def _codigos(resultado) -> list:
+    return [e["codigo_estudiante"] for e in resultado]
+
+
+ROSTER = [
+    ("A100", "ANA GÓMEZ", "5", "COMPLETO"),
+    ("A101", "MARIANA LÓPEZ", "5", "COMPLETO"),
+    ("B200", "ANDRÉS PÉREZ", "8", "SOLO ALMUERZO"),
+    ("B201", "JUANA ÁLVAREZ", "8", "COMPLETO"),
+    ("C300", "ANABEL RUIZ", "10", "NINGUNO"),
+    ("C301", "LUCÍA ANAYA", "10", None),
+    ("X1", "ZOE ANA", "3", "REFRIGERIO"),
+]
+
+
+@pytest.fixture
+def indice():
+    return _indice(*ROSTER)
+
+
+def test_codigo_exacto_va_primero_y_solo(indice):
+    # "A10" también es subcadena de A100 y A101, pero el exacto gana
+    assert _codigos(indice.buscar(codigo_estudiante=" A100 ")) == ["A100"]
+
+
+def test_codigo_exacto_respeta_los_filtros(indice):
+    # Exacto sin plan: cae a la búsqueda por subcadena, que tampoco lo admite
+    assert indice.buscar(codigo_estudiante="C300") == []
+    # Exacto con otro grado: cae a subcadena, que filtra por grado
+    assert indice.buscar(codigo_estudiante="A100", grado="8") == []
+
+
+def test_prefijos_antes_que_subcadenas_y_por_nombre(indice):
+    # Como ORDER BY es_prefijo DESC, nombre ASC en buscar_estudiantes
+    assert _codigos(indice.buscar(nombre="ana")) == [
+        "A100",  # ANA GÓMEZ (prefijo)
+        "B201",  # JUANA ÁLVAREZ
+        "A101",  # MARIANA LÓPEZ
+        "X1",    # ZOE ANA
+    ]
+
+
+def test_sin_tildes_ni_mayusculas(indice):
+    assert _codigos(indice.buscar(nombre="Andres")) == ["B200"]
+    assert _codigos(indice.buscar(nombre="ÁLVAREZ")) == ["B201"]
+    assert _codigos(indice.buscar(nombre="gomez")) == ["A100"]
+
+
+def test_nombre_parcial_dentro_de_una_palabra(indice):
+    # Subcadenas en medio de la palabra, resueltas con el mapa de trigramas
+    assert _codigos(indice.buscar(nombre="ariana")) == ["A101"]
+    assert _codigos(indice.buscar(nombre="rez")) == ["B200", "B201"]
+    assert _codigos(indice.buscar(nombre="ana lop")) == ["A101"]
+    assert indice.buscar(nombre="anx") == []
+
+
+def test_indice_de_nombres_coincide_con_el_recorrido_completo(indice):
+    estado = indice._estado
+    for termino in ["ana", "nde", "ez", "lvar", "a", "juana", "zoe", "qqq"]:
+        esperado = {
+            e.codigo_estudiante for e in estado.con_plan
+            if (e.nombre_norm.startswith(termino) if len(termino) < 3 else termino in e.nombre_norm)
+        }
+        assert set(_codigos(indice.buscar(nombre=termino))) == esperado, termino
+
+
+def test_termino_corto_de_nombre_solo_por_prefijo(indice):
+    # Con menos de 3 caracteres no hay trigramas: solo 'term%'
+    assert _codigos(indice.buscar(nombre="an")) == ["A100", "B200"]
+    assert indice.buscar(nombre="ez") == []
+
+
+def test_termino_corto_de_codigo_es_prefijo_sensible_a_mayusculas(indice):
+    # LIKE 'term%' en SQL
+    assert _codigos(indice.buscar(codigo_estudiante="A1")) == ["A100", "A101"]
+    assert indice.buscar(codigo_estudiante="a1") == []
+    assert indice.buscar(codigo_estudiante="00") == []
+
+
+def test_codigo_de_3_o_mas_es_subcadena_sin_mayusculas(indice):
+    # ILIKE '%term%', con los que empiezan por el término primero
+    assert _codigos(indice.buscar(codigo_estudiante="b20")) == ["B200", "B201"]
+    assert _codigos(indice.buscar(codigo_estudiante="200")) == ["B200"]
+
+
+def test_solo_estudiantes_con_plan(indice):
+    # tipo_alimentacion != 'NINGUNO' (NULL tampoco pasa)
+    assert "C300" not in _codigos(indice.buscar(nombre="anabel"))
+    assert _codigos(indice.buscar(nombre="anaya")) == []
+    assert "C300" not in _codigos(indice.buscar())
+    assert "C301" not in _codigos(indice.buscar())
+
+
+def test_filtro_por_grado(indice):
+    assert _codigos(indice.buscar(grado="5")) == ["A100", "A101"]
+    assert _codigos(indice.buscar(nombre="ana", grado="8")) == ["B201"]
+    assert indice.buscar(grado="11") == []
+
+
+def test_limit(indice):
+    assert _codigos(indice.buscar(nombre="ana", limit=2)) == ["A100", "B201"]
+
+
+def test_con_plan_ordenados_por_nombre(indice):
+    assert _codigos(indice.estudiantes_con_plan()) == ["A100", "B200", "B201", "A101", "X1"]
+
+
+def test_diferencias_no_toca_la_foto_anterior():
+    anterior = IndiceRoster._diferencias(None, _por_codigo(ROSTER), 1)
+    nuevos = _por_codigo([
+        ("A100", "ANA GÓMEZ", "6", "COMPLETO"),   # cambió de grado
+        ("A101", "MARIANA LÓPEZ", "5", "COMPLETO"),
+        ("D400", "PEDRO NIETO", "5", "COMPLETO"),  # alta
+    ])
+
+    estado = IndiceRoster._diferencias(anterior, nuevos, 2)
+
+    assert set(estado.por_codigo) == {"A100", "A101", "D400"}
+    assert estado.por_grado["5"] == {"A101", "D400"}
+    assert estado.por_grado["6"] == {"A100"}
+    assert "8" not in estado.por_grado
+    assert estado.tokens["ana"] == {"A100"}
+    assert "juana" not in estado.tokens
+    # Los trigramas siguen a las palabras que entran y salen
+    assert "uan" not in estado.trigramas
+    assert estado.trigramas["nie"] == {"nieto"}
+    assert "uan" in anterior.trigramas
+    # El que no cambió es el mismo objeto (solo se aplican diferencias)
+    assert estado.por_codigo["A101"] is anterior.por_codigo["A101"]
+    # La foto anterior sigue intacta para los lectores en curso
+    assert len(anterior.por_codigo) == len(ROSTER)
+    assert anterior.por_grado["5"] == {"A100", "A101"}
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+from pydantic import ValidationError
+
+from app.schemas.registro import MAX_EVENTOS_LOTE, EventoValidacion, LoteValidaciones
+
+
+def _evento(**cambios) -> dict:
+    return {"codigo_estudiante": "A100", "plan": "SNACK", "fecha_hora": "2026-03-02T09:45:00", **cambios}
+
+
+def test_evento_limpia_codigo_y_plan():
+    evento = EventoValidacion(**_evento(codigo_estudiante="  A100 ", plan=" lunch"))
+
+    assert evento.codigo_estudiante == "A100"
+    assert evento.plan == "LUNCH"
+
+
+def test_evento_con_zona_horaria_pasa_a_hora_local_sin_zona():
+    # 17:30 UTC son las 12:30 en Bogotá; sin zona se toma como hora local
+    assert EventoValidacion(**_evento(fecha_hora="2026-03-02T17:30:00Z")).fecha_hora == datetime(2026, 3, 2, 12, 30)
+    assert EventoValidacion(**_evento()).fecha_hora == datetime(2026, 3, 2, 9, 45)
+
+
+@pytest.mark.parametrize("cambios", [
+    {"codigo_estudiante": ""},
+    {"codigo_estudiante": "   "},
+    {"plan": "CENA"},
+    {"fecha_hora": "ayer"},
+])
+def test_evento_invalido(cambios):
+    with pytest.raises(ValidationError):
+        EventoValidacion(**_evento(**cambios))
+
+
+def test_lote_entre_1_y_el_maximo():
+    assert len(LoteValidaciones(eventos=[_evento()] * MAX_EVENTOS_LOTE).eventos) == MAX_EVENTOS_LOTE
+
+    with pytest.raises(ValidationError):
+        LoteValidaciones(eventos=[])
+    with pytest.raises(ValidationError):
+        LoteValidaciones(eventos=[_evento()] * (MAX_EVENTOS_LOTE + 1))
@@ -0,0 +1,62 @@
+from datetime import datetime
+from io import BytesIO
+
+import openpyxl
+
+from app.exports.xlsx import ENCABEZADOS_REGISTROS, fila_registro, generar_xlsx
+
+
+def _abrir(bloques):
+    return openpyxl.load_workbook(BytesIO(b"".join(bloques)))
+
+
+def test_se_abre_en_openpyxl_con_encabezados_y_filas():
+    registros = [
+        {
+            "id": 1, "codigo_estudiante": "A100", "nombre": "ANA GÓMEZ", "grado": "5",
+            "tipo_alimentacion": "COMPLETO", "fecha_hora": datetime(2026, 3, 2, 9, 30),
+            "plan": "SNACK", "estado": "VALIDADO"
+        },
+        {
+            "id": 2, "codigo_estudiante": "B200", "nombre": "ANDRÉS <PÉREZ> & Cía",
+            "tipo_alimentacion": "COMPLETO", "fecha_hora": None,
+            "plan": "LUNCH", "estado": "NO RECLAMO"
+        },
+    ]
+    lotes = [[fila_registro(registros[0])], [fila_registro(registros[1])]]
+
+    libro = _abrir(generar_xlsx("Registros Filtrados", ENCABEZADOS_REGISTROS, lotes))
+    hoja = libro.active
+
+    assert hoja.title == "Registros Filtrados"
+    filas = list(hoja.iter_rows(values_only=True))
+    assert list(filas[0]) == ENCABEZADOS_REGISTROS
+    assert list(filas[1]) == [1, "A100", "ANA GÓMEZ", "5", "COMPLETO", "2026-03-02 09:30:00", "SNACK", "VALIDADO"]
+    # Texto con caracteres de XML escapado; sin grado ni fecha quedan vacíos
+    assert filas[2][2] == "ANDRÉS <PÉREZ> & Cía"
+    assert filas[2][3] in (None, "")
+    assert filas[2][5] in (None, "")
+    assert len(filas) == 3
+
+
+def test_tipos_de_celda_y_caracteres_de_control():
+    lotes = [[[True, 3, 2.5, None, "a\x00b\x1fc"]]]
+
+    hoja = _abrir(generar_xlsx("Tipos", ["b", "i", "f", "n", "s"], lotes)).active
+
+    assert list(hoja.iter_rows(min_row=2, values_only=True))[0] == (True, 3, 2.5, None, "abc")
+
+
+def test_titulo_invalido_se_limpia_y_recorta():
+    hoja = _abrir(generar_xlsx("Reporte: [marzo/abril] " + "x" * 40, ["a"], [])).active
+
+    assert hoja.title == ("Reporte marzoabril " + "x" * 40)[:31]
+
+
+def test_sin_filas_y_muchos_lotes():
+    assert list(_abrir(generar_xlsx("Vacio", ["a", "b"], [])).active.iter_rows(values_only=True)) == [("a", "b")]
+
+    lotes = ([[n, f"fila {n}"] for n in range(inicio, inicio + 500)] for inicio in range(0, 5000, 500))
+    filas = list(_abrir(generar_xlsx("Grande", ["n", "texto"], lotes)).active.iter_rows(values_only=True))
+    assert len(filas) == 5001
+    assert filas[-1] == (4999, "fila 4999")